@@ -1,7 +1,14 @@
 import os
 from flask_cors import CORS
-from flask import Flask
+import time
+from flask import Flask, jsonify, request, g, session, got_request_exception
+from config.settings import Settings
 from config.config import Config
+from util.UnitOfWork import UnitOfWork
+from util.DatabaseConnection import DBConnector
+from util.Metrics import request_metrics
+from controller.Auth import load_current_user
+from controller.Idempotency import release_idempotency_key
 from werkzeug.utils import secure_filename
 
 UPLOAD_FOLDER = 'static/img'
@@ -16,3 +23,78 @@ CORS(app) # allow cors request, otherwise I cannot access any non-static request
 app.config['SECRET_KEY'] = Config.AppSecretKey  
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+# request count / latency / in flight per route for /metrics
+# registered first so its after_request runs last and sees the final status code
+@app.before_request
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g.metrics_start = time.perf_counter()
+    request_metrics.start(request.method, g.metrics_route)
+
+@app.after_request
+def record_request_metrics(response):
+    if "metrics_start" in g:
+        request_metrics.finish(request.method, g.pop("metrics_route"), response.status_code,
+                               time.perf_counter() - g.pop("metrics_start"))
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    # the request failed before after_request ran, still count it and leave the in flight gauge right
+    if "metrics_start" in g:
+        request_metrics.finish(request.method, g.pop("metrics_route"), 500, time.perf_counter() - g.pop("metrics_start"))
+
+# verify the session JWT once per request (claims are cached) and load the identity in g.user
+app.before_request(load_current_user)
+
+# let duplicates of an Idempotency-Key request go once it is done
+# (registered before the unit of work hooks: teardown functions run in reverse, so this runs after the release)
+app.teardown_request(release_idempotency_key)
+
+# every request is one unit of work: DAO calls share one pooled connection (taken on first use)
+# and one transaction, committed after the view returned and released on teardown.
+# after_request also runs for a view that raised (Flask turns it into a 500), so a request that raised
+# or answers 5xx is rolled back instead
+@app.before_request
+def begin_unit_of_work():
+    UnitOfWork.begin_request()
+
+@got_request_exception.connect_via(app)
+def mark_request_failed(sender, exception, **extra):
+    g.request_failed = True
+
+@app.after_request
+def commit_unit_of_work(response):
+    failed = g.pop('request_failed', False)
+    if UnitOfWork.request_pool_exhausted():
+        # the pool wait queue was full or the wait timed out: whatever the view made of the failed DAO call,
+        # tell the client to come back instead of reporting a bogus failure. No connection is bound, nothing to commit
+        response = jsonify({"success": False, "message": "Server is busy, please try again later."})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+    elif failed or response.status_code >= 500:
+        UnitOfWork.rollback_request()
+    elif not UnitOfWork.commit_request():
+        response = jsonify({"success": False, "message": "Failed to commit changes."})
+        response.status_code = 500
+    return response
+
+@app.teardown_request
+def release_unit_of_work(exc):
+    UnitOfWork.end_request(exc)
+
+# read your own writes with replicas: a POST / PUT / DELETE reads from the primary and its time is kept in the
+# session, the user's reads stay on the primary for REPLICA_STICKY_SECONDS after it (the session cookie works
+# across workers). Other reads of read_only DAO methods may go to a replica
+@app.before_request
+def route_reads():
+    writing = request.method not in ('GET', 'HEAD')
+    recently_wrote = time.time() - session.get('last_write', 0) < Settings.ReplicaStickySeconds
+    DBConnector.read_from_primary.set(writing or recently_wrote)
+
+@app.after_request
+def remember_write(response):
+    if DBConnector.has_replicas() and request.method not in ('GET', 'HEAD') and g.get('user') is not None:
+        session['last_write'] = time.time()
+    return response
@@ -0,0 +1,80 @@
+import os
+
+
+def _env(name, default, cast=str):
+    # read a setting from the environment, fall back to the default if it is not set
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    if cast is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return cast(value)
+
+
+class Settings:
+    # tunable, non secret settings, every value can be overridden by the environment variable read next to it
+
+    # product cache in ProductDAO
+    ProductCacheTTL = _env("PRODUCT_CACHE_TTL", 30.0, float)  # seconds an entry is fresh
+    ProductCacheStaleTTL = _env("PRODUCT_CACHE_STALE_TTL", 30.0, float)  # seconds an expired entry can still be served while it reloads, 0 turns it off
+    ProductCacheMaxSize = _env("PRODUCT_CACHE_MAX_SIZE", 10000, int)
+
+    # verified JWT claims cached in UserService, an entry expires with its token
+    TokenCacheMaxSize = _env("TOKEN_CACHE_MAX_SIZE", 10000, int)
+
+    # database connection pool, None means use the "pool" section of db_connection.json or the default
+    DBPoolSize = _env("DB_POOL_SIZE", None, int)
+    DBPoolMaxOverflow = _env("DB_POOL_MAX_OVERFLOW", None, int)  # extra connections opened under bursts
+    DBPoolTimeout = _env("DB_POOL_TIMEOUT", None, float)  # seconds to wait for a free connection
+    DBPoolMaxLifetime = _env("DB_POOL_MAX_LIFETIME", None, float)  # seconds before a connection is replaced
+    DBPoolMaxWaiters = _env("DB_POOL_MAX_WAITERS", None, int)  # callers allowed to wait at the same time
+    DBPoolValidateAfterIdle = _env("DB_POOL_VALIDATE_AFTER_IDLE", None, float)  # idle seconds after which a connection is pinged on checkout
+
+    # read replicas ("replicas" in db_connection.json), see util/ReplicaSet.py
+    ReplicaMaxLag = _env("REPLICA_MAX_LAG", 2.0, float)  # seconds behind the primary before a replica is skipped
+    ReplicaCheckInterval = _env("REPLICA_CHECK_INTERVAL", 5.0, float)  # seconds between lag checks of a replica
+    ReplicaStickySeconds = _env("REPLICA_STICKY_SECONDS", 5.0, float)  # a user reads from the primary this long after a write
+
+    # token bucket per user and route class, see util/RateLimiter.py. A rate of 0 turns the limit off
+    RateLimitReadRate = _env("RATE_LIMIT_READ_RATE", 10.0, float)  # GET requests per second and user
+    RateLimitReadBurst = _env("RATE_LIMIT_READ_BURST", 30.0, float)  # requests allowed at once after a quiet period
+    RateLimitWriteRate = _env("RATE_LIMIT_WRITE_RATE", 2.0, float)  # POST / PUT / DELETE requests per second and user
+    RateLimitWriteBurst = _env("RATE_LIMIT_WRITE_BURST", 10.0, float)
+    RateLimitAdminRate = _env("RATE_LIMIT_ADMIN_RATE", 0.5, float)  # admin requests per second and user
+    RateLimitAdminBurst = _env("RATE_LIMIT_ADMIN_BURST", 5.0, float)
+    RateLimitMaxUsers = _env("RATE_LIMIT_MAX_USERS", 10000, int)  # buckets kept, least recently used ones are dropped
+
+    # /metrics is only answered to these addresses / networks (comma separated), e.g. "10.0.0.0/8,127.0.0.1"
+    MetricsAllowedNetworks = _env("METRICS_ALLOWED_NETWORKS", "127.0.0.1/32,::1/128")
+
+    # query timing, see util/QueryLog.py
+    SlowQueryThreshold = _env("SLOW_QUERY_THRESHOLD", 0.2, float)  # seconds, slower statements are written to mysql.log
+    QueryStatsMaxStatements = _env("QUERY_STATS_MAX_STATEMENTS", 500, int)  # distinct statements with their own histogram
+
+    # password hashing, see util/PasswordHasher.py
+    BcryptRounds = _env("BCRYPT_ROUNDS", 12, int)  # cost of new hashes, stored hashes with another cost are rehashed on login
+    BcryptWorkers = _env("BCRYPT_WORKERS", 2, int)  # hashing processes, 0 hashes on the request thread
+    BcryptMaxPending = _env("BCRYPT_MAX_PENDING", 8, int)  # hash / check jobs admitted at the same time
+    BcryptAdmissionTimeout = _env("BCRYPT_ADMISSION_TIMEOUT", 0.5, float)  # seconds to wait for a place before answering 503
+
+    # queued purchase mode, see service/PurchaseQueue.py
+    PurchaseQueueEnabled = _env("PURCHASE_QUEUE_ENABLED", False, bool)  # group commit purchases of the same product
+    PurchaseWorkers = _env("PURCHASE_WORKERS", 4, int)  # threads applying batches, each holds one pooled connection
+    PurchaseBatchSize = _env("PURCHASE_BATCH_SIZE", 50, int)  # purchases of one product applied in one transaction
+    PurchaseQueueMaxSize = _env("PURCHASE_QUEUE_MAX_SIZE", 5000, int)  # queued purchases before new ones get 503
+    PurchaseTimeout = _env("PURCHASE_TIMEOUT", 10, float)  # seconds a request waits for its queued purchase
+
+    # Idempotency-Key on /purchase and the deposit routes, see controller/Idempotency.py
+    IdempotencyKeyTTL = _env("IDEMPOTENCY_KEY_TTL", 86400.0, float)  # seconds a response is replayed from memory
+    IdempotencyCacheMaxSize = _env("IDEMPOTENCY_CACHE_MAX_SIZE", 10000, int)  # responses kept in memory
+    IdempotencyWaitTimeout = _env("IDEMPOTENCY_WAIT_TIMEOUT", 10.0, float)  # seconds a duplicate waits for the first request
+
+    # product images, see service/ImageService.py
+    ImageWorkers = _env("IMAGE_WORKERS", 2, int)  # threads decoding and resizing uploaded images
+
+    # logging, see log/log.py
+    LogLevel = _env("LOG_LEVEL", "INFO")  # default level of every logger
+    LogLevels = _env("LOG_LEVELS", "")  # per logger levels, e.g. "dao=WARNING,util.DatabaseConnection=ERROR"
+    LogSampleRate = _env("LOG_SAMPLE_RATE", 100, int)  # write 1 in N of the high volume messages
+    LogQueueSize = _env("LOG_QUEUE_SIZE", 10000, int)  # records waiting for the writer thread before new ones are dropped
+    LogExternalRotation = _env("LOG_EXTERNAL_ROTATION", False, bool)  # logrotate rotates the files, not the app (several processes)
@@ -0,0 +1,47 @@
+import math
+from functools import wraps
+from flask import g, request, session, jsonify, redirect, url_for
+from service.UserService import UserService
+from util.RateLimiter import rate_limiter
+
+
+def load_current_user():
+    # before every request: verify the session token (cached, see UserService.verify_token) and put its identity
+    # in g.user, None when there is no token or it is invalid / expired
+    token = session.get('token')
+    g.user = UserService.verify_token(token)
+    if token and g.user is None:
+        session.clear()  # expired or forged, the user has to log in again
+
+
+def login_required(redirect_to_index=False, rate_class=None):
+    # views behind it can use g.user; anonymous callers get 401, or go back to the home page for page routes
+    # every call takes a token from the user's bucket of rate_class (default "read" for GET, "write" otherwise),
+    # a user out of tokens gets 429 with Retry-After, see util/RateLimiter.py
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.get('user') is None:
+                if redirect_to_index:
+                    return redirect(url_for('index'))
+                return jsonify({"success": False, "message": "Unauthorized access."}), 401
+            route_class = rate_class or ("read" if request.method in ('GET', 'HEAD') else "write")
+            wait = rate_limiter.acquire(route_class, g.user['user_id'])
+            if wait > 0:
+                return jsonify({"success": False, "message": "Too many requests, please slow down."}), 429, \
+                    {'Retry-After': str(math.ceil(wait))}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def admin_required(redirect_to_index=False, message="Only admin users can perform this action."):
+    # login_required plus 403 for users that are not admin, admin routes have their own rate limit
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.user['role'] != 'admin':
+                return jsonify({"success": False, "message": message}), 403
+            return view(*args, **kwargs)
+        return login_required(redirect_to_index, rate_class="admin")(wrapper)
+    return decorator
@@ -1,18 +1,60 @@
-import os
-from flask import render_template, jsonify, request, redirect, url_for, session
+import itertools
+from flask import render_template, jsonify, request, redirect, url_for, session, stream_with_context, Response, g, send_from_directory
 from app import app
 from service.UserService import UserService
 from service.ProductService import ProductService
 from service.OrderService import OrderService
-from werkzeug.utils import secure_filename
+from service.MetricsService import MetricsService
+from service.ImageService import ImageService
+from controller.Auth import login_required, admin_required
+from controller.Idempotency import idempotent
+from config.settings import Settings
+from util.ConnectionPool import PoolTimeoutError
 from log.log import get_logger
 
 logger = get_logger(__name__)
 
+STREAM_BATCH_SIZE = 500  # items serialized per chunk of a streamed response
+
+
+def stream_items(key, items):
+    # stream a possibly huge list without building it in memory
+    # default: the same {"success": true, key: [...]} document jsonify would return, sent in chunks
+    # ?format=ndjson: one JSON object per line
+    # the first item is fetched before the response starts, so a failed query still gets a proper status
+    # (once streaming started, an error can only cut the body short)
+    ndjson = request.args.get('format') == 'ndjson'
+    items = iter(items)
+    try:
+        head = list(itertools.islice(items, 1))
+    except PoolTimeoutError:
+        return jsonify({"success": False, "message": "Server is busy, please try again later."}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        logger.error("Failed to stream %s: %s", key, e)
+        return jsonify({"success": False, "message": f"Failed to fetch {key}."}), 500
+
+    def generate():
+        batch = []
+        first = True
+        if not ndjson:
+            yield '{"success":true,"%s":[' % key
+        for item in itertools.chain(head, items):
+            batch.append(app.json.dumps(item))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield ("\n".join(batch) + "\n") if ndjson else (("" if first else ",") + ",".join(batch))
+                batch, first = [], False
+        if batch:
+            yield ("\n".join(batch) + "\n") if ndjson else (("" if first else ",") + ",".join(batch))
+        if not ndjson:
+            yield ']}'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype)
+
 @app.route('/')
 def index():
     # Redirect to welcome page if user is already logged in
-    if 'token' in session:
+    if g.user is not None:
         return redirect(url_for('welcome'))
     return render_template('index.html')  # Render home page for unauthenticated users
 
@@ -21,8 +63,10 @@ def register():
     data = request.json
     if not data or 'username' not in data or 'password' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
-    logger.info(f"Request received at '/register' with data: {data}")
+    logger.info("Request received at '/register' with data: %s", data)
     result = UserService.register_user(data['username'], data['password'])
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
     return jsonify(result)
 
 @app.route('/login', methods=['POST'])
@@ -31,85 +75,89 @@ def login():
     if not data or 'username' not in data or 'password' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
 
-    logger.info(f"Request received at '/login' with data: {data}")
+    logger.info("Request received at '/login' with data: %s", data)
     result = UserService.login_user(data['username'], data['password'])
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
     if result['success']:
-        session['token'] = result['token']  # Store JWT token in session
-        session['user_id'] = result['payload']['user_id']
-        session['username'] = result['payload']['username']  # Store username in session
-        session['role'] = result['payload']['role']
-        session['exp'] = result['payload']['exp']
-        logger.info(f"User {session['user_id']} : {session['username']} : {session['role']} logged in.")
+        # only the JWT goes in the session, every request verifies it and loads the identity in g.user (controller/Auth.py)
+        session['token'] = result['token']
+        payload = result['payload']
+        logger.info("User %s : %s : %s logged in.", payload['user_id'], payload['username'], payload['role'])
         return redirect(url_for('welcome'))  # Redirect to welcome page on success
     return jsonify(result)
 
 @app.route('/welcome')
+@login_required(redirect_to_index=True)
 def welcome():
-    # Redirect to home page if user is not logged in
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    return render_template('welcome.html', username=session.get('username'))
+    return render_template('welcome.html', username=g.user['username'])
 
 @app.route('/order_history')
+@login_required(redirect_to_index=True)
 def order_history():
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    return render_template('order_history.html', username=session.get('username'))
+    return render_template('order_history.html', username=g.user['username'])
 
 """
 User Related API
 """
 
 @app.route('/user/username', methods=['GET'])
+@login_required(redirect_to_index=True)
 def get_current_username():
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    return jsonify({"username": session['username']})
+    return jsonify({"username": g.user['username']})
 
 @app.route('/user/deposit', methods=['GET'])
+@login_required()
 def get_current_deposit():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401 
-    result = UserService.get_current_deposit_by_id(session["user_id"])
+    result = UserService.get_current_deposit_by_id(g.user['user_id'])
     
     if not result["success"]:
         return jsonify({"success": False, "message": result["message"], "deposit": 0.00}), 404
     return jsonify({"success": True, "deposit": result["deposit"]}), 200
 
+@app.route('/bootstrap', methods=['GET'])
+@login_required()
+def bootstrap_welcome_page():
+    # everything the welcome page needs on load in one round trip: username, deposit and the first product page
+    # query string: limit (product page size)
+    deposit = UserService.get_current_deposit_by_id(g.user['user_id'])
+    if not deposit["success"]:
+        return jsonify({"success": False, "message": deposit["message"]}), 404
+    page = ProductService.get_products_page(limit=request.args.get('limit'))
+    if not page["success"]:
+        return jsonify(page), 400
+    return jsonify({
+        "success": True,
+        "username": g.user['username'],
+        "role": g.user['role'],
+        "deposit": deposit["deposit"],
+        "products": page["products"],
+        "next_cursor": page["next_cursor"],
+    })
 
 @app.route('/admin', methods=['GET'])
+@admin_required(message="You are not admin user. You cannot access this page.")
 def admin_page():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "You are not admin user. You cannot access this page."}), 403
     return render_template('admin.html')
 
 @app.route('/logout', methods=['GET'])
 def logout():
-    logger.info(f"User {session['user_id']} : {session['username']} : {session['role']} logged out.")
+    if g.user is not None:
+        logger.info("User %s : %s : %s logged out.", g.user['user_id'], g.user['username'], g.user['role'])
     session.clear()  # Clear all session data
     return jsonify({"success": True, "message": "Logged out successfully."})
 
 @app.route('/users', methods=['GET'])
+@admin_required()
 def get_all_users():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
-    logger.info(f"Request received at '/users to query all users. With current user {session['user_id']} : {session['username']}'")
-    result = UserService.get_all_users()
-    return jsonify(result)
+    logger.info("Request received at '/users to query all users. With current user %s : %s'", g.user['user_id'], g.user['username'])
+    return stream_items("users", UserService.iter_all_users())
 
 @app.route('/user', methods=['DELETE'])
+@admin_required()
 def delete_user_by_id():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
-
     data = request.json
-    logger.info(f"Request received at '/user to delete user with data : {data}'")
+    logger.info("Request received at '/user to delete user with data : %s'", data)
     if not data or 'user_id' not in data:
         return jsonify({"success": False, "message": "User ID is required."}), 400
 
@@ -117,14 +165,10 @@ def delete_user_by_id():
     return jsonify(result)
 
 @app.route('/user/role', methods=['PUT'])
+@admin_required()
 def update_role_by_id():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
-
     data = request.json
-    logger.info(f"Request received at '/users to update a user with data : {data}'")
+    logger.info("Request received at '/users to update a user with data : %s'", data)
     if not data or 'user_id' not in data or 'role' not in data:
         return jsonify({"success": False, "message": "User ID and new role are required."}), 400
 
@@ -132,42 +176,69 @@ def update_role_by_id():
     return jsonify(result)
 
 @app.route('/user/adddeposite', methods=['PUT'])
+@login_required()
+@idempotent()
 def add_deposit_to_current_user():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    
     data = request.json
-    logger.info(f"Request received at '/adddeposit to add deposit to current user : {session['username']} {data}'")
+    logger.info("Request received at '/adddeposit to add deposit to current user : %s %s'", g.user['username'], data)
     if not data or 'amount' not in data:
         return jsonify({"success": False, "message": "Deposit add amount are required."}), 400
     
-    result = UserService.add_money_to_deposit_by_id(session['user_id'], data['amount'])
+    result = UserService.add_money_to_deposit_by_id(g.user['user_id'], data['amount'])
     return jsonify(result), (200 if result["success"] else 400)
 
 @app.route('/user/minusdeposite', methods=['PUT'])
+@login_required()
+@idempotent()
 def minus_deposit_to_current_user():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-    
     data = request.json
-    logger.info(f"Request received at '/minusdeposit to minus deposit to current user : {session['username']} {data}'")
+    logger.info("Request received at '/minusdeposit to minus deposit to current user : %s %s'", g.user['username'], data)
     if not data or 'amount' not in data:
         return jsonify({"success": False, "message": "Deposit minus amount are required."}), 400
     
-    result = UserService.minus_money_to_deposit_by_id(session['user_id'], data['amount'])
+    result = UserService.minus_money_to_deposit_by_id(g.user['user_id'], data['amount'])
     return jsonify(result), (200 if result["success"] else 400)
 """
 Product related API
 """
+PRODUCT_PAGE_ARGS = ('limit', 'cursor', 'category', 'min_price', 'max_price', 'in_stock', 'sort')
 
 @app.route('/products', methods=['GET'])
+@login_required(redirect_to_index=True)
 def get_all_products():
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    products = ProductService.get_all_products()
-    return jsonify(products), 200
+    # any paging / filtering parameter -> server side page, see ProductService.get_products_page
+    # query string: limit, cursor, category, min_price, max_price, in_stock (true/false), sort (id, price_asc, price_desc)
+    if any(arg in request.args for arg in PRODUCT_PAGE_ARGS):
+        result = ProductService.get_products_page(
+            limit=request.args.get('limit'),
+            cursor=request.args.get('cursor'),
+            category=request.args.get('category'),
+            min_price=request.args.get('min_price'),
+            max_price=request.args.get('max_price'),
+            in_stock=request.args.get('in_stock', 'false').lower() in ('1', 'true', 'yes'),
+            sort=request.args.get('sort', 'id')
+        )
+        return jsonify(result), (200 if result["success"] else 400)
+
+    # pre-serialized catalog with a strong etag, clients sending If-None-Match get 304 while nothing changed
+    body, etag = ProductService.get_all_products_serialized()
+    if etag is None:
+        return app.response_class(body, status=500, mimetype='application/json')
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'  # always revalidate, the etag makes it cheap
+    return response.make_conditional(request)
+
+@app.route('/img/<path:filename>', methods=['GET'])
+def product_image(filename):
+    # built product images (see ImageService), named by content hash so they can be cached forever
+    response = send_from_directory(ImageService.BUILD_DIR, filename, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/product', methods=['PUT'])
+@admin_required(redirect_to_index=True)
 def add_product():
     # add a new product
     # the request.json should include:
@@ -176,20 +247,16 @@ def add_product():
     #   product inventory
     #   product category (can be empty)
     #   product description (can be empty) 
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
     
     # function to check if file uploaded allowed
     def allowed_file(filename):
-        ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+        ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
     
     data = request.form  # take product info
     file = request.files.get('image')  # product image info
 
-    logger.info(f"Request received at '/product to add new product : {session['username']} : {data}'")
+    logger.info("Request received at '/product to add new product : %s : %s'", g.user['username'], data)
     if not data or 'name' not in data or 'price' not in data or 'inventory' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
 
@@ -200,53 +267,43 @@ def add_product():
         'category': data.get('category', ''),
         'description': data.get('description', '')
     }
-    result = ProductService.add_product(product_data)   # add the product info to database
-    
-    if result["success"] and file and allowed_file(file.filename):
-        filename = secure_filename(f"{data['name']}.jpg") 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-    
+    # the image is checked, deduplicated and resized in the background (ImageService), no need to wait for it
+    image = file.read() if file and allowed_file(file.filename) else None
+    result = ProductService.add_product(product_data, image)   # add the product info to database
+
     return jsonify(result), (201 if result["success"] else 500)
 
 @app.route('/product/inventory', methods=['PUT'])
+@login_required(redirect_to_index=True)
 def update_product_inventory():
-    if 'token' not in session:
-        return redirect(url_for('index'))
     # update product inventory
     # the request.json should include product_id, product_change_amount(int, + or -)
     data = request.json
-    logger.info(f"Request received at '/product/inventory to change product inventory : {session['username']} {data}'")
+    logger.info("Request received at '/product/inventory to change product inventory : %s %s'", g.user['username'], data)
     if not data or 'product_id' not in data or 'change_amount' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
     result = ProductService.update_inventory_by_id(data['product_id'], data['change_amount'])
     return jsonify(result), (200 if result["success"] else 500)
 
 @app.route('/product/price', methods=['PUT'])
+@admin_required(redirect_to_index=True)
 def update_product_price():
     # update product price
     # the request.json should include product_id, product_new_price(int)
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
     data = request.json
-    logger.info(f"Request received at '/product/price to change product price : {session['username']} {data}'")
+    logger.info("Request received at '/product/price to change product price : %s %s'", g.user['username'], data)
     if not data or 'product_id' not in data or 'new_price' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
     result = ProductService.update_price_by_id(data['product_id'], data['new_price'])
     return jsonify(result), (200 if result["success"] else 500)
 
 @app.route('/product', methods=['DELETE'])
+@admin_required(redirect_to_index=True)
 def delete_product_by_id():
     # delete product
     # the request.json should include product_id
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
     data = request.json
-    logger.info(f"Request received at '/product to delete a product : {session['username']} {data}'")
+    logger.info("Request received at '/product to delete a product : %s %s'", g.user['username'], data)
     if not data or 'product_id' not in data:
         return jsonify({"success": False, "message": "Invalid input."}), 400
     result = ProductService.delete_product_by_id(data['product_id'])
@@ -257,46 +314,81 @@ def delete_product_by_id():
 Orders related
 """
 @app.route('/orders', methods=['GET'])
+@admin_required(redirect_to_index=True)
 def get_all_orders():
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    if session['role'] != 'admin':
-        return jsonify({"success": False, "message": "Only admin users can perform this action."}), 403
-    logger.info(f"Request received at '/orders to retrieve all orders : {session['username']}'")
-    result = OrderService.get_all_orders()
-    return jsonify(result), (200 if result["success"] else 500)
+    logger.info("Request received at '/orders to retrieve all orders : %s'", g.user['username'])
+    return stream_items("orders", OrderService.iter_all_orders())
 
 @app.route('/user/orders', methods=['GET'])
+@login_required(redirect_to_index=True)
 def get_current_user_orders():
     # this method only works for current user
-    if 'token' not in session:
-        return redirect(url_for('index'))
-    logger.info(f"Request received at '/user/orders to retrieve all orders for current user: {session['username']}'")
-    result = OrderService.get_order_by_user_id(session['user_id'])
-    return jsonify(result), (200 if result["success"] else 500)
+    # newest first, paginated. query string: limit, cursor (next_cursor of the previous page), start_date, end_date
+    logger.info("Request received at '/user/orders to retrieve orders for current user: %s %s'", g.user['username'], request.args.to_dict())
+    result = OrderService.get_orders_page_by_user_id(
+        g.user['user_id'],
+        limit=request.args.get('limit'),
+        cursor=request.args.get('cursor'),
+        start_date=request.args.get('start_date'),
+        end_date=request.args.get('end_date')
+    )
+    return jsonify(result), (200 if result["success"] else 400)
 
 """
 Purchase
 """
 @app.route('/purchase', methods=['POST'])
+@login_required()
+@idempotent(claimed_by_view=lambda: Settings.PurchaseQueueEnabled)
 def purchase_product():
-    if 'token' not in session:
-        return jsonify({"success": False, "message": "Unauthorized access."}), 401
-
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({"success": False, "message": "User ID not found in session."}), 400
+    user_id = g.user['user_id']
 
     data = request.json
-    logger.info(f"Request received at '/purchase to make a purchase : {session['username']} {data}'")
+    logger.info("Request received at '/purchase to make a purchase : %s %s'", g.user['username'], data)
     if not data or 'product_id' not in data or 'quantity' not in data:
         return jsonify({"success": False, "message": "Product ID and quantity are required."}), 400
 
     product_id = data.get('product_id')
     quantity = data.get('quantity')
 
+    # queued mode with an Idempotency-Key: the key is saved with the purchase, the response is rendered there
+    idempotency = g.get('idempotency')
+    if idempotency is not None:
+        idempotency["render"] = lambda result: (200 if result["success"] else 400, app.json.dumps(result))
+
+    try:
+        result = OrderService.create_order(user_id, product_id, quantity, idempotency=idempotency)
+        if result.get('busy'):
+            return jsonify(result), 503, {'Retry-After': '1'}
+        if result.get('duplicate'):
+            return jsonify(result), 409, {'Retry-After': '1'}
+        return jsonify(result), (200 if result["success"] else 400)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+@app.route('/checkout', methods=['POST'])
+@login_required()
+def checkout_cart():
+    # buy several products at once
+    # the request.json should include items: [{"product_id": int, "quantity": int}, ...]
+    user_id = g.user['user_id']
+
+    data = request.json
+    logger.info("Request received at '/checkout to checkout a cart : %s %s'", g.user['username'], data)
+    if not data or not isinstance(data.get('items'), list):
+        return jsonify({"success": False, "message": "Cart items are required."}), 400
+
     try:
-        result = OrderService.create_order(user_id, product_id, quantity)
+        result = OrderService.checkout(user_id, data['items'])
         return jsonify(result), (200 if result["success"] else 400)
     except Exception as e:
-        return jsonify({"success": False, "message": f"An unexpected error occurred: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"success": False, "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape endpoint: per route requests / latency / in flight, connection pool, queries and caches
+    # routes, users and table sizes are not for everybody, only the scraper's networks get them
+    if not MetricsService.is_allowed(request.remote_addr):
+        logger.warning("Refused /metrics to %s.", request.remote_addr)
+        return jsonify({"success": False, "message": "Forbidden."}), 403
+    return Response(MetricsService.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,113 @@
+import hashlib
+from functools import wraps
+from flask import g, request, jsonify, make_response, Response
+from config.settings import Settings
+from dao.IdempotencyDAO import IdempotencyDAO
+from util.DatabaseConnection import DBConnector
+from util.Idempotency import idempotency_store, IdempotencyTimeoutError
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+MAX_KEY_LENGTH = 64
+
+
+def idempotent(claimed_by_view=None):
+    # goes under login_required. A request with an Idempotency-Key header runs once per user and key,
+    # a retry gets the first response back (with Idempotent-Replayed: true) without running the view again:
+    # from memory if this process answered it, from the idempotency_keys table otherwise.
+    # A duplicate arriving while the first request runs waits for it. 5xx responses are not kept.
+    # claimed_by_view: callable, True when the view saves the key itself in the transaction that applies the
+    # request instead of the request unit of work (queued purchases, see OrderDAO.purchase_batch); it gets
+    # g.idempotency and sets "saved" once the key and its response are committed.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return jsonify({"success": False, "message": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters."}), 400
+
+            user_id = g.user['user_id']
+            store_key = (user_id, key)
+            request_hash = hashlib.sha256(f"{request.method} {request.path}\n".encode() + request.get_data()).hexdigest()
+
+            try:
+                stored = idempotency_store.acquire(store_key, Settings.IdempotencyWaitTimeout)
+            except IdempotencyTimeoutError:
+                return _in_progress()
+            if stored is not None:
+                return _replay(stored, request_hash)  # answered from memory, no connection taken
+            g.idempotency_key = store_key  # released on teardown, after the unit of work committed
+
+            if claimed_by_view is not None and claimed_by_view():
+                return _run_claimed_by_view(view, args, kwargs, store_key, request_hash)
+
+            claim = IdempotencyDAO.claim(user_id, key, request.path, request_hash)
+            if claim["status"] == IdempotencyDAO.FAILED:
+                return _busy()
+            if claim["status"] == IdempotencyDAO.EXISTS:
+                return _replay_claim(claim, store_key, request_hash)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code >= 500:
+                IdempotencyDAO.release(user_id, key)
+                return response
+
+            stored = {"request_hash": request_hash, "status": response.status_code, "body": response.get_data(as_text=True)}
+            IdempotencyDAO.save_response(user_id, key, stored["status"], stored["body"])
+            # kept in memory only once committed, a rolled back request (e.g. insufficient deposit) can be retried
+            DBConnector.after_commit(lambda: idempotency_store.put(store_key, stored))
+            return response
+        return wrapper
+    return decorator
+
+
+def _run_claimed_by_view(view, args, kwargs, store_key, request_hash):
+    # a key committed by another process is replayed, otherwise the view saves it with its own transaction
+    user_id, key = store_key
+    found = IdempotencyDAO.find(user_id, key)
+    if found["status"] == IdempotencyDAO.FAILED:
+        return _busy()
+    if found["status"] == IdempotencyDAO.EXISTS:
+        return _replay_claim(found, store_key, request_hash)
+
+    g.idempotency = {"user_id": user_id, "key": key, "route": request.path, "request_hash": request_hash}
+    response = make_response(view(*args, **kwargs))
+    saved = g.idempotency.get("saved")
+    if saved is not None:
+        status, body = saved
+        idempotency_store.put(store_key, {"request_hash": request_hash, "status": status, "body": body})
+    return response
+
+def release_idempotency_key(exc=None):
+    # on request teardown: wake up the duplicates waiting for this request
+    store_key = g.pop('idempotency_key', None)
+    if store_key is not None:
+        idempotency_store.release(store_key)
+
+
+def _replay(stored, request_hash):
+    if stored["request_hash"] != request_hash:
+        logger.warning("Idempotency-Key reused with a different request.")
+        return jsonify({"success": False, "message": "Idempotency-Key was already used for a different request."}), 422
+    response = Response(stored["body"], status=stored["status"], content_type='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _replay_claim(claim, store_key, request_hash):
+    if claim["status_code"] is None:
+        return _in_progress()  # committed without a response, e.g. the process died halfway
+    stored = {"request_hash": claim["request_hash"], "status": claim["status_code"], "body": claim["response"]}
+    idempotency_store.put(store_key, stored)
+    return _replay(stored, request_hash)
+
+
+def _busy():
+    return jsonify({"success": False, "message": "Server is busy, please try again later."}), 503, {'Retry-After': '1'}
+
+
+def _in_progress():
+    return jsonify({"success": False, "message": "A request with this Idempotency-Key is still in progress."}), 409, {'Retry-After': '1'}
@@ -0,0 +1,160 @@
+from util.DatabaseConnection import DBConnector
+from log.log import get_logger
+from config.settings import Settings
+import mysql.connector
+from mysql.connector import errorcode
+
+logger = get_logger(__name__)
+
+class IdempotencyDAO:
+    """
+    Table idempotency_keys (migrations/003_create_idempotency_keys.sql)
+    +--------------+-------------+------+-----+-------------------+-------------------+
+    | Field        | Type        | Null | Key | Default           | Extra             |
+    +--------------+-------------+------+-----+-------------------+-------------------+
+    | user_id      | int         | NO   | PRI | NULL              |                   |
+    | idem_key     | varchar(64) | NO   | PRI | NULL              |                   |
+    | route        | varchar(64) | NO   |     | NULL              |                   |
+    | request_hash | char(64)    | NO   |     | NULL              |                   |
+    | status_code  | smallint    | YES  |     | NULL              |                   |
+    | response     | text        | YES  |     | NULL              |                   |
+    | created_at   | datetime    | NO   | MUL | CURRENT_TIMESTAMP | DEFAULT_GENERATED |
+    +--------------+-------------+------+-----+-------------------+-------------------+
+
+    Used inside the request unit of work: the key is claimed, the purchase / deposit change is made and the
+    response is saved in one transaction, so either all of them are committed or none. Queued purchases are
+    applied outside the request, OrderDAO.purchase_batch writes their keys in the batch transaction instead.
+    """
+
+    # result status of claim / find
+    CLAIMED = "claimed"
+    EXISTS = "exists"
+    MISSING = "missing"
+    FAILED = "failed"
+
+    @staticmethod
+    def claim(user_id, key, route, request_hash):
+        # insert the key. Another transaction holding the same key makes this wait until it commits (duplicate
+        # key, the stored row is returned) or rolls back (the key is claimed here)
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+            try:
+                query = "INSERT INTO idempotency_keys (user_id, idem_key, route, request_hash) VALUES (%s, %s, %s, %s)"
+                cursor.execute(query, (user_id, key, route, request_hash))
+                connection.commit()
+                return {"status": IdempotencyDAO.CLAIMED}
+            except mysql.connector.IntegrityError as e:
+                if e.errno != errorcode.ER_DUP_ENTRY:
+                    raise
+
+            # locking read, a plain read could see a snapshot from before the other request committed
+            query = ("SELECT route, request_hash, status_code, response FROM idempotency_keys "
+                     "WHERE user_id = %s AND idem_key = %s LOCK IN SHARE MODE")
+            cursor.execute(query, (user_id, key))
+            row = cursor.fetchone()
+            if row is None:
+                # deleted in the meantime (release or cleanup), the caller can try again
+                return {"status": IdempotencyDAO.FAILED}
+            route, request_hash, status_code, response = row
+            return {"status": IdempotencyDAO.EXISTS, "route": route, "request_hash": request_hash,
+                    "status_code": status_code, "response": response}
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to claim idempotency key: %s for user_id=%s.", e, user_id)
+            return {"status": IdempotencyDAO.FAILED}
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def find(user_id, key):
+        # plain read of a key, for requests that save their key elsewhere (queued purchases)
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = ("SELECT route, request_hash, status_code, response FROM idempotency_keys "
+                     "WHERE user_id = %s AND idem_key = %s")
+            cursor.execute(query, (user_id, key))
+            row = cursor.fetchone()
+            if row is None:
+                return {"status": IdempotencyDAO.MISSING}
+            route, request_hash, status_code, response = row
+            return {"status": IdempotencyDAO.EXISTS, "route": route, "request_hash": request_hash,
+                    "status_code": status_code, "response": response}
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to find idempotency key: %s for user_id=%s.", e, user_id)
+            return {"status": IdempotencyDAO.FAILED}
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def save_response(user_id, key, status_code, response):
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE user_id = %s AND idem_key = %s"
+            cursor.execute(query, (status_code, response, user_id, key))
+            connection.commit()
+            return cursor.rowcount == 1
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to save idempotent response: %s for user_id=%s.", e, user_id)
+            return False
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def release(user_id, key):
+        # forget a claimed key whose request did not complete (5xx), so a retry runs again
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = "DELETE FROM idempotency_keys WHERE user_id = %s AND idem_key = %s"
+            cursor.execute(query, (user_id, key))
+            connection.commit()
+            return cursor.rowcount == 1
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to release idempotency key: %s for user_id=%s.", e, user_id)
+            return False
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def delete_expired(max_age):
+        # delete keys older than max_age seconds, return the number deleted or None if the query failed
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND"
+            cursor.execute(query, (int(max_age),))
+            connection.commit()
+
+            logger.info("Deleted %s expired idempotency keys.", cursor.rowcount)
+            return cursor.rowcount
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to delete expired idempotency keys: %s", e)
+            return None
+
+        finally:
+            DBConnector.release_connection(connection)
+
+
+if __name__ == '__main__':
+    # python -m dao.IdempotencyDAO: delete keys older than IDEMPOTENCY_KEY_TTL, e.g. from cron
+    IdempotencyDAO.delete_expired(Settings.IdempotencyKeyTTL)
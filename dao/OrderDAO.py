@@ -1,10 +1,9 @@
-import logging
 from util.DatabaseConnection import DBConnector
+from dao.ProductDAO import ProductDAO
 from log.log import get_logger
-from model.User import User
-from model.Product import Product
 from model.Order import Order
 import mysql.connector
+from mysql.connector import errorcode
 
 logger = get_logger(__name__)
 
@@ -18,7 +17,7 @@ class OrderDAO:
     | user_id    | int      | NO   | MUL | NULL              |                   |
     | product_id | int      | NO   | MUL | NULL              |                   |
     | quantity   | int      | NO   |     | NULL              |                   |
-    | order_date | datetime | YES  |     | CURRENT_TIMESTAMP | DEFAULT_GENERATED |
+    | order_date | datetime | NO   |     | CURRENT_TIMESTAMP | DEFAULT_GENERATED |
     +------------+----------+------+-----+-------------------+-------------------+
 
     reference integrity constraints:
@@ -30,6 +29,16 @@ class OrderDAO:
     +----------------------+------------+-------------+-----------------------+------------------------+-------------+-------------+
 
     """
+
+    # result status of purchase_product and checkout
+    PURCHASE_OK = "ok"
+    PURCHASE_USER_NOT_FOUND = "user_not_found"
+    PURCHASE_PRODUCT_NOT_FOUND = "product_not_found"
+    PURCHASE_INSUFFICIENT_INVENTORY = "insufficient_inventory"
+    PURCHASE_INSUFFICIENT_DEPOSIT = "insufficient_deposit"
+    PURCHASE_FAILED = "failed"
+    PURCHASE_DUPLICATE = "duplicate"  # purchase_batch: its Idempotency-Key is used by another purchase already
+
     @staticmethod
     def create_order(user_id, product_id, quantity):
         connection = None
@@ -44,22 +53,21 @@ class OrderDAO:
             cursor.execute(query, (user_id, product_id, quantity))
             connection.commit()
 
-            logger.info(f"Order created: user_id={user_id}, product_id={product_id}, quantity={quantity}.")
+            logger.info("Order created: user_id=%s, product_id=%s, quantity=%s.", user_id, product_id, quantity)
             return cursor.lastrowid
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to create order: {e}")
+            logger.warning("Failed to create order: %s", e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_all_orders():
         connection = None
         try:
-            connection = DBConnector.get_connection()
+            connection = DBConnector.get_connection(read_only=True)
             cursor = connection.cursor(dictionary=True)
 
             query = "SELECT * FROM orders"
@@ -69,12 +77,11 @@ class OrderDAO:
             return [Order.from_dict(row) for row in results]
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to get orders: {e}")
+            logger.warning("Failed to get orders: %s", e)
             return []
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_order_by_id(order_id):
@@ -89,18 +96,17 @@ class OrderDAO:
             return Order.from_dict(result) if result else None
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to get order: {e}")
+            logger.warning("Failed to get order: %s", e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_orders_by_user_id(user_id):
         connection = None
         try:
-            connection = DBConnector.get_connection()
+            connection = DBConnector.get_connection(read_only=True)
             cursor = connection.cursor(dictionary=True)
 
             query = "SELECT * FROM orders WHERE user_id = %s"
@@ -109,52 +115,356 @@ class OrderDAO:
             return [Order.from_dict(row) for row in results]
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to get orders for user_id={user_id}: {e}")
+            logger.warning("Failed to get orders for user_id=%s: %s", user_id, e)
+            return []
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def get_all_orders_with_product_name():
+        # join products in the same query so the product name comes back with each order
+        # instead of looking every product up one by one
+        connection = None
+        try:
+            connection = DBConnector.get_connection(read_only=True)
+            cursor = connection.cursor(dictionary=True)
+
+            query = """
+                SELECT o.id, o.user_id, o.product_id, o.quantity, o.order_date, p.name AS product_name
+                FROM orders o
+                LEFT JOIN products p ON p.id = o.product_id
+            """
+            cursor.execute(query)
+            results = cursor.fetchall()
+            logger.info("Queried all orders with product names and returned.")
+            return [Order.from_dict(row) for row in results]
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to get orders with product names: %s", e)
             return []
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def iter_all_orders_with_product_name(chunk_size=1000):
+        # generator version of get_all_orders_with_product_name, rows are fetched chunk_size at a time
+        # so only one chunk is in memory. the connection is held until the generator is exhausted or closed
+        # unlike the other methods a database error is raised, a half streamed result must not look complete
+        connection = None
+        try:
+            connection = DBConnector.get_stream_connection()
+            cursor = connection.cursor(dictionary=True)
+
+            query = """
+                SELECT o.id, o.user_id, o.product_id, o.quantity, o.order_date, p.name AS product_name
+                FROM orders o
+                LEFT JOIN products p ON p.id = o.product_id
+            """
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Order.from_dict(row)
+            logger.info("Streamed all orders with product names.")
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to stream orders with product names: %s", e)
+            raise
+
+        finally:
+            DBConnector.release_connection(connection)  # also drains the rows left if the consumer stopped early
+
+    @staticmethod
+    def get_orders_page_by_user_id(user_id, limit, after=None, start_date=None, end_date=None):
+        # one page of a user's orders, newest first, with keyset pagination on (order_date, id)
+        # after is the (order_date, id) of the last order of the previous page
+        # with the (user_id, order_date, id) index every page is one index range scan
+        # returns {"orders": [...], "has_more": bool} or None if the query failed
+        connection = None
+        try:
+            connection = DBConnector.get_connection(read_only=True)
+            cursor = connection.cursor(dictionary=True)
+
+            filters, params = ["o.user_id = %s"], [user_id]
+            if start_date is not None:
+                filters.append("o.order_date >= %s")
+                params.append(start_date)
+            if end_date is not None:
+                filters.append("o.order_date < %s")
+                params.append(end_date)
+            if after is not None:
+                filters.append("(o.order_date < %s OR (o.order_date = %s AND o.id < %s))")
+                params.extend([after[0], after[0], after[1]])
+
+            query = f"""
+                SELECT o.id, o.user_id, o.product_id, o.quantity, o.order_date, p.name AS product_name
+                FROM orders o
+                LEFT JOIN products p ON p.id = o.product_id
+                WHERE {" AND ".join(filters)}
+                ORDER BY o.order_date DESC, o.id DESC
+                LIMIT %s
+            """
+            cursor.execute(query, tuple(params) + (limit + 1,))
+            orders = [Order.from_dict(row) for row in cursor.fetchall()]
+            return {"orders": orders[:limit], "has_more": len(orders) > limit}
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to get orders page for user_id=%s: %s", user_id, e)
+            return None
+
+        finally:
+            DBConnector.release_connection(connection)
 
     @staticmethod
-    def update_inventory_deposit_and_create_order(product_id, new_inventory, user_id, new_deposit, quantity):
-        # in transaction, update both product inventory and user deposit, and create the order
-        # in case database error happened during the process
+    def purchase_product(user_id, product_id, quantity):
+        # whole purchase in one transaction on one connection
+        # guarded updates only succeed when there is enough inventory / deposit, so the affected
+        # row count tells if the purchase can go on, no read-then-write race between buyers
+        # returns a dict with "status" (one of the PURCHASE_* values), and on success "order_id" plus
+        # the user's "deposit" and the product's "inventory" after the purchase
         connection = None
         try:
             connection = DBConnector.get_connection()
             cursor = connection.cursor()
             connection.start_transaction()
 
-            # update inventory
-            inventory_query = "UPDATE products SET inventory = %s WHERE id = %s"
-            cursor.execute(inventory_query, (new_inventory, product_id))
-
-            # update user deposit
-            deposit_query = "UPDATE users SET deposit = %s WHERE id = %s"
-            cursor.execute(deposit_query, (new_deposit, user_id))
+            # take the inventory first, this also locks the product row until commit
+            inventory_query = "UPDATE products SET inventory = inventory - %s WHERE id = %s AND inventory >= %s"
+            cursor.execute(inventory_query, (quantity, product_id, quantity))
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT inventory FROM products WHERE id = %s", (product_id,))
+                row = cursor.fetchone()
+                connection.rollback()
+                if row is None:
+                    logger.warning("Purchase failed, product not found: product_id=%s", product_id)
+                    return {"status": OrderDAO.PURCHASE_PRODUCT_NOT_FOUND}
+                logger.warning("Purchase failed, insufficient inventory: product_id=%s, requested=%s, available=%s", product_id, quantity, row[0])
+                return {"status": OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY, "available": row[0]}
+
+            # product row is locked by us now, the price cannot change under this purchase
+            cursor.execute("SELECT price, inventory FROM products WHERE id = %s", (product_id,))
+            price, inventory = cursor.fetchone()
+            total_cost = price * quantity
+
+            deposit_query = "UPDATE users SET deposit = deposit - %s WHERE id = %s AND deposit >= %s"
+            cursor.execute(deposit_query, (total_cost, user_id, total_cost))
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT deposit FROM users WHERE id = %s", (user_id,))
+                row = cursor.fetchone()
+                connection.rollback()
+                if row is None:
+                    logger.warning("Purchase failed, user not found: user_id=%s", user_id)
+                    return {"status": OrderDAO.PURCHASE_USER_NOT_FOUND}
+                logger.warning("Purchase failed, insufficient deposit: user_id=%s, deposit=%s, total_cost=%s", user_id, row[0], total_cost)
+                return {"status": OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT}
+            cursor.execute("SELECT deposit FROM users WHERE id = %s", (user_id,))  # locked by the update above
+            deposit = cursor.fetchone()[0]
 
-            # create order
             order_query = """
                 INSERT INTO orders (user_id, product_id, quantity)
                 VALUES (%s, %s, %s)
             """
             cursor.execute(order_query, (user_id, product_id, quantity))
+            order_id = cursor.lastrowid
+
+            connection.commit()
+            ProductDAO.invalidate_cache(product_id)
+            logger.info("Order created: user_id=%s, product_id=%s, quantity=%s, total_cost=%s.", user_id, product_id, quantity, total_cost)
+            return {"status": OrderDAO.PURCHASE_OK, "order_id": order_id, "deposit": deposit, "inventory": inventory}
+
+        except mysql.connector.Error as e:
+            if connection:
+                connection.rollback()  # here, exception happened, rollback
+            logger.warning("Failed to process purchase transaction: %s", e)
+            return {"status": OrderDAO.PURCHASE_FAILED}
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def purchase_batch(product_id, purchases):
+        # group commit of many purchases of the same product, see service/PurchaseQueue.py
+        # purchases is a list of (user_id, quantity, idempotency), applied first come first served in one transaction:
+        # the product row and the buyers' rows (in id order, so batches cannot deadlock each other) are locked once,
+        # every purchase is checked in memory, then one inventory update, the deposit updates and one multi-row
+        # order insert. returns one result dict per purchase, like purchase_product, or None if the transaction failed
+        # idempotency is None or the Idempotency-Key of the request ({"user_id", "key", "route", "request_hash",
+        # "response": result dict -> (status code, body)}): the key is inserted in the same transaction, a key in
+        # use already gives PURCHASE_DUPLICATE, a successful purchase saves its response and sets "saved" once
+        # committed. The keys of refused purchases are not kept, a retry runs again
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+            connection.start_transaction()
+
+            cursor.execute("SELECT price, inventory FROM products WHERE id = %s FOR UPDATE", (product_id,))
+            row = cursor.fetchone()
+            if row is None:
+                connection.rollback()
+                logger.warning("Purchase batch failed, product not found: product_id=%s", product_id)
+                return [{"status": OrderDAO.PURCHASE_PRODUCT_NOT_FOUND} for _ in purchases]
+            price, inventory = row
+
+            user_ids = sorted({user_id for user_id, _, _ in purchases})
+            placeholders = ", ".join(["%s"] * len(user_ids))
+            cursor.execute(f"SELECT id, deposit FROM users WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", tuple(user_ids))
+            deposits = dict(cursor.fetchall())
+
+            results, debits, accepted, refused_keys = [], {}, [], []
+            for user_id, quantity, idempotency in purchases:
+                total_cost = price * quantity
+                if idempotency is not None and not OrderDAO._claim_idempotency_key(cursor, idempotency):
+                    results.append({"status": OrderDAO.PURCHASE_DUPLICATE})
+                    continue
+                if user_id not in deposits:
+                    results.append({"status": OrderDAO.PURCHASE_USER_NOT_FOUND})
+                elif quantity > inventory:
+                    results.append({"status": OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY, "available": inventory})
+                elif total_cost > deposits[user_id]:
+                    results.append({"status": OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT})
+                else:
+                    inventory -= quantity
+                    deposits[user_id] -= total_cost
+                    debits[user_id] = debits.get(user_id, 0) + total_cost
+                    accepted.append((len(results), user_id, quantity, idempotency))
+                    results.append({"status": OrderDAO.PURCHASE_OK, "deposit": deposits[user_id]})
+                    continue
+                if idempotency is not None:
+                    refused_keys.append(idempotency)
+
+            if not accepted:
+                connection.rollback()
+                return results
+
+            sold = sum(quantity for _, _, quantity, _ in accepted)
+            cursor.execute("UPDATE products SET inventory = inventory - %s WHERE id = %s", (sold, product_id))
+            cursor.executemany("UPDATE users SET deposit = deposit - %s WHERE id = %s",
+                               [(debit, user_id) for user_id, debit in sorted(debits.items())])
+
+            values = ", ".join(["(%s, %s, %s)"] * len(accepted))
+            params = [value for _, user_id, quantity, _ in accepted for value in (user_id, product_id, quantity)]
+            cursor.execute(f"INSERT INTO orders (user_id, product_id, quantity) VALUES {values}", params)
+            # the rows of one multi-row insert get their ids in one step: lastrowid is the first one and the next
+            # ones follow auto_increment_increment apart (not 1 e.g. on a multi-primary setup)
+            first_order_id = cursor.lastrowid
+            cursor.execute("SELECT @@SESSION.auto_increment_increment")
+            id_increment = cursor.fetchone()[0]
+            for offset, (index, _, _, _) in enumerate(accepted):
+                results[index].update(order_id=first_order_id + offset * id_increment, inventory=inventory)
+
+            saved = []
+            for index, _, _, idempotency in accepted:
+                if idempotency is not None:
+                    status_code, body = idempotency["response"](results[index])
+                    cursor.execute("UPDATE idempotency_keys SET status_code = %s, response = %s WHERE user_id = %s AND idem_key = %s",
+                                   (status_code, body, idempotency["user_id"], idempotency["key"]))
+                    saved.append((idempotency, (status_code, body)))
+            if refused_keys:
+                cursor.executemany("DELETE FROM idempotency_keys WHERE user_id = %s AND idem_key = %s",
+                                   [(idempotency["user_id"], idempotency["key"]) for idempotency in refused_keys])
 
-            # commit
             connection.commit()
-            logger.info(f"Order created: user_id={user_id}, product_id={product_id}, quantity={quantity}.")
-            return cursor.lastrowid 
+            ProductDAO.invalidate_cache(product_id)
+            for idempotency, response in saved:
+                idempotency["saved"] = response
+            logger.info("Purchase batch committed: product_id=%s, purchases=%s, accepted=%s, sold=%s.", product_id, len(purchases), len(accepted), sold)
+            return results
 
         except mysql.connector.Error as e:
             if connection:
                 connection.rollback()  # here, exception happened, rollback
-            logger.warning(f"Failed to process transaction: {e}")
+            logger.warning("Failed to process purchase batch for product_id=%s: %s", product_id, e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def _claim_idempotency_key(cursor, idempotency):
+        # insert the key of a queued purchase in the batch transaction, False if it is used already
+        try:
+            cursor.execute("INSERT INTO idempotency_keys (user_id, idem_key, route, request_hash) VALUES (%s, %s, %s, %s)",
+                           (idempotency["user_id"], idempotency["key"], idempotency["route"], idempotency["request_hash"]))
+            return True
+        except mysql.connector.IntegrityError as e:
+            if e.errno != errorcode.ER_DUP_ENTRY:
+                raise
+            return False
+
+    @staticmethod
+    def checkout(user_id, items):
+        # buy a whole cart in one transaction
+        # items is a dict {product_id: quantity}, rows are always locked in product id order
+        # so two carts with the same products cannot deadlock each other
+        # returns a dict like purchase_product, with "order_count" and "total_cost" on success
+        product_ids = sorted(items)
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+            connection.start_transaction()
+
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            lock_query = f"SELECT id, price, inventory FROM products WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE"
+            cursor.execute(lock_query, tuple(product_ids))
+            products = {row[0]: row for row in cursor.fetchall()}
+
+            total_cost = 0
+            for product_id in product_ids:
+                if product_id not in products:
+                    connection.rollback()
+                    logger.warning("Checkout failed, product not found: product_id=%s", product_id)
+                    return {"status": OrderDAO.PURCHASE_PRODUCT_NOT_FOUND, "product_id": product_id}
+                _, price, inventory = products[product_id]
+                if inventory < items[product_id]:
+                    connection.rollback()
+                    logger.warning("Checkout failed, insufficient inventory: product_id=%s, requested=%s, available=%s", product_id, items[product_id], inventory)
+                    return {"status": OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY, "product_id": product_id, "available": inventory}
+                total_cost += price * items[product_id]
+
+            # debit the deposit once for the whole cart
+            deposit_query = "UPDATE users SET deposit = deposit - %s WHERE id = %s AND deposit >= %s"
+            cursor.execute(deposit_query, (total_cost, user_id, total_cost))
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT deposit FROM users WHERE id = %s", (user_id,))
+                row = cursor.fetchone()
+                connection.rollback()
+                if row is None:
+                    logger.warning("Checkout failed, user not found: user_id=%s", user_id)
+                    return {"status": OrderDAO.PURCHASE_USER_NOT_FOUND}
+                logger.warning("Checkout failed, insufficient deposit: user_id=%s, deposit=%s, total_cost=%s", user_id, row[0], total_cost)
+                return {"status": OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT}
+
+            # rows are locked and checked above, so the inventory updates cannot fail
+            inventory_query = "UPDATE products SET inventory = inventory - %s WHERE id = %s"
+            cursor.executemany(inventory_query, [(items[product_id], product_id) for product_id in product_ids])
+
+            order_query = """
+                INSERT INTO orders (user_id, product_id, quantity)
+                VALUES (%s, %s, %s)
+            """
+            cursor.executemany(order_query, [(user_id, product_id, items[product_id]) for product_id in product_ids])
+            order_count = cursor.rowcount
+
+            connection.commit()
+            for product_id in product_ids:
+                ProductDAO.invalidate_cache(product_id)
+            logger.info("Checkout finished: user_id=%s, items=%s, total_cost=%s.", user_id, len(product_ids), total_cost)
+            return {"status": OrderDAO.PURCHASE_OK, "order_count": order_count, "total_cost": total_cost}
+
+        except mysql.connector.Error as e:
+            if connection:
+                connection.rollback()  # here, exception happened, rollback
+            logger.warning("Failed to process checkout transaction: %s", e)
+            return {"status": OrderDAO.PURCHASE_FAILED}
+
+        finally:
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def delete_order_by_id(order_id):
@@ -167,13 +477,12 @@ class OrderDAO:
             cursor.execute(query, (order_id,))
             connection.commit()
 
-            logger.info(f"Order with ID {order_id} deleted successfully.")
+            logger.info("Order with ID %s deleted successfully.", order_id)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to delete order: {e}")
+            logger.warning("Failed to delete order: %s", e)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
@@ -1,5 +1,8 @@
+import itertools
 import logging
 from util.DatabaseConnection import DBConnector
+from util.Cache import TTLCache
+from config.settings import Settings
 from log.log import get_logger
 from model.User import User
 from model.Product import Product
@@ -23,8 +26,27 @@ class ProductDAO:
     | category    | varchar(255)  | YES  |     | NULL    |                |
     | inventory   | int           | NO   |     | NULL    |                |
     +-------------+---------------+------+-----+---------+----------------+
+
+    get_all_products and get_product_by_id read through an in-process TTL/LRU cache,
+    writes have to go through invalidate_cache.
     """
-    
+
+    ALL_PRODUCTS_KEY = "all"
+    # sort name -> (column, direction) used by get_products_page, every column is indexed (see migrations/)
+    PAGE_SORTS = {
+        "id": ("id", "ASC"),
+        "price_asc": ("price", "ASC"),
+        "price_desc": ("price", "DESC"),
+    }
+    _catalog_versions = itertools.count(1)
+    catalog_version = next(_catalog_versions)  # bumped on every product write, see invalidate_cache
+    cache = TTLCache(
+        maxsize=Settings.ProductCacheMaxSize,
+        ttl=Settings.ProductCacheTTL,
+        stale_ttl=Settings.ProductCacheStaleTTL,
+        name="product_cache"
+    )
+
     @staticmethod
     def create_product(product):
         connection = None
@@ -38,41 +60,147 @@ class ProductDAO:
             """
             cursor.execute(query, (product.name, product.price, product.inventory, product.category, product.description))
             connection.commit()
+            ProductDAO.invalidate_cache()
 
-            logger.info(f"Product created: {product.name}, price={product.price}, inventory={product.inventory}.")
+            logger.info("Product created: %s, price=%s, inventory=%s.", product.name, product.price, product.inventory)
             return cursor.lastrowid
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to create product: {e}")
+            logger.warning("Failed to create product: %s", e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_all_products():
+        try:
+            rows = ProductDAO.cache.get_or_load(ProductDAO.ALL_PRODUCTS_KEY, ProductDAO._query_all_product_rows)
+            return [Product.from_dict(row) for row in rows]
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to get all products: %s", e)
+            return None
+
+    @staticmethod
+    def get_product_by_id(product_id):
+        # the cache key is the int id, "5" from a request body and 5 must share the entry invalidate_cache drops
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            logger.warning("Invalid product_id=%s.", product_id)
+            return None
+        try:
+            row = ProductDAO.cache.get_or_load(product_id, lambda: ProductDAO._query_product_row_by_id(product_id))
+            return Product.from_dict(row) if row else None
+
+        except mysql.connector.Error as e:
+            logger.warning("Failed to get product: %s", e)
+            return None
+
+    @staticmethod
+    def get_products_page(limit, after=None, category=None, min_price=None, max_price=None, in_stock=False, sort="id"):
+        # one page of products with keyset pagination, plus the per category counts of the filtered products
+        # after is the (sort value, id) of the last product of the previous page, or (id,) when sorting by id
+        # both come from the same statement so the page and the facets are one round trip
+        # returns {"products": [...], "has_more": bool, "facets": {category: count}} or None if the query failed
+        column, direction = ProductDAO.PAGE_SORTS[sort]
         connection = None
         try:
-            connection = DBConnector.get_connection()
+            connection = DBConnector.get_connection(read_only=True)
             cursor = connection.cursor(dictionary=True)
 
-            query = "SELECT * FROM products"
-            cursor.execute(query)
+            filters, filter_params = [], []
+            if min_price is not None:
+                filters.append("price >= %s")
+                filter_params.append(min_price)
+            if max_price is not None:
+                filters.append("price <= %s")
+                filter_params.append(max_price)
+            if in_stock:
+                filters.append("inventory > 0")
+
+            page_filters, page_params = list(filters), list(filter_params)
+            if category is not None:
+                page_filters.append("category = %s")
+                page_params.append(category)
+            if after is not None:
+                op = ">" if direction == "ASC" else "<"
+                if column == "id":
+                    page_filters.append(f"id {op} %s")
+                    page_params.append(after[0])
+                else:
+                    page_filters.append(f"({column} {op} %s OR ({column} = %s AND id {op} %s))")
+                    page_params.extend([after[0], after[0], after[1]])
+
+            def where(clauses):
+                return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+            # facets ignore the category filter, so the client can show counts for the other categories too
+            query = f"""
+                (SELECT 'item' AS row_type, id, name, description, price, category, inventory, NULL AS facet_count
+                 FROM products
+                 {where(page_filters)}
+                 ORDER BY {column} {direction}{'' if column == 'id' else f', id {direction}'}
+                 LIMIT %s)
+                UNION ALL
+                (SELECT 'facet' AS row_type, NULL, NULL, NULL, NULL, category, NULL, COUNT(*)
+                 FROM products
+                 {where(filters)}
+                 GROUP BY category)
+            """
+            cursor.execute(query, tuple(page_params) + (limit + 1,) + tuple(filter_params))
             results = cursor.fetchall()
-            logger.info(f"Queried all products and returned.")
-            return [Product.from_dict(row) for row in results]
+
+            products = [Product.from_dict(row) for row in results if row['row_type'] == 'item']
+            facets = {(row['category'] or ""): row['facet_count'] for row in results if row['row_type'] == 'facet'}
+            logger.info("Queried a page of %s products, sort=%s, category=%s.", min(len(products), limit), sort, category)
+            return {"products": products[:limit], "has_more": len(products) > limit, "facets": facets}
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to get all products: {e}")
+            logger.warning("Failed to get products page: %s", e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
-    def get_product_by_id(product_id):
+    def invalidate_cache(product_id=None):
+        # drop the cached product (and the cached product list) after a write
+        # every product write, including purchases in OrderDAO, must call this after commit
+        # inside a unit of work the commit comes later, so it is done again once the transaction ended: a reader
+        # could cache the old row in between, or (its loaders read through the unit of work) the uncommitted
+        # new one, which must not outlive a rollback
+        def invalidate():
+            if product_id is not None:
+                ProductDAO.cache.invalidate(int(product_id))  # same key as get_product_by_id
+            ProductDAO.cache.invalidate(ProductDAO.ALL_PRODUCTS_KEY)
+            ProductDAO.catalog_version = next(ProductDAO._catalog_versions)
+
+        invalidate()
+        if DBConnector.current_unit_of_work.get() is not None:
+            DBConnector.after_transaction(invalidate)
+
+    @staticmethod
+    def _query_all_product_rows():
+        # loader of the product cache, raises mysql.connector.Error so the cache can fall back to a stale entry
+        # reads the primary: right after a write invalidated it, a lagging replica would cache the old rows for the TTL
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor(dictionary=True)
+
+            query = "SELECT * FROM products"
+            cursor.execute(query)
+            results = cursor.fetchall()
+            logger.info("Queried all products and returned.")
+            return results
+
+        finally:
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def _query_product_row_by_id(product_id):
         connection = None
         try:
             connection = DBConnector.get_connection()
@@ -80,16 +208,10 @@ class ProductDAO:
 
             query = "SELECT * FROM products WHERE id = %s"
             cursor.execute(query, (product_id,))
-            result = cursor.fetchone()
-            return Product.from_dict(result) if result else None
-
-        except mysql.connector.Error as e:
-            logger.warning(f"Failed to get product: {e}")
-            return None
+            return cursor.fetchone()
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_product_by_name(product_name):
@@ -104,12 +226,11 @@ class ProductDAO:
             return Product.from_dict(result) if result else None
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to get product: {e}")
+            logger.warning("Failed to get product: %s", e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_inventory_by_id(product_id, new_inventory):
@@ -121,17 +242,50 @@ class ProductDAO:
             query = "UPDATE products SET inventory = %s WHERE id = %s"
             cursor.execute(query, (new_inventory, product_id))
             connection.commit()
+            ProductDAO.invalidate_cache(product_id)
 
-            logger.info(f"Updated inventory for product_id={product_id} to {new_inventory}.")
+            logger.info("Updated inventory for product_id=%s to %s.", product_id, new_inventory)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update inventory: {e}")
+            logger.warning("Failed to update inventory: %s", e)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def add_to_inventory_by_id(product_id, delta):
+        # change the inventory on the server side, delta can be negative but the inventory never goes below 0
+        # returns (updated rows, inventory after the update) re-selected on the same connection,
+        # inventory is None if the product does not exist. returns None if the query failed
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = "UPDATE products SET inventory = inventory + %s WHERE id = %s AND inventory + %s >= 0"
+            cursor.execute(query, (delta, product_id, delta))
+            updated = cursor.rowcount
+
+            cursor.execute("SELECT inventory FROM products WHERE id = %s", (product_id,))
+            row = cursor.fetchone()
+            connection.commit()
+            if updated:
+                ProductDAO.invalidate_cache(product_id)
+
+            inventory = row[0] if row else None
+            logger.info("Changed inventory for product_id=%s by %s, updated=%s, inventory=%s.", product_id, delta, updated, inventory)
+            return updated, inventory
+
+        except mysql.connector.Error as e:
+            if connection:
+                connection.rollback()
+            logger.warning("Failed to change inventory: %s", e)
+            return None
+
+        finally:
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_price_by_id(product_id, new_price):
@@ -143,17 +297,17 @@ class ProductDAO:
             query = "UPDATE products SET price = %s WHERE id = %s"
             cursor.execute(query, (new_price, product_id))
             connection.commit()
+            ProductDAO.invalidate_cache(product_id)
 
-            logger.info(f"Updated price for product_id={product_id} to {new_price}.")
+            logger.info("Updated price for product_id=%s to %s.", product_id, new_price)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update price: {e}")
+            logger.warning("Failed to update price: %s", e)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def delete_product_by_id(product_id):
@@ -165,14 +319,14 @@ class ProductDAO:
             query = "DELETE FROM products WHERE id = %s"
             cursor.execute(query, (product_id,))
             connection.commit()
+            ProductDAO.invalidate_cache(product_id)
 
-            logger.info(f"Deleted product with product_id={product_id}.")
+            logger.info("Deleted product with product_id=%s.", product_id)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to delete product: {e}")
+            logger.warning("Failed to delete product: %s", e)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
\ No newline at end of file
+            DBConnector.release_connection(connection)
\ No newline at end of file
@@ -26,22 +26,47 @@ class UserDAO:
         """获取所有用户"""
         connection = None
         try:
-            connection = DBConnector.get_connection()
+            connection = DBConnector.get_connection(read_only=True)
             cursor = connection.cursor(dictionary=True)
 
             query = "SELECT * FROM users"
             cursor.execute(query)
             results = cursor.fetchall()
-            logger.info(f"Returned all users.")
+            logger.info("Returned all users.")
             return [User.from_dict(row) for row in results]
 
         except mysql.connector.Error as e:
-            logger.warning(f"Database query failed: {e}")
+            logger.warning("Database query failed: %s", e)
             return []
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def iter_all_users(chunk_size=1000):
+        # generator version of get_all_users, rows are fetched chunk_size at a time so only one chunk is in memory
+        # a database error is raised instead of ending the stream early
+        connection = None
+        try:
+            connection = DBConnector.get_stream_connection()
+            cursor = connection.cursor(dictionary=True)
+
+            query = "SELECT * FROM users"
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield User.from_dict(row)
+            logger.info("Streamed all users.")
+
+        except mysql.connector.Error as e:
+            logger.warning("Database query failed: %s", e)
+            raise
+
+        finally:
+            DBConnector.release_connection(connection)  # also drains the rows left if the consumer stopped early
 
     @staticmethod
     def get_user_by_username(username):
@@ -56,19 +81,18 @@ class UserDAO:
 
             if result:
                 user = User.from_dict(result)
-                logger.info(f"Queried a user {user.username} and returned.")
+                logger.info("Queried a user %s and returned.", user.username)
                 return user
             else:
-                logger.info(f"Didn't find user with username : {username}")
+                logger.info("Didn't find user with username : %s", username)
                 return None
 
         except mysql.connector.Error as e:
-            logger.warning(f"Database query failed: {e} when querying {username}")
+            logger.warning("Database query failed: %s when querying %s", e, username)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def get_user_by_id(user_id):
@@ -83,19 +107,18 @@ class UserDAO:
 
             if result:
                 user = User.from_dict(result)
-                logger.info(f"Queried a user with user id {user_id} and returned.")
+                logger.info("Queried a user with user id %s and returned.", user_id)
                 return user
             else:
-                logger.info(f"Didn't find user with user id : {user_id}")
+                logger.info("Didn't find user with user id : %s", user_id)
                 return None
 
         except mysql.connector.Error as e:
-            logger.warning(f"Database query failed: {e} when querying {user_id}")
+            logger.warning("Database query failed: %s when querying %s", e, user_id)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_user_deposit_by_id(user_id, new_deposit):
@@ -108,16 +131,47 @@ class UserDAO:
             cursor.execute(query, (new_deposit, user_id))
             connection.commit()
 
-            logger.info(f"Updated deposit for user_id={user_id} to {new_deposit}.")
+            logger.info("Updated deposit for user_id=%s to %s.", user_id, new_deposit)
             return cursor.rowcount 
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update deposit: {e} for user_id={user_id}.")
+            logger.warning("Failed to update deposit: %s for user_id=%s.", e, user_id)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
+
+    @staticmethod
+    def add_to_deposit_by_id(user_id, delta):
+        # change the deposit on the server side, delta can be negative but the deposit never goes below 0
+        # no read-modify-write in python, so two requests at the same time cannot lose an update
+        # returns (updated rows, deposit after the update) re-selected on the same connection,
+        # deposit is None if the user does not exist. returns None if the query failed
+        connection = None
+        try:
+            connection = DBConnector.get_connection()
+            cursor = connection.cursor()
+
+            query = "UPDATE users SET deposit = deposit + %s WHERE id = %s AND deposit + %s >= 0"
+            cursor.execute(query, (delta, user_id, delta))
+            updated = cursor.rowcount
+
+            cursor.execute("SELECT deposit FROM users WHERE id = %s", (user_id,))
+            row = cursor.fetchone()
+            connection.commit()
+
+            deposit = row[0] if row else None
+            logger.info("Changed deposit for user_id=%s by %s, updated=%s, deposit=%s.", user_id, delta, updated, deposit)
+            return updated, deposit
+
+        except mysql.connector.Error as e:
+            if connection:
+                connection.rollback()
+            logger.warning("Failed to change deposit: %s for user_id=%s.", e, user_id)
+            return None
+
+        finally:
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def create_user(username, password, role):
@@ -131,16 +185,15 @@ class UserDAO:
             cursor.execute(query, (username, password, role))
             connection.commit()
 
-            logger.info(f"New user inserted into database: {username}, role={role}.")
+            logger.info("New user inserted into database: %s, role=%s.", username, role)
             return cursor.lastrowid
 
         except mysql.connector.Error as e:
-            logger.warning(f"Database insert failed: {e} when inserting {username}.")
+            logger.warning("Database insert failed: %s when inserting %s.", e, username)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_username(user_id, new_username):
@@ -153,16 +206,15 @@ class UserDAO:
             cursor.execute(query, (new_username, user_id))
             connection.commit()
 
-            logger.info(f"Updated username for user_id={user_id} to {new_username}.")
+            logger.info("Updated username for user_id=%s to %s.", user_id, new_username)
             return cursor.rowcount 
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update username: {e} for user_id={user_id}.")
+            logger.warning("Failed to update username: %s for user_id=%s.", e, user_id)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_password(user_id, new_password):
@@ -175,16 +227,15 @@ class UserDAO:
             cursor.execute(query, (new_password, user_id))
             connection.commit()
 
-            logger.info(f"Updated password for user_id={user_id}.")
+            logger.info("Updated password for user_id=%s.", user_id)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update password: {e} for user_id={user_id}.")
+            logger.warning("Failed to update password: %s for user_id=%s.", e, user_id)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def update_role_by_id(user_id, new_role):
@@ -197,16 +248,15 @@ class UserDAO:
             cursor.execute(query, (new_role, user_id))
             connection.commit()
 
-            logger.info(f"Updated role for user_id={user_id} to {new_role}.")
+            logger.info("Updated role for user_id=%s to %s.", user_id, new_role)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to update role: {e} for user_id={user_id}.")
+            logger.warning("Failed to update role: %s for user_id=%s.", e, user_id)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
 
     @staticmethod
     def delete_user_by_id(user_id):
@@ -219,16 +269,15 @@ class UserDAO:
             cursor.execute(query, (user_id,))
             connection.commit()
 
-            logger.info(f"Deleted user with user_id={user_id}.")
+            logger.info("Deleted user with user_id=%s.", user_id)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to delete user: {e} for user_id={user_id}.")
+            logger.warning("Failed to delete user: %s for user_id=%s.", e, user_id)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
+            DBConnector.release_connection(connection)
     
     @staticmethod
     def delete_user_by_username(user_name):
@@ -241,13 +290,12 @@ class UserDAO:
             cursor.execute(query, (user_name,))
             connection.commit()
 
-            logger.info(f"Deleted user with user_name={user_name}.")
+            logger.info("Deleted user with user_name=%s.", user_name)
             return cursor.rowcount
 
         except mysql.connector.Error as e:
-            logger.warning(f"Failed to delete user: {e} for user_name={user_name}.")
+            logger.warning("Failed to delete user: %s for user_name=%s.", e, user_name)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                connection.close()
\ No newline at end of file
+            DBConnector.release_connection(connection)
\ No newline at end of file
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+# every value can be overridden on the command line or by the environment variables read below
+
+# the workers share the log files, so they must not rotate them themselves (see log/log.py). Set before the
+# first import of the app reads the settings
+os.environ.setdefault("LOG_EXTERNAL_ROTATION", "true")
+
+from config.settings import Settings
+from util.DatabaseConnection import DBConnector
+
+
+def _pool_capacities():
+    # connections one worker can hold on the primary and on each replica: pool size + overflow, from the
+    # environment or db_connection.json (a replica without "pool" section uses the primary one, see DBConnector)
+    try:
+        db_config = DBConnector.load_db_config(DBConnector._config_filepath)
+    except Exception:
+        db_config = {}
+    pool_config = db_config.get("pool", {})
+
+    def capacity(config):
+        options = DBConnector.load_pool_options(config)
+        return options["pool_size"] + options["max_overflow"]
+
+    return capacity(pool_config), [capacity(replica.get("pool", pool_config)) for replica in db_config.get("replicas", [])]
+
+
+def recommended_workers(pool_capacities, max_connections):
+    # 2 x cores + 1, but never more than a database server accepts when every worker fills its pool there:
+    # the primary and every replica (each one a server of its own with max_connections)
+    return max(1, min(multiprocessing.cpu_count() * 2 + 1, *(max_connections // capacity for capacity in pool_capacities)))
+
+
+def recommended_threads(pool_capacity):
+    # a request holds at most one connection of the pool at a time (a queued purchase gives it back while it
+    # waits), more threads than connections would only wait in the pool queue. The purchase workers hold
+    # one connection each while they apply a batch, leave those to them. Sized on the primary pool only:
+    # read_only calls may go to a replica, but fall back to the primary whenever no replica is healthy or free
+    reserved = Settings.PurchaseWorkers if Settings.PurchaseQueueEnabled else 0
+    return max(1, pool_capacity - reserved)
+
+
+POOL_CAPACITY, REPLICA_POOL_CAPACITIES = _pool_capacities()
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 150))  # MySQL max_connections minus what other clients need
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", recommended_workers([POOL_CAPACITY] + REPLICA_POOL_CAPACITIES, DB_MAX_CONNECTIONS)))
+threads = int(os.environ.get("WEB_THREADS", recommended_threads(POOL_CAPACITY)))
+preload_app = True  # import the app once in the master, workers share its memory; post_fork makes them safe
+timeout = 30
+graceful_timeout = 30  # in-flight requests get this long to finish on shutdown / reload
+keepalive = 5
+max_requests = 10000  # recycle workers now and then, the jitter keeps them from restarting together
+max_requests_jitter = 1000
+
+
+def when_ready(server):
+    server.log.info("Workers: %s x %s threads, up to %s primary connections each (%s in total, limit %s), "
+                    "replica pools %s each.", workers, threads, POOL_CAPACITY, workers * POOL_CAPACITY,
+                    DB_MAX_CONNECTIONS, REPLICA_POOL_CAPACITIES)
+
+
+def post_fork(server, worker):
+    # reset what came from the master (pool, log threads, bcrypt processes) and open the connections
+    # before the worker accepts requests
+    from wsgi import init_worker
+    init_worker()
+
+
+def worker_exit(server, worker):
+    from wsgi import shutdown_worker
+    shutdown_worker()
@@ -1,7 +1,13 @@
+import atexit
+import datetime
+import decimal
+import itertools
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, WatchedFileHandler, QueueHandler, QueueListener
 import os
-from filelock import FileLock
+import queue
+import threading
+from config.settings import Settings
 
 LOG_DIR = os.path.join(os.path.dirname(__file__), 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -9,28 +15,163 @@ os.makedirs(LOG_DIR, exist_ok=True)
 GENERAL_LOG_FILE = os.path.join(LOG_DIR, 'general.log')  # normal logger info path
 MYSQL_LOG_FILE = os.path.join(LOG_DIR, 'mysql.log')  # mysql logger info
 
-general_handler = TimedRotatingFileHandler(
-    GENERAL_LOG_FILE, when='midnight', interval=1, backupCount=7, encoding='utf-8', delay=True
-)
-general_handler.setFormatter(
-    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-)
 
-mysql_handler = TimedRotatingFileHandler(
-    MYSQL_LOG_FILE, when='midnight', interval=1, backupCount=7, encoding='utf-8', delay=True
-)
-mysql_handler.setFormatter(
-    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+def _file_handler(path):
+    # one process: rotate at midnight and keep a week. Several processes writing the same file (gunicorn
+    # workers) must not rotate it each on their own, logrotate does it and the handler reopens the new file
+    if Settings.LogExternalRotation:
+        handler = WatchedFileHandler(path, encoding='utf-8', delay=True)
+    else:
+        handler = TimedRotatingFileHandler(path, when='midnight', interval=1, backupCount=7, encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return handler
+
+
+general_handler = _file_handler(GENERAL_LOG_FILE)
+mysql_handler = _file_handler(MYSQL_LOG_FILE)
+
+# high volume messages (matched by their unformatted template), only 1 in LogSampleRate is written
+SAMPLED_MESSAGES = (
+    "Successfully obtained a connection from the pool.",
 )
 
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Puts records on a queue for the listener thread, which does the formatting and the file write.
+    Unlike QueueHandler the message is not formatted here, so the request thread only pays for the put.
+    Records with a mutable argument (a dict, a list, an object) are the exception: the caller may change it
+    before the listener gets to it, so they are formatted right away.
+    When the queue is full (disk too slow) records are dropped instead of blocking requests.
+    """
+
+    IMMUTABLE_TYPES = (str, int, float, bytes, type(None), decimal.Decimal, datetime.date, datetime.time)
+
+    dropped = 0
+
+    def prepare(self, record):
+        # a single dict argument ends up as record.args itself, it is mutable either way
+        if record.args and not DeferredQueueHandler._immutable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    @staticmethod
+    def _immutable(value):
+        if isinstance(value, tuple):
+            return all(DeferredQueueHandler._immutable(item) for item in value)
+        return isinstance(value, DeferredQueueHandler.IMMUTABLE_TYPES)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DeferredQueueHandler.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    # keep one in `rate` records of each sampled message template, every other record passes
+    def __init__(self, templates, rate):
+        super().__init__()
+        self.rate = rate
+        self._counters = {template: itertools.count() for template in templates}
+
+    def filter(self, record):
+        counter = self._counters.get(record.msg)
+        if counter is None or self.rate <= 1:
+            return True
+        return next(counter) % self.rate == 0
+
+
+def parse_level(value):
+    # "warning" or "30" -> 30, None if it is not a level
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    return level if isinstance(level, int) else None
+
+
+def parse_log_levels(value, invalid=None):
+    # "dao=WARNING,util.DatabaseConnection=ERROR" -> {"dao": 30, "util.DatabaseConnection": 40}
+    # entries with an unknown level are left out and added to the invalid list
+    levels = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            if parse_level(level) is None:
+                if invalid is not None:
+                    invalid.append(item.strip())
+                continue
+            levels[name.strip()] = parse_level(level)
+    return levels
+
+
+_invalid_levels = []  # logged once the handlers are set up, see the end of the file
+LOG_LEVEL = parse_level(Settings.LogLevel)
+if LOG_LEVEL is None:
+    _invalid_levels.append(f"LOG_LEVEL={Settings.LogLevel}")
+    LOG_LEVEL = logging.INFO
+LOG_LEVELS = parse_log_levels(Settings.LogLevels, _invalid_levels)
+
+general_queue = queue.Queue(maxsize=Settings.LogQueueSize)
+mysql_queue = queue.Queue(maxsize=Settings.LogQueueSize)
+general_queue_handler = DeferredQueueHandler(general_queue)
+mysql_queue_handler = DeferredQueueHandler(mysql_queue)
+sampling_filter = SamplingFilter(SAMPLED_MESSAGES, Settings.LogSampleRate)
+general_queue_handler.addFilter(sampling_filter)
+
+# background threads writing the log files
+general_listener = QueueListener(general_queue, general_handler)
+mysql_listener = QueueListener(mysql_queue, mysql_handler)
+general_listener.start()
+mysql_listener.start()
+
+
+def restart_listeners():
+    # in a forked worker: the parent's listener threads do not exist here and its queues may have been locked
+    # at the fork, give the handlers new queues and start new listeners
+    global general_queue, mysql_queue, general_listener, mysql_listener
+    general_queue = queue.Queue(maxsize=Settings.LogQueueSize)
+    mysql_queue = queue.Queue(maxsize=Settings.LogQueueSize)
+    general_queue_handler.queue = general_queue
+    mysql_queue_handler.queue = mysql_queue
+    general_listener = QueueListener(general_queue, general_handler)
+    mysql_listener = QueueListener(mysql_queue, mysql_handler)
+    general_listener.start()
+    mysql_listener.start()
+
+
+@atexit.register
+def stop_listeners():
+    # flush what is still queued before the process exits
+    for listener in (general_listener, mysql_listener):
+        if listener._thread is not None:
+            listener.stop()
+
+
+_handlers_lock = threading.Lock()
+
+
+def level_for(name):
+    # most specific configured prefix wins: "dao.OrderDAO" uses "dao.OrderDAO", then "dao", then LOG_LEVEL
+    parts = name.split('.')
+    for i in range(len(parts), 0, -1):
+        level = LOG_LEVELS.get('.'.join(parts[:i]))
+        if level is not None:
+            return level
+    return LOG_LEVEL
+
+
 def get_logger(name, is_mysql=False):
     logger = logging.getLogger(name)
-    if not any(isinstance(handler, TimedRotatingFileHandler) for handler in logger.handlers):
-        lock_file = os.path.join(LOG_DIR, 'log.lock')  # 定义锁文件
-        with FileLock(lock_file):  # 确保线程安全
-            if is_mysql:
-                logger.addHandler(mysql_handler)
-            else:
-                logger.addHandler(general_handler)
-        logger.setLevel(logging.DEBUG)
+    if not any(isinstance(handler, DeferredQueueHandler) for handler in logger.handlers):
+        with _handlers_lock:  # 确保线程安全
+            if not any(isinstance(handler, DeferredQueueHandler) for handler in logger.handlers):
+                logger.addHandler(mysql_queue_handler if is_mysql else general_queue_handler)
+                logger.setLevel(level_for(name))
     return logger
+
+
+if _invalid_levels:
+    get_logger(__name__).warning("Ignored unknown log levels, the default is used instead: %s", ", ".join(_invalid_levels))
@@ -0,0 +1,7 @@
+-- Indexes backing the filtered / sorted / keyset paginated product queries (ProductDAO.get_products_page).
+-- InnoDB secondary indexes already end with the primary key, so (price) also serves ORDER BY price, id.
+
+ALTER TABLE products
+    ADD INDEX idx_products_category_price (category, price),
+    ADD INDEX idx_products_price (price),
+    ADD INDEX idx_products_inventory (inventory);
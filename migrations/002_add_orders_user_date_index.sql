@@ -0,0 +1,6 @@
+-- Composite index for the paginated order history (OrderDAO.get_orders_page_by_user_id).
+-- WHERE user_id = ? ORDER BY order_date DESC, id DESC LIMIT n becomes one index range scan.
+-- It starts with user_id, so it can also back the fk_orders_user_id foreign key.
+
+ALTER TABLE orders
+    ADD INDEX idx_orders_user_date_id (user_id, order_date, id);
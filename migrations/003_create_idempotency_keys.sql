@@ -0,0 +1,17 @@
+-- Idempotency-Key of /purchase, /user/adddeposite and /user/minusdeposite (IdempotencyDAO).
+-- The key is inserted in the same transaction as the purchase / deposit change, the primary key makes a
+-- second request with the same key wait for the first one to commit and then read its stored response.
+-- Old keys are deleted by python -m dao.IdempotencyDAO (e.g. from cron).
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id      INT          NOT NULL,
+    idem_key     VARCHAR(64)  NOT NULL,
+    route        VARCHAR(64)  NOT NULL,
+    request_hash CHAR(64)     NOT NULL,
+    status_code  SMALLINT     NULL,
+    response     TEXT         NULL,
+    created_at   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idem_key),
+    INDEX idx_idempotency_keys_created_at (created_at),
+    CONSTRAINT fk_idempotency_keys_user_id FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
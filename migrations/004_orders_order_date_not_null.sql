@@ -0,0 +1,9 @@
+-- order_date was nullable. The order history is paginated with keyset cursors on (order_date, id)
+-- (OrderDAO.get_orders_page_by_user_id), and a NULL order_date cannot be put in a cursor nor compared with
+-- "order_date < ?", so such an order ended or skipped pages.
+-- Orders without a date are given the oldest possible one, they already came last in the history.
+
+UPDATE orders SET order_date = '1970-01-01 00:00:00' WHERE order_date IS NULL;
+
+ALTER TABLE orders
+    MODIFY order_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP;
@@ -1,10 +1,11 @@
 class Order:
-    def __init__(self, order_id, user_id, product_id, quantity, order_date=None):
+    def __init__(self, order_id, user_id, product_id, quantity, order_date=None, product_name=None):
         self.id = order_id
         self.user_id = user_id
         self.product_id = product_id
         self.quantity = quantity
         self.order_date = order_date
+        self.product_name = product_name  # only set when the order is queried together with products
 
     def __repr__(self):
         return (f"Order(id={self.id}, user_id={self.user_id}, product_id={self.product_id}, "
@@ -16,13 +17,16 @@ class Order:
 
     def to_dict(self):
         # transfer the object to dict format
-        return {
+        order_dict = {
             "id": self.id,
             "user_id": self.user_id,
             "product_id": self.product_id,
             "quantity": self.quantity,
             "order_date": self.order_date
         }
+        if self.product_name is not None:
+            order_dict["product_name"] = self.product_name
+        return order_dict
 
     @staticmethod
     def from_dict(data):
@@ -32,5 +36,6 @@ class Order:
             user_id=data.get('user_id'),
             product_id=data.get('product_id'),
             quantity=data.get('quantity'),
-            order_date=data.get('order_date')
+            order_date=data.get('order_date'),
+            product_name=data.get('product_name')
         )
@@ -0,0 +1,387 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config.settings import Settings
+from dao.ProductDAO import ProductDAO
+from log.log import get_logger
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, without it only the original image is served (no thumbnail / webp)
+    Image = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, the manifest is then only locked within the process
+    fcntl = None
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImageService:
+    """
+    Product images in a content addressed store: the manifest maps a product id to the sha256 of its image,
+    every distinct image is stored once in BUILD_DIR under that hash with a thumbnail and a WebP thumbnail,
+    so products with the same picture share the files. The files never change, so they are served from
+    /img/ with an immutable cache header.
+
+    manifest.json in BUILD_DIR:
+        products: product id -> {"name": product name, "digest": ..., "uploaded": true if set by an upload}
+        assets:   digest -> {"src": ..., "thumb": ..., "webp": ..., "refs": products using it}
+
+    Products without an upload use static/img/<name>.<ext> (or default.jpg). Uploads are decoded, checked and
+    resized on a background thread pool, the admin request does not wait for it. An asset is deleted once no
+    product uses it any more.
+
+    Every worker process shares the file: a change re-reads it under an exclusive lock (manifest.json.lock) and
+    saves it before letting go (only if something changed), and a process reloads it when another one changed it
+    (checked at most every MANIFEST_CHECK_INTERVAL seconds).
+    """
+
+    SOURCE_DIR = os.path.join(BASE_DIR, 'static', 'img')
+    BUILD_DIR = os.path.join(SOURCE_DIR, 'build')
+    MANIFEST_FILE = os.path.join(BUILD_DIR, 'manifest.json')
+    MANIFEST_CHECK_INTERVAL = 1.0
+    URL_PREFIX = '/img/'
+    SOURCE_EXTENSIONS = ('jpg', 'png', 'jpeg', 'gif')
+    DEFAULT_IMAGE = 'default.jpg'
+    THUMB_SIZE = (100, 100)  # product images are shown at 50px, twice that for high density screens
+    # image formats accepted for uploads -> extension of the stored original
+    FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+    _manifest = None
+    _manifest_stamp = None  # (mtime, size) of the file _manifest was read from or saved to
+    _checked_at = 0.0
+    _lock = threading.RLock()  # changes of this process, one at a time
+    _reload_lock = threading.Lock()  # reloads / publishing of _manifest, never held for long so readers do not wait on a build
+    _building = set()  # product ids with a build queued or running
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @staticmethod
+    def image_name(product_name):
+        # file name (without extension) of a product image, same rule the pages used to guess it
+        name = re.sub(r'\s+', '_', product_name or '')
+        return re.sub(r'[^a-zA-Z0-9\u4e00-\u9fa5_]', '', name)
+
+    @staticmethod
+    def image_urls(product_id, product_name):
+        # {"src", "thumb", "webp"} URLs of a product image, webp is None without Pillow
+        # a dict lookup once the product is in the manifest. A product missing from it, or without upload and
+        # renamed, is built on the background pool; until then it gets its old image or the plain default one.
+        # product_name None (e.g. an order of a deleted product) gets the default image
+        manifest = ImageService._get_manifest()
+        if product_name is None:
+            product_id = "default"
+        entry = manifest["products"].get(str(product_id))
+        if entry is None or (not entry["uploaded"] and entry["name"] != product_name):
+            ImageService._submit_build(product_id, product_name)
+            if entry is None:
+                return ImageService._default_urls()
+        return ImageService._asset_urls(manifest["assets"][entry["digest"]])
+
+    @staticmethod
+    def submit_upload(product_id, product_name, data):
+        # process an uploaded image in the background, the product keeps its current image until it is done
+        return ImageService._get_executor().submit(ImageService._process_upload, product_id, product_name, data)
+
+    @staticmethod
+    def remove_product(product_id):
+        # the product was deleted: forget its image and delete the files if no other product uses them
+        with ImageService._update_manifest() as manifest:
+            entry = manifest["products"].pop(str(product_id), None)
+            if entry is not None:
+                ImageService._release(manifest, entry["digest"])
+
+    @staticmethod
+    def build_all(products):
+        # build the manifest for every product ahead of time, on deploy (see __main__ below) or in the background
+        # on worker start (submit_build_all). One read and at most one save of the manifest for the whole
+        # catalog, only missing or renamed entries are built, so it is quick once the files exist
+        # return how many entries were built
+        with ImageService._update_manifest() as manifest:
+            built = ImageService._build_entry(manifest, "default", None)
+            for product in products:
+                built += ImageService._build_entry(manifest, product.id, product.name)
+        logger.info("Image manifest built for %s products, %s entries changed.", len(products), built)
+        return built
+
+    @staticmethod
+    def submit_build_all():
+        # build_all of every product on the background pool, e.g. on worker start: the worker serves requests
+        # right away (missing images get the default one until then)
+        return ImageService._get_executor().submit(ImageService._build_all_in_background)
+
+    @staticmethod
+    def shutdown():
+        # on shutdown: finish the uploads and builds still being processed
+        with ImageService._executor_lock:
+            executor, ImageService._executor = ImageService._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def _submit_build(product_id, product_name):
+        # build the entry of a product on the background pool, once at a time per product
+        with ImageService._lock:
+            if str(product_id) in ImageService._building:
+                return
+            ImageService._building.add(str(product_id))
+        ImageService._get_executor().submit(ImageService._build_in_background, product_id, product_name)
+
+    @staticmethod
+    def _build_in_background(product_id, product_name):
+        try:
+            if ImageService._build(product_id, product_name):
+                ProductDAO.invalidate_cache(None if product_id == "default" else product_id)  # catalog responses carry the image URLs
+        except Exception as e:
+            logger.error("Failed to build image of product_id=%s: %s", product_id, e)
+        finally:
+            with ImageService._lock:
+                ImageService._building.discard(str(product_id))
+
+    @staticmethod
+    def _build_all_in_background():
+        try:
+            if ImageService.build_all(ProductDAO.get_all_products() or []):
+                ProductDAO.invalidate_cache()  # catalog responses carry the image URLs
+        except Exception as e:
+            logger.error("Failed to build the image manifest: %s", e)
+
+    @staticmethod
+    def _build(product_id, product_name):
+        # point a product without upload at the image found by its name, False if its entry is up to date
+        with ImageService._update_manifest() as manifest:
+            return ImageService._build_entry(manifest, product_id, product_name)
+
+    @staticmethod
+    def _build_entry(manifest, product_id, product_name):
+        # inside _update_manifest, the work of _build
+        entry = manifest["products"].get(str(product_id))
+        if entry is not None and (entry["uploaded"] or entry["name"] == product_name):
+            return False
+        source_path = ImageService._find_source(product_name)
+        with open(source_path, 'rb') as file:
+            data = file.read()
+        digest = ImageService._store(manifest, data, os.path.splitext(source_path)[1].lower())
+        ImageService._set_product(manifest, product_id, product_name, digest, uploaded=False)
+        return True
+
+    @staticmethod
+    def _process_upload(product_id, product_name, data):
+        try:
+            extension = ImageService._validate(data)
+            with ImageService._update_manifest() as manifest:
+                digest = ImageService._store(manifest, data, extension)
+                ImageService._set_product(manifest, product_id, product_name, digest, uploaded=True)
+            ProductDAO.invalidate_cache(product_id)  # catalog responses carry the image URLs
+            logger.info("Stored uploaded image of product_id=%s as %s.", product_id, digest)
+        except ValueError as e:
+            logger.warning("Rejected uploaded image of product_id=%s: %s", product_id, e)
+        except Exception as e:
+            logger.error("Failed to process uploaded image of product_id=%s: %s", product_id, e)
+
+    @staticmethod
+    def _validate(data):
+        # return the extension of the real image format, raise ValueError if it is not an accepted image
+        if Image is None:
+            # no decoder, trust the magic bytes
+            for magic, image_format in ((b'\xff\xd8\xff', 'JPEG'), (b'\x89PNG\r\n\x1a\n', 'PNG'), (b'GIF8', 'GIF')):
+                if data.startswith(magic):
+                    return ImageService.FORMATS[image_format]
+            if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+                return ImageService.FORMATS['WEBP']
+            raise ValueError("not a JPEG, PNG, GIF or WebP image")
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image_format = image.format
+                image.verify()
+        except Exception as e:
+            raise ValueError(f"cannot decode image: {e}") from e
+        if image_format not in ImageService.FORMATS:
+            raise ValueError(f"unsupported image format {image_format}")
+        return ImageService.FORMATS[image_format]
+
+    @staticmethod
+    def _find_source(product_name):
+        name = ImageService.image_name(product_name)
+        for extension in ImageService.SOURCE_EXTENSIONS:
+            path = os.path.join(ImageService.SOURCE_DIR, f"{name}.{extension}")
+            if name and os.path.isfile(path):
+                return path
+        return os.path.join(ImageService.SOURCE_DIR, ImageService.DEFAULT_IMAGE)
+
+    @staticmethod
+    def _set_product(manifest, product_id, product_name, digest, uploaded):
+        # inside _update_manifest, point the product at digest and move its reference from the old asset
+        old = manifest["products"].get(str(product_id))
+        entry = {"name": product_name, "digest": digest, "uploaded": uploaded}
+        manifest["products"][str(product_id)] = entry
+        manifest["assets"][digest]["refs"] += 1
+        if old is not None:
+            ImageService._release(manifest, old["digest"])
+        return entry
+
+    @staticmethod
+    def _release(manifest, digest):
+        # inside _update_manifest, drop one reference and delete the files of an asset nobody uses
+        assets = manifest["assets"]
+        asset = assets.get(digest)
+        if asset is None:
+            return
+        asset["refs"] -= 1
+        if asset["refs"] > 0:
+            return
+        del assets[digest]
+        for key in ("src", "thumb", "webp"):
+            if asset[key]:
+                try:
+                    os.remove(os.path.join(ImageService.BUILD_DIR, asset[key]))
+                except FileNotFoundError:
+                    pass
+        logger.info("Deleted unused image asset %s.", digest)
+
+    @staticmethod
+    def _store(manifest, data, extension):
+        # inside _update_manifest, write the image and its variants under its content hash and return the hash
+        # nothing is written if the same content is stored already, refs is left to _set_product
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        assets = manifest["assets"]
+        if digest in assets:
+            return digest
+
+        os.makedirs(ImageService.BUILD_DIR, exist_ok=True)
+        asset = {"src": f"{digest}{extension or '.jpg'}", "thumb": None, "webp": None, "refs": 0}
+        with open(os.path.join(ImageService.BUILD_DIR, asset["src"]), 'wb') as file:
+            file.write(data)
+        if Image is not None:
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    image.thumbnail(ImageService.THUMB_SIZE)
+                    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+                    image = image.convert('RGBA' if transparent else 'RGB')
+                    thumb_format = 'PNG' if transparent else 'JPEG'
+                    asset["thumb"] = f"{digest}.thumb.{thumb_format.lower().replace('jpeg', 'jpg')}"
+                    image.save(os.path.join(ImageService.BUILD_DIR, asset["thumb"]), thumb_format, optimize=True)
+                    asset["webp"] = f"{digest}.thumb.webp"
+                    image.save(os.path.join(ImageService.BUILD_DIR, asset["webp"]), 'WEBP', quality=80, method=6)
+            except (OSError, ValueError) as e:
+                logger.warning("Failed to make variants of image %s: %s", digest, e)
+                asset["thumb"] = asset["webp"] = None
+        assets[digest] = asset
+        logger.info("Built image asset %s.", digest)
+        return digest
+
+    @staticmethod
+    def _default_urls():
+        # the default image as it is in static/img, while the product's own entry is being built
+        src = '/static/img/' + ImageService.DEFAULT_IMAGE
+        return {"src": src, "thumb": src, "webp": None}
+
+    @staticmethod
+    def _asset_urls(asset):
+        src = ImageService.URL_PREFIX + asset["src"]
+        return {
+            "src": src,
+            "thumb": ImageService.URL_PREFIX + asset["thumb"] if asset["thumb"] else src,
+            "webp": ImageService.URL_PREFIX + asset["webp"] if asset["webp"] else None,
+        }
+
+    @staticmethod
+    def _get_executor():
+        with ImageService._executor_lock:
+            if ImageService._executor is None:
+                ImageService._executor = ThreadPoolExecutor(max_workers=Settings.ImageWorkers, thread_name_prefix="image")
+            return ImageService._executor
+
+    @staticmethod
+    def _get_manifest():
+        # the manifest to read from, reloaded when another process saved a newer one
+        manifest = ImageService._manifest
+        now = time.monotonic()
+        if manifest is None or now - ImageService._checked_at >= ImageService.MANIFEST_CHECK_INTERVAL:
+            with ImageService._reload_lock:
+                if ImageService._manifest is None or now - ImageService._checked_at >= ImageService.MANIFEST_CHECK_INTERVAL:
+                    ImageService._checked_at = now
+                    stamp = ImageService._file_stamp()
+                    if ImageService._manifest is None or stamp != ImageService._manifest_stamp:
+                        ImageService._manifest = ImageService._load_manifest()
+                        ImageService._manifest_stamp = stamp
+                manifest = ImageService._manifest
+        return manifest
+
+    @staticmethod
+    @contextmanager
+    def _update_manifest():
+        # every change goes through here: re-read the file under an exclusive lock so changes saved by other
+        # processes are kept, change it and save it before the lock is released. Nothing is written when the
+        # change turned out to be a no-op
+        with ImageService._lock:
+            os.makedirs(ImageService.BUILD_DIR, exist_ok=True)
+            with open(ImageService.MANIFEST_FILE + '.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+                # changed on a copy of its own and only published once saved, readers never see half a change
+                manifest = ImageService._load_manifest()
+                unchanged = copy.deepcopy(manifest)
+                yield manifest
+                if manifest == unchanged:
+                    return
+                stamp = ImageService._save_manifest(manifest)
+                with ImageService._reload_lock:
+                    ImageService._manifest, ImageService._manifest_stamp = manifest, stamp
+
+    @staticmethod
+    def _file_stamp():
+        try:
+            stat = os.stat(ImageService.MANIFEST_FILE)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _load_manifest():
+        try:
+            with open(ImageService.MANIFEST_FILE, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            # reference counts follow from the products, count them again in case the file is older or was edited
+            for asset in manifest["assets"].values():
+                asset["refs"] = 0
+            for entry in manifest["products"].values():
+                entry.setdefault("uploaded", False)
+                manifest["assets"][entry["digest"]]["refs"] += 1
+            logger.info("Loaded image manifest with %s products.", len(manifest["products"]))
+            return manifest
+        except FileNotFoundError:
+            return {"products": {}, "assets": {}}
+        except (ValueError, KeyError) as e:
+            logger.warning("Image manifest is not valid, building a new one: %s", e)
+            return {"products": {}, "assets": {}}
+
+    @staticmethod
+    def _save_manifest(manifest):
+        # inside _update_manifest, write a temp file of its own (other threads and processes save too) and rename so readers never see half a manifest
+        file_descriptor, temp_file = tempfile.mkstemp(dir=ImageService.BUILD_DIR, prefix='manifest.', suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+                json.dump(manifest, file, ensure_ascii=False, indent=1)
+            os.chmod(temp_file, 0o644)  # mkstemp makes it private
+            os.replace(temp_file, ImageService.MANIFEST_FILE)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        return ImageService._file_stamp()
+
+if __name__ == '__main__':
+    # python -m service.ImageService: build the manifest and the variants of every product
+    ImageService.build_all(ProductDAO.get_all_products() or [])
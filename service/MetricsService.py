@@ -0,0 +1,92 @@
+import ipaddress
+from config.settings import Settings
+from util.Cache import TTLCache
+from util.DatabaseConnection import DBConnector
+from util.Metrics import PrometheusWriter, request_metrics
+from util.RateLimiter import rate_limiter
+from log.log import DeferredQueueHandler
+
+
+class MetricsService:
+
+    _allowed_networks = [ipaddress.ip_network(network.strip(), strict=False)
+                         for network in Settings.MetricsAllowedNetworks.split(",") if network.strip()]
+
+    @staticmethod
+    def is_allowed(remote_addr):
+        # True if remote_addr is in Settings.MetricsAllowedNetworks
+        try:
+            address = ipaddress.ip_address(remote_addr or "")
+        except ValueError:
+            return False
+        return any(address in network for network in MetricsService._allowed_networks)
+
+    @staticmethod
+    def render_prometheus():
+        # everything we measure, in Prometheus text format, for GET /metrics
+        writer = PrometheusWriter()
+
+        requests = request_metrics.snapshot()
+        writer.metric("http_requests_total", "counter", "Requests served by route and status code.",
+                      [({"method": method, "route": route, "status": status}, count)
+                       for (method, route, status), count in sorted(requests["counts"].items())])
+        writer.metric("http_requests_in_flight", "gauge", "Requests being served by route.",
+                      [({"method": method, "route": route}, count)
+                       for (method, route), count in sorted(requests["in_flight"].items())])
+        writer.histogram("http_request_duration_seconds", "Request latency by route.",
+                         [({"method": method, "route": route}, snapshot)
+                          for (method, route), snapshot in sorted(requests["latency"].items())])
+
+        pool = DBConnector.pool_stats()
+        if pool is not None:
+            for key, kind, help_text in (
+                    ("pool_size", "gauge", "Configured pool size."),
+                    ("size", "gauge", "Pooled connections open."),
+                    ("overflow", "gauge", "Overflow connections open."),
+                    ("in_use", "gauge", "Connections checked out."),
+                    ("idle", "gauge", "Connections idle in the pool."),
+                    ("waiters", "gauge", "Callers waiting for a connection."),
+                    ("checkouts", "counter", "Connections checked out since start."),
+                    ("timeouts", "counter", "Checkouts that gave up waiting."),
+                    ("rejected", "counter", "Checkouts refused at once because the wait queue was full."),
+            ):
+                name = f"db_pool_{key}_total" if kind == "counter" else f"db_pool_{key}"
+                writer.metric(name, kind, help_text, [({}, pool[key])])
+            writer.histogram("db_pool_wait_seconds", "Time waited for a connection.", [({}, pool["wait_time"])])
+            writer.histogram("db_pool_checkout_seconds", "Time a connection was held.", [({}, pool["checkout_duration"])])
+
+        replicas = sorted(DBConnector.replica_stats().items())
+        writer.metric("db_replica_healthy", "gauge", "1 if the replica passed its last lag check.",
+                      [({"replica": name}, int(stats["healthy"])) for name, stats in replicas])
+        writer.metric("db_replica_lag_seconds", "gauge", "Replication lag seen by the last check.",
+                      [({"replica": name}, stats["lag"]) for name, stats in replicas if stats["lag"] is not None])
+        writer.metric("db_replica_in_use", "gauge", "Replica connections checked out.",
+                      [({"replica": name}, stats["in_use"]) for name, stats in replicas])
+        writer.metric("db_replica_checkouts_total", "counter", "Replica connections checked out since start.",
+                      [({"replica": name}, stats["checkouts"]) for name, stats in replicas])
+
+        limits = sorted(rate_limiter.stats().items())
+        writer.metric("rate_limit_requests_total", "counter", "Requests let through or limited (429) by route class.",
+                      [({"class": route_class, "result": result}, stats[result])
+                       for route_class, stats in limits for result in ("allowed", "limited")])
+        writer.metric("rate_limit_rate", "gauge", "Tokens per second and user by route class, 0 is unlimited.",
+                      [({"class": route_class}, stats["rate"]) for route_class, stats in limits])
+
+        writer.histogram("db_query_duration_seconds", "Statement latency by normalized SQL.",
+                         [({"statement": sql}, snapshot) for sql, snapshot in sorted(DBConnector.query_stats().items())])
+
+        caches = sorted(TTLCache.all_stats().items())
+        for key, kind, help_text in (
+                ("size", "gauge", "Entries in the cache."),
+                ("hits", "counter", "Fresh cache hits."),
+                ("stale_hits", "counter", "Stale entries served while reloading."),
+                ("misses", "counter", "Cache misses."),
+                ("evictions", "counter", "Entries evicted to stay under maxsize."),
+                ("hit_ratio", "gauge", "Hits (fresh and stale) over lookups."),
+        ):
+            name = f"cache_{key}_total" if kind == "counter" else f"cache_{key}"
+            writer.metric(name, kind, help_text, [({"cache": cache}, stats[key]) for cache, stats in caches])
+
+        writer.metric("log_records_dropped_total", "counter", "Log records dropped because the log queue was full.",
+                      [({}, DeferredQueueHandler.dropped)])
+        return writer.render()
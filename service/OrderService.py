@@ -1,102 +1,182 @@
-from dao.UserDAO import UserDAO
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime
 from dao.OrderDAO import OrderDAO
-from dao.ProductDAO import ProductDAO
-from model.Order import Order
-from model.Product import Product
-from model.User import User
 from log.log import get_logger
+from util.Cursor import encode_cursor, decode_cursor
+from service.ImageService import ImageService
+from service.PurchaseQueue import PurchaseQueue, PurchaseQueueFullError
+from config.settings import Settings
+from util.UnitOfWork import UnitOfWork
 
 logger = get_logger(__name__)
 
 class OrderService:
 
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    @staticmethod
+    def _order_to_dict(order):
+        # order comes from a query joined with products, product_name is None if the product is gone
+        order_dict = order.to_dict()
+        order_dict["product_name"] = order.product_name or "Unknown"
+        order_dict["product_image"] = ImageService.image_urls(order.product_id, order.product_name)
+        return order_dict
+
     @staticmethod
-    def create_order(user_id, product_id, quantity):
-        logger.info(f"Attempting to create order: user_id={user_id}, product_id={product_id}, quantity={quantity}")
+    def create_order(user_id, product_id, quantity, idempotency=None):
+        # idempotency: Idempotency-Key of a queued purchase with "render" (result dict -> (status code, body)),
+        # see controller/Idempotency.py. The key and the rendered response are saved with the purchase
+        logger.info("Attempting to create order: user_id=%s, product_id=%s, quantity=%s", user_id, product_id, quantity)
 
         # bunch of data check to make sure it is legal to create an order
         if quantity < 1:
-            logger.warning(f"Invalid quantity: {quantity}. Quantity must be at least 1.")
+            logger.warning("Invalid quantity: %s. Quantity must be at least 1.", quantity)
             return {"success": False, "message": "Quantity must be at least 1."}
 
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found: user_id={user_id}")
-            return {"success": False, "message": "User not found."}
+        if Settings.PurchaseQueueEnabled:
+            # queued mode: applied together with other purchases of the same product, see PurchaseQueue
+            if idempotency is not None:
+                render = idempotency["render"]
+                idempotency["response"] = lambda dao_result: render(OrderService._purchase_result(user_id, product_id, dao_result))
+            UnitOfWork.commit_and_release()  # do not hold a pooled connection while the purchase waits in the queue
+            try:
+                future = PurchaseQueue.submit(user_id, product_id, quantity, idempotency)
+            except PurchaseQueueFullError:
+                logger.warning("Purchase rejected, queue is full: user_id=%s, product_id=%s", user_id, product_id)
+                return {"success": False, "busy": True, "message": "Server is busy, please try again later."}
+            try:
+                result = future.result(timeout=Settings.PurchaseTimeout)
+            except FuturesTimeoutError:
+                if future.cancel():
+                    # still queued, it will never be applied
+                    logger.warning("Purchase timed out in the queue: user_id=%s, product_id=%s", user_id, product_id)
+                    return {"success": False, "busy": True, "message": "Server is busy, please try again later."}
+                # a worker is applying it already, the outcome is unknown to this request
+                logger.warning("Purchase timed out while being applied: user_id=%s, product_id=%s", user_id, product_id)
+                return {"success": False, "busy": True,
+                        "message": "Purchase is still being processed, please check your orders before retrying."}
+        else:
+            # one transaction with guarded updates, checks and writes happen on the same connection
+            result = OrderDAO.purchase_product(user_id, product_id, quantity)
+
+        order_result = OrderService._purchase_result(user_id, product_id, result)
+        if order_result["success"]:
+            logger.info("Order created successfully: order_id=%s", order_result["order_id"])
+        return order_result
 
-        product = ProductDAO.get_product_by_id(product_id)
-        if not product:
-            logger.warning(f"Product not found: product_id={product_id}")
+    @staticmethod
+    def _purchase_result(user_id, product_id, result):
+        # result dict of OrderDAO.purchase_product / purchase_batch -> result dict of create_order
+        status = result["status"]
+
+        if status == OrderDAO.PURCHASE_USER_NOT_FOUND:
+            return {"success": False, "message": "User not found."}
+        if status == OrderDAO.PURCHASE_PRODUCT_NOT_FOUND:
             return {"success": False, "message": "Product not found."}
+        if status == OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY:
+            return {"success": False, "message": f"Insufficient inventory (Available: {result['available']})."}
+        if status == OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT:
+            return {"success": False, "message": "Insufficient deposit."}
+        if status == OrderDAO.PURCHASE_DUPLICATE:
+            return {"success": False, "duplicate": True, "message": "A request with this Idempotency-Key is still in progress."}
+        if status != OrderDAO.PURCHASE_OK:
+            logger.error("Transaction failed for order creation: user_id=%s, product_id=%s", user_id, product_id)
+            return {"success": False, "message": "Failed to process purchase. Transaction rolled back."}
 
-        if product.inventory < quantity:
-            logger.warning(f"Insufficient inventory: product_id={product_id}, requested={quantity}, available={product.inventory}")
-            return {"success": False, "message": f"Insufficient inventory (Available: {product.inventory})."}
+        # new balance and stock, so the client does not have to fetch them again
+        return {"success": True, "message": "Purchase successful.", "order_id": result["order_id"],
+                "deposit": float(result["deposit"]), "inventory": result["inventory"]}
 
-        total_cost = product.price * quantity
-        if user.deposit < total_cost:
-            logger.warning(f"Insufficient deposit: user_id={user_id}, deposit={user.deposit}, total_cost={total_cost}")
+    @staticmethod
+    def checkout(user_id, items):
+        # items is a list of {"product_id": ..., "quantity": ...}, the whole cart is bought or nothing
+        logger.info("Attempting to checkout cart: user_id=%s, items=%s", user_id, items)
+
+        if not items:
+            logger.warning("Checkout failed: Cart is empty.")
+            return {"success": False, "message": "Cart is empty."}
+
+        # validate the whole cart first and merge repeated products
+        cart = {}
+        for item in items:
+            if not isinstance(item, dict) or 'product_id' not in item or 'quantity' not in item:
+                logger.warning("Checkout failed: Invalid cart item %s.", item)
+                return {"success": False, "message": "Each cart item needs product ID and quantity."}
+            product_id, quantity = item['product_id'], item['quantity']
+            if not isinstance(product_id, int) or not isinstance(quantity, int):
+                logger.warning("Checkout failed: Invalid cart item %s.", item)
+                return {"success": False, "message": "Product ID and quantity must be integers."}
+            if quantity < 1:
+                logger.warning("Invalid quantity: %s. Quantity must be at least 1.", quantity)
+                return {"success": False, "message": "Quantity must be at least 1."}
+            cart[product_id] = cart.get(product_id, 0) + quantity
+
+        result = OrderDAO.checkout(user_id, cart)
+        status = result["status"]
+
+        if status == OrderDAO.PURCHASE_USER_NOT_FOUND:
+            return {"success": False, "message": "User not found."}
+        if status == OrderDAO.PURCHASE_PRODUCT_NOT_FOUND:
+            return {"success": False, "message": f"Product not found (ID: {result['product_id']})."}
+        if status == OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY:
+            return {"success": False, "message": f"Insufficient inventory for product {result['product_id']} (Available: {result['available']})."}
+        if status == OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT:
             return {"success": False, "message": "Insufficient deposit."}
+        if status != OrderDAO.PURCHASE_OK:
+            logger.error("Transaction failed for checkout: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to process checkout. Transaction rolled back."}
 
-        # Update product inventory and user deposit
-        logger.info(f"Updating inventory and deposit for transaction: product_id={product_id}, user_id={user_id}")
-        ProductDAO.update_inventory_by_id(product_id, product.inventory - quantity)
-        UserDAO.update_user_deposit_by_id(user_id, user.deposit - total_cost)
-
-        # Call the transaction method
-        # In transaction, update both product inventory and user deposit, and create the order
-        # In case database error happened during the process
-        logger.info(f"Creating order in transaction: user_id={user_id}, product_id={product_id}, quantity={quantity}")
-        order_id = OrderDAO.update_inventory_deposit_and_create_order(
-            product_id=product_id,
-            new_inventory=product.inventory - quantity,
-            user_id=user_id,
-            new_deposit=user.deposit - total_cost,
-            quantity=quantity
-        )
-        if not order_id:
-            logger.error(f"Transaction failed for order creation: user_id={user_id}, product_id={product_id}")
-            return {"success": False, "message": "Failed to process purchase. Transaction rolled back."}
-
-        logger.info(f"Order created successfully: order_id={order_id}")
-        return {"success": True, "message": "Purchase successful.", "order_id": order_id}
+        logger.info("Checkout successful: user_id=%s, orders=%s", user_id, result['order_count'])
+        return {"success": True, "message": "Checkout successful.", "order_count": result["order_count"], "total_cost": float(result["total_cost"])}
 
     @staticmethod
     def get_all_orders():
         logger.info("Fetching all orders from database")
-        orders = OrderDAO.get_all_orders()
-        orders_dict = []
-
-        for order in orders:
-            order_dict = order.to_dict()
-            product = ProductDAO.get_product_by_id(order.product_id)  # Get product name
-            order_dict["product_name"] = product.name if product else "Unknown"
-            orders_dict.append(order_dict)
+        orders = OrderDAO.get_all_orders_with_product_name()  # product name joined in the same query
+        orders_dict = [OrderService._order_to_dict(order) for order in orders]
 
         if not orders:
             logger.warning("No orders found or database query failed.")
             return {"success": False, "orders": orders_dict, "message": "Database query orders failed."}
 
-        logger.info(f"Fetched {len(orders)} orders successfully.")
+        logger.info("Fetched %s orders successfully.", len(orders))
         return {"success": True, "orders": orders_dict}
 
     @staticmethod
-    def get_order_by_user_id(user_id):
-        logger.info(f"Fetching orders for user_id={user_id}")
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found while fetching orders: user_id={user_id}")
-            return {"success": False, "message": "Order query failed. User id not exist."}
-
-        orders = OrderDAO.get_orders_by_user_id(user_id)
-        orders_dict = []
-
-        for order in orders:
-            order_dict = order.to_dict()
-            product = ProductDAO.get_product_by_id(order.product_id)  # Get product name
-            order_dict["product_name"] = product.name if product else "Unknown"
-            # order_dict["product_price"] = product.price if product else 0.0
-            orders_dict.append(order_dict)
-
-        logger.info(f"Fetched {len(orders)} orders for user_id={user_id}.")
-        return {"success": True, "orders": orders_dict}
+    def iter_all_orders():
+        # streaming version of get_all_orders, yields one order dict at a time
+        logger.info("Streaming all orders from database")
+        for order in OrderDAO.iter_all_orders_with_product_name():
+            yield OrderService._order_to_dict(order)
+
+    @staticmethod
+    def get_orders_page_by_user_id(user_id, limit=None, cursor=None, start_date=None, end_date=None):
+        # newest first, one page at a time. start_date / end_date are ISO dates (end_date excluded)
+        logger.info("Fetching orders page for user_id=%s, limit=%s, cursor=%s, start_date=%s, end_date=%s", user_id, limit, cursor, start_date, end_date)
+        try:
+            limit = OrderService.DEFAULT_PAGE_SIZE if limit is None else int(limit)
+            start_date = None if start_date is None else datetime.fromisoformat(start_date)
+            end_date = None if end_date is None else datetime.fromisoformat(end_date)
+        except ValueError:
+            logger.warning("Invalid orders page parameters.")
+            return {"success": False, "message": "Limit must be an integer and dates must be ISO dates."}
+        if not (1 <= limit <= OrderService.MAX_PAGE_SIZE):
+            return {"success": False, "message": f"Limit must be in 1 to {OrderService.MAX_PAGE_SIZE}."}
+
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor, 2)
+            except ValueError as e:
+                logger.warning(str(e))
+                return {"success": False, "message": "Invalid cursor."}
+
+        page = OrderDAO.get_orders_page_by_user_id(user_id, limit, after, start_date, end_date)
+        if page is None:
+            return {"success": False, "message": "Database query orders failed."}
+
+        orders = page["orders"]
+        next_cursor = encode_cursor([orders[-1].order_date, orders[-1].id]) if page["has_more"] else None
+        logger.info("Fetched %s orders for user_id=%s, has more: %s.", len(orders), user_id, page['has_more'])
+        return {"success": True, "orders": [OrderService._order_to_dict(order) for order in orders], "next_cursor": next_cursor}
@@ -1,3 +1,8 @@
+import hashlib
+import json
+import threading
+import time
+from decimal import Decimal
 import bcrypt
 import jwt
 from dao.UserDAO import UserDAO
@@ -5,25 +10,115 @@ from model.Product import Product
 from dao.ProductDAO import ProductDAO
 from datetime import datetime, timedelta, timezone
 from config.config import Config
+from config.settings import Settings
+from util.Cursor import encode_cursor, decode_cursor
 from log.log import get_logger
+from util.UnitOfWork import UnitOfWork
+from util.DatabaseConnection import DBConnector
+from service.ImageService import ImageService
 
 logger = get_logger(__name__)
 
 class ProductService:
 
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    @staticmethod
+    def _product_to_dict(product):
+        # product payload with the URLs of its image and variants, see ImageService
+        product_dict = product.to_dict()
+        product_dict["image"] = ImageService.image_urls(product.id, product.name)
+        return product_dict
+
+    # serialized /products body, built once per catalog version: (catalog_version, built_at, body, etag)
+    _catalog_snapshot = None
+    _catalog_snapshot_lock = threading.Lock()
+
+    @staticmethod
+    def get_all_products_serialized():
+        # return (body bytes, etag) of the whole catalog
+        # the body is only rebuilt when a product write bumped the catalog version, or after the cache TTL
+        # so changes made by other processes show up too. etag is None when the query failed
+        version = ProductDAO.catalog_version  # read before loading so a concurrent write forces a rebuild
+        snapshot = ProductService._catalog_snapshot
+        if snapshot and snapshot[0] == version and time.monotonic() - snapshot[1] < Settings.ProductCacheTTL:
+            return snapshot[2], snapshot[3]
+
+        with ProductService._catalog_snapshot_lock:
+            snapshot = ProductService._catalog_snapshot
+            if snapshot and snapshot[0] == version and time.monotonic() - snapshot[1] < Settings.ProductCacheTTL:
+                return snapshot[2], snapshot[3]
+
+            logger.info("Building catalog response for catalog version %s.", version)
+            products = ProductDAO.get_all_products()
+            if products is None:
+                logger.warning("Database query products failed, catalog response not cached.")
+                return json.dumps({"success": False, "products": [], "message": "Database query products failed."}).encode('utf-8'), None
+
+            payload = {"success": True, "products": [ProductService._product_to_dict(product) for product in products]}
+            body = json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')  # Decimal price as string, same as jsonify
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            ProductService._catalog_snapshot = (version, time.monotonic(), body, etag)
+            return body, etag
+
+    @staticmethod
+    def get_products_page(limit=None, cursor=None, category=None, min_price=None, max_price=None, in_stock=False, sort="id"):
+        # server side filtered, sorted and paginated products, with per category facet counts
+        # all arguments come straight from the query string, so they are validated here
+        logger.info("Fetching products page: limit=%s, cursor=%s, category=%s, min_price=%s, max_price=%s, in_stock=%s, sort=%s", limit, cursor, category, min_price, max_price, in_stock, sort)
+        if sort not in ProductDAO.PAGE_SORTS:
+            return {"success": False, "message": f"Sort must be one of: {', '.join(ProductDAO.PAGE_SORTS)}."}
+        try:
+            limit = ProductService.DEFAULT_PAGE_SIZE if limit is None else int(limit)
+            min_price = None if min_price is None else Decimal(min_price)
+            max_price = None if max_price is None else Decimal(max_price)
+        except (ValueError, ArithmeticError):
+            logger.warning("Invalid products page parameters.")
+            return {"success": False, "message": "Limit must be an integer and prices must be numbers."}
+        if not (1 <= limit <= ProductService.MAX_PAGE_SIZE):
+            return {"success": False, "message": f"Limit must be in 1 to {ProductService.MAX_PAGE_SIZE}."}
+
+        column = ProductDAO.PAGE_SORTS[sort][0]
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor, 1 if column == "id" else 2)
+            except ValueError as e:
+                logger.warning(str(e))
+                return {"success": False, "message": "Invalid cursor."}
+
+        page = ProductDAO.get_products_page(limit, after, category, min_price, max_price, in_stock, sort)
+        if page is None:
+            return {"success": False, "message": "Database query products failed."}
+
+        products = page["products"]
+        next_cursor = None
+        if page["has_more"]:
+            last = products[-1]
+            next_cursor = encode_cursor([last.id] if column == "id" else [getattr(last, column), last.id])
+        logger.info("Fetched %s products, has more: %s.", len(products), page['has_more'])
+        return {
+            "success": True,
+            "products": [ProductService._product_to_dict(product) for product in products],
+            "next_cursor": next_cursor,
+            "facets": page["facets"]
+        }
+
     @staticmethod
     def get_all_products():
         logger.info("Fetching all products from database.")
-        products = [product.to_dict() for product in ProductDAO.get_all_products()]
+        products = [ProductService._product_to_dict(product) for product in ProductDAO.get_all_products()]
         if not products:
             logger.warning("No products found or database query failed.")
         else:
-            logger.info(f"Fetched {len(products)} products successfully.")
+            logger.info("Fetched %s products successfully.", len(products))
         return {"success": True, "products": products}
 
     @staticmethod
-    def add_product(product):
-        logger.info(f"Attempting to add new product: {product.get('name', 'Unknown Name')}")
+    def add_product(product, image=None):
+        # image: bytes of the uploaded image, stored in the background once the product is committed
+        logger.info("Attempting to add new product: %s", product.get('name', 'Unknown Name'))
         product = Product(
             product_id=None,  # id generated by database
             name=product['name'],
@@ -34,49 +129,58 @@ class ProductService:
         )
         product_id = ProductDAO.create_product(product)
         if product_id is None:
-            logger.error(f"Failed to add product: {product.name}")
+            logger.error("Failed to add product: %s", product.name)
             return {"success": False, "message": "Product insert failed."}
-        logger.info(f"Product added successfully with ID: {product_id}")
+        logger.info("Product added successfully with ID: %s", product_id)
+        if image:
+            name = product.name
+            DBConnector.after_commit(lambda: ImageService.submit_upload(product_id, name, image))
+            return {"success": True, "product_id": product_id, "image": "processing"}
         return {"success": True, "product_id": product_id}
 
     @staticmethod
     def update_inventory_by_id(product_id, change_amount):
-        logger.info(f"Updating inventory for product_id={product_id}, change_amount={change_amount}")
-        product = ProductDAO.get_product_by_id(product_id)
-        if product is None:
-            logger.warning(f"Product not found: product_id={product_id}")
+        logger.info("Updating inventory for product_id=%s, change_amount=%s", product_id, change_amount)
+        # guarded server side update, it only happens if the inventory stays >= 0
+        result = ProductDAO.add_to_inventory_by_id(product_id, change_amount)
+        if result is None:
+            logger.error("Failed to update inventory for product_id=%s", product_id)
+            return {"success": False, "message": "Failed to update inventory."}
+        updated, new_inventory = result
+        if new_inventory is None:
+            logger.warning("Product not found: product_id=%s", product_id)
             return {"success": False, "message": "Product does not exist."}
-        new_inventory = product.inventory + change_amount
-        if new_inventory < 0:
-            logger.warning(f"Attempt to set negative inventory: product_id={product_id}, current_inventory={product.inventory}, attempted_change={change_amount}")
+        if not updated and change_amount != 0:
+            logger.warning("Attempt to set negative inventory: product_id=%s, current_inventory=%s, attempted_change=%s", product_id, new_inventory, change_amount)
             return {"success": False, "message": "Inventory cannot be negative."}
-        success = ProductDAO.update_inventory_by_id(product_id, new_inventory) > 0
-        if success:
-            logger.info(f"Inventory updated successfully for product_id={product_id}, new_inventory={new_inventory}")
-        else:
-            logger.error(f"Failed to update inventory for product_id={product_id}")
-        return {"success": success, "message": "Inventory updated successfully." if success else "Failed to update inventory."}
+
+        logger.info("Inventory updated successfully for product_id=%s, new_inventory=%s", product_id, new_inventory)
+        return {"success": True, "message": "Inventory updated successfully.", "inventory": new_inventory}
 
     @staticmethod
     def update_price_by_id(product_id, new_price):
-        logger.info(f"Updating price for product_id={product_id}, new_price={new_price}")
-        product = ProductDAO.get_product_by_id(product_id)
-        if product is None:
-            logger.warning(f"Product not found: product_id={product_id}")
-            return {"success": False, "message": "Product does not exist."}
-        affected_line = ProductDAO.update_price_by_id(product_id, new_price) > 0
-        if affected_line:
-            logger.info(f"Price updated successfully for product_id={product_id}, new_price={new_price}")
-        else:
-            logger.error(f"Failed to update price for product_id={product_id}")
-        return {"success": True, "message": f"Line affected by price change: {affected_line}"}
+        logger.info("Updating price for product_id=%s, new_price=%s", product_id, new_price)
+        # read and write share one connection and one transaction
+        with UnitOfWork():
+            product = ProductDAO.get_product_by_id(product_id)
+            if product is None:
+                logger.warning("Product not found: product_id=%s", product_id)
+                return {"success": False, "message": "Product does not exist."}
+            affected_line = ProductDAO.update_price_by_id(product_id, new_price) > 0
+            if affected_line:
+                logger.info("Price updated successfully for product_id=%s, new_price=%s", product_id, new_price)
+            else:
+                logger.error("Failed to update price for product_id=%s", product_id)
+            return {"success": True, "message": f"Line affected by price change: {affected_line}"}
 
     @staticmethod
     def delete_product_by_id(product_id):
-        logger.info(f"Attempting to delete product: product_id={product_id}")
+        logger.info("Attempting to delete product: product_id=%s", product_id)
         deleted_rows = ProductDAO.delete_product_by_id(product_id)
         if deleted_rows > 0:
-            logger.info(f"Product deleted successfully: product_id={product_id}, rows_affected={deleted_rows}")
+            logger.info("Product deleted successfully: product_id=%s, rows_affected=%s", product_id, deleted_rows)
+            # drop its image once the delete is committed, the files go when no other product uses them
+            DBConnector.after_commit(lambda: ImageService.remove_product(product_id))
         else:
-            logger.warning(f"Product deletion failed or no rows affected: product_id={product_id}")
+            logger.warning("Product deletion failed or no rows affected: product_id=%s", product_id)
         return {"success": True, "message": f"Deleted rows: {deleted_rows}"}
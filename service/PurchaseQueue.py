@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from config.settings import Settings
+from dao.OrderDAO import OrderDAO
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class PurchaseQueueFullError(Exception):
+    # too many purchases are waiting already, the caller should retry later
+    pass
+
+
+class PurchaseQueue:
+    """
+    Queued purchase mode (Settings.PurchaseQueueEnabled): instead of one transaction per /purchase, requests are
+    queued per product and a few worker threads apply up to Settings.PurchaseBatchSize purchases of the same
+    product in one transaction (OrderDAO.purchase_batch). Under a flash sale the hot product row is locked once
+    per batch instead of once per purchase. Each caller waits on its own future for its own result, at most
+    Settings.PurchaseTimeout: a purchase still queued by then is cancelled and never applied.
+
+    A product is handled by one worker at a time, purchases of the same product are applied in arrival order.
+    """
+
+    _pending = OrderedDict()  # product_id -> deque of (user_id, quantity, idempotency, future), oldest product first
+    _active = set()  # products a worker is applying right now
+    _size = 0
+    _cond = threading.Condition()
+    _workers = []
+
+    @staticmethod
+    def submit(user_id, product_id, quantity, idempotency=None):
+        # return a Future with the purchase_product-like result dict
+        # idempotency: Idempotency-Key of the request, saved in the batch transaction (see OrderDAO.purchase_batch)
+        future = Future()
+        with PurchaseQueue._cond:
+            if PurchaseQueue._size >= Settings.PurchaseQueueMaxSize:
+                raise PurchaseQueueFullError("Purchase queue is full.")
+            PurchaseQueue._start_workers()
+            PurchaseQueue._pending.setdefault(product_id, deque()).append((user_id, quantity, idempotency, future))
+            PurchaseQueue._size += 1
+            PurchaseQueue._cond.notify()
+        return future
+
+    @staticmethod
+    def _start_workers():
+        # caller holds the lock, workers start on first use
+        if not PurchaseQueue._workers:
+            for i in range(Settings.PurchaseWorkers):
+                worker = threading.Thread(target=PurchaseQueue._work, name=f"purchase-worker-{i}", daemon=True)
+                worker.start()
+                PurchaseQueue._workers.append(worker)
+
+    @staticmethod
+    def _take_batch():
+        # block until a product nobody is working on has queued purchases, take up to PurchaseBatchSize of them
+        with PurchaseQueue._cond:
+            while True:
+                product_id = next((product_id for product_id in PurchaseQueue._pending
+                                   if product_id not in PurchaseQueue._active), None)
+                if product_id is None:
+                    PurchaseQueue._cond.wait()
+                    continue
+                queued = PurchaseQueue._pending[product_id]
+                batch = [queued.popleft() for _ in range(min(len(queued), Settings.PurchaseBatchSize))]
+                if not queued:
+                    del PurchaseQueue._pending[product_id]
+                PurchaseQueue._size -= len(batch)
+                # a caller that timed out cancelled its future, its purchase is dropped; the others can no
+                # longer be cancelled, their callers learn the outcome even if it comes late
+                batch = [entry for entry in batch if entry[-1].set_running_or_notify_cancel()]
+                if batch:
+                    PurchaseQueue._active.add(product_id)
+                    return product_id, batch
+
+    @staticmethod
+    def _work():
+        while True:
+            product_id, batch = PurchaseQueue._take_batch()
+            try:
+                purchases = [(user_id, quantity, idempotency) for user_id, quantity, idempotency, _ in batch]
+                results = OrderDAO.purchase_batch(product_id, purchases)
+                if results is None:
+                    results = [{"status": OrderDAO.PURCHASE_FAILED}] * len(batch)
+                for (_, _, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error("Purchase worker failed on product_id=%s: %s", product_id, e)
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_result({"status": OrderDAO.PURCHASE_FAILED})
+            finally:
+                with PurchaseQueue._cond:
+                    PurchaseQueue._active.discard(product_id)
+                    PurchaseQueue._cond.notify_all()  # purchases of this product queued meanwhile can go now
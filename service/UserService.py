@@ -1,24 +1,34 @@
-import bcrypt
+import hashlib
+import time
 import jwt
 from dao.UserDAO import UserDAO
 from datetime import datetime, timedelta, timezone
 from config.config import Config
+from config.settings import Settings
+from util.Cache import TTLCache
 from log.log import get_logger
+from util.UnitOfWork import UnitOfWork
+from util.PasswordHasher import PasswordHasher, HasherBusyError
 
 logger = get_logger(__name__)
 
 SECRET_KEY = Config.UserServiceSecretKey  # Import secret key from config
 
+BUSY_RESULT = {"success": False, "busy": True, "message": "Server is busy, please try again later."}
+
 
 class UserService:
 
+    # sha256 of a token -> its verified identity, each entry expires at the token's exp
+    token_cache = TTLCache(maxsize=Settings.TokenCacheMaxSize, ttl=0, name="token_cache")
+
     @staticmethod
     def register_user(username, password, role="user"):
-        logger.info(f"Attempting to register user: username={username}, role={role}")
+        logger.info("Attempting to register user: username=%s, role=%s", username, role)
         
         # Validate username and password
         if UserDAO.get_user_by_username(username):
-            logger.warning(f"Registration failed: Username already exists. username={username}")
+            logger.warning("Registration failed: Username already exists. username=%s", username)
             return {"success": False, "message": "Username already exists."}
         if not username.isalnum():
             logger.warning("Registration failed: Username contains invalid characters.")
@@ -31,21 +41,34 @@ class UserService:
             return {"success": False, "message": "Password length must be in 6 to 20."}
         
         # Hash the password and create user
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        user_id = UserDAO.create_user(username, hashed_password.decode('utf-8'), role)
+        UnitOfWork.commit_and_release()  # do not hold a pooled connection while hashing
+        try:
+            hashed_password = PasswordHasher.hash_password(password)
+        except HasherBusyError:
+            logger.warning("Registration rejected, password hashing is saturated. username=%s", username)
+            return dict(BUSY_RESULT)
+        user_id = UserDAO.create_user(username, hashed_password, role)
         if user_id:
-            logger.info(f"User registered successfully: username={username}, user_id={user_id}")
+            logger.info("User registered successfully: username=%s, user_id=%s", username, user_id)
             return {"success": True, "message": "User registered successfully.", "user_id": user_id}
-        logger.error(f"Failed to register user: username={username}")
+        logger.error("Failed to register user: username=%s", username)
         return {"success": False, "message": "Failed to register user."}
 
     @staticmethod
     def login_user(username, password):
-        logger.info(f"Attempting to login user: username={username}")
+        logger.info("Attempting to login user: username=%s", username)
         user = UserDAO.get_user_by_username(username)
-        if not user or not bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
-            logger.warning(f"Login failed: Invalid username or password. username={username}")
+        UnitOfWork.commit_and_release()  # do not hold a pooled connection while checking the password
+        try:
+            valid = user is not None and PasswordHasher.check_password(password, user.password)
+        except HasherBusyError:
+            logger.warning("Login rejected, password checking is saturated. username=%s", username)
+            return dict(BUSY_RESULT)
+        if not valid:
+            logger.warning("Login failed: Invalid username or password. username=%s", username)
             return {"success": False, "message": "Invalid username or password."}
+        if PasswordHasher.needs_rehash(user.password):
+            UserService._rehash_password(user, password)
 
         # Generate JWT token
         payload = {
@@ -55,98 +78,149 @@ class UserService:
             "exp": datetime.now(timezone.utc) + timedelta(hours=2)
         }
         token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
-        logger.info(f"User logged in successfully: username={username}, user_id={user.id}")
+        logger.info("User logged in successfully: username=%s, user_id=%s", username, user.id)
         return {"success": True, "message": "Login successful.", "token": token, "payload": payload}
 
+    @staticmethod
+    def verify_token(token):
+        # return the identity (user_id, username, role, exp) of a valid, unexpired token, None otherwise
+        # the signature is only checked the first time a token is seen, then the claims come from token_cache
+        if not token:
+            return None
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        identity = UserService.token_cache.get(key)
+        if identity is not None:
+            return identity
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], options={"require": ["exp"]})
+        except jwt.InvalidTokenError as e:
+            logger.info("Rejected token: %s", e)
+            return None
+        identity = {
+            "user_id": claims["user_id"],
+            "username": claims["username"],
+            "role": claims["role"],
+            "exp": claims["exp"],
+        }
+        ttl = claims["exp"] - time.time()
+        if ttl > 0:
+            UserService.token_cache.put(key, identity, ttl=ttl)
+        return identity
+
+    @staticmethod
+    def _rehash_password(user, password):
+        # the hash was made with another BCRYPT_ROUNDS, store a new one now that we have the password
+        # best effort: the login still succeeds if this fails
+        try:
+            if UserDAO.update_password(user.id, PasswordHasher.hash_password(password)):
+                logger.info("Rehashed password of user_id=%s with the configured cost.", user.id)
+        except HasherBusyError:
+            logger.info("Skipped password rehash of user_id=%s, hashing is saturated.", user.id)
+
     @staticmethod
     def get_all_users():
         logger.info("Fetching all users.")
         users = UserDAO.get_all_users()
         filtered_users = [{"user_id": user.id, "username": user.username, "role": user.role, "deposit": user.deposit} for user in users]
-        logger.info(f"Fetched {len(users)} users.")
+        logger.info("Fetched %s users.", len(users))
         return {"success": True, "users": filtered_users}
 
+    @staticmethod
+    def iter_all_users():
+        # streaming version of get_all_users, yields one user dict at a time
+        logger.info("Streaming all users.")
+        for user in UserDAO.iter_all_users():
+            yield {"user_id": user.id, "username": user.username, "role": user.role, "deposit": user.deposit}
+
     @staticmethod
     def get_current_deposit_by_id(user_id):
-        logger.info(f"Fetching deposit for user_id={user_id}.")
+        logger.info("Fetching deposit for user_id=%s.", user_id)
         user = UserDAO.get_user_by_id(user_id)
         if not user:
-            logger.warning(f"User not found: user_id={user_id}")
+            logger.warning("User not found: user_id=%s", user_id)
             return {"success": False, "deposit": 0.00, "message": f"User with id {user_id} does not exist."}
         return {"success": True, "deposit": float(user.deposit)}
 
     @staticmethod
     def add_money_to_deposit_by_id(user_id, amount):
-        logger.info(f"Adding money to deposit: user_id={user_id}, amount={amount}")
+        logger.info("Adding money to deposit: user_id=%s, amount=%s", user_id, amount)
         if amount <= 0:
             logger.warning("Invalid deposit amount: Amount must be positive.")
             return {"success": False, "message": "Amount must be positive."}
 
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found: user_id={user_id}")
+        # one server side update, the new deposit is read back on the same connection
+        result = UserDAO.add_to_deposit_by_id(user_id, amount)
+        if result is None:
+            logger.error("Failed to update deposit: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to update deposit."}
+        updated, new_deposit = result
+        if new_deposit is None:
+            logger.warning("User not found: user_id=%s", user_id)
             return {"success": False, "message": f"User with id {user_id} does not exist."}
+        if not updated:
+            logger.error("Failed to update deposit: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to update deposit."}
 
-        new_deposit = user.deposit + amount
-        if UserDAO.update_user_deposit_by_id(user_id, new_deposit) > 0:
-            logger.info(f"Deposit updated successfully: user_id={user_id}, new_deposit={new_deposit}")
-            return {"success": True, "message": f"Deposit updated successfully. New deposit: {new_deposit}"}
-        logger.error(f"Failed to update deposit: user_id={user_id}")
-        return {"success": False, "message": "Failed to update deposit."}
+        logger.info("Deposit updated successfully: user_id=%s, new_deposit=%s", user_id, new_deposit)
+        return {"success": True, "message": f"Deposit updated successfully. New deposit: {new_deposit}", "deposit": float(new_deposit)}
 
     @staticmethod
     def minus_money_to_deposit_by_id(user_id, amount):
-        logger.info(f"Deducting money from deposit: user_id={user_id}, amount={amount}")
+        logger.info("Deducting money from deposit: user_id=%s, amount=%s", user_id, amount)
         if amount <= 0:
             logger.warning("Invalid deduction amount: Amount must be positive.")
             return {"success": False, "message": "Amount must be positive."}
 
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found: user_id={user_id}")
+        # guarded server side update, it only happens if the deposit stays >= 0
+        result = UserDAO.add_to_deposit_by_id(user_id, -amount)
+        if result is None:
+            logger.error("Failed to deduct deposit: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to update deposit."}
+        updated, new_deposit = result
+        if new_deposit is None:
+            logger.warning("User not found: user_id=%s", user_id)
             return {"success": False, "message": f"User with id {user_id} does not exist."}
-
-        if user.deposit < amount:
-            logger.warning(f"Insufficient deposit: user_id={user_id}, current_deposit={user.deposit}, requested_deduction={amount}")
+        if not updated:
+            logger.warning("Insufficient deposit: user_id=%s, current_deposit=%s, requested_deduction=%s", user_id, new_deposit, amount)
             return {"success": False, "message": "Insufficient deposit."}
 
-        new_deposit = user.deposit - amount
-        if UserDAO.update_user_deposit_by_id(user_id, new_deposit) > 0:
-            logger.info(f"Deposit deducted successfully: user_id={user_id}, new_deposit={new_deposit}")
-            return {"success": True, "message": f"Deposit updated successfully. New deposit: {new_deposit}"}
-        logger.error(f"Failed to deduct deposit: user_id={user_id}")
-        return {"success": False, "message": "Failed to update deposit."}
+        logger.info("Deposit deducted successfully: user_id=%s, new_deposit=%s", user_id, new_deposit)
+        return {"success": True, "message": f"Deposit updated successfully. New deposit: {new_deposit}", "deposit": float(new_deposit)}
 
     @staticmethod
     def delete_user_by_id(user_id):
-        logger.info(f"Attempting to delete user: user_id={user_id}")
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found: user_id={user_id}")
-            return {"success": False, "message": "User not found."}
-        if user.role == 'admin':
-            logger.warning(f"Cannot delete admin user: user_id={user_id}")
-            return {"success": False, "message": "Cannot delete admin users."}
-
-        if UserDAO.delete_user_by_id(user_id) > 0:
-            logger.info(f"User deleted successfully: user_id={user_id}")
-            return {"success": True, "message": "User deleted successfully."}
-        logger.error(f"Failed to delete user: user_id={user_id}")
-        return {"success": False, "message": "Failed to delete user."}
+        logger.info("Attempting to delete user: user_id=%s", user_id)
+        # read and write share one connection and one transaction
+        with UnitOfWork():
+            user = UserDAO.get_user_by_id(user_id)
+            if not user:
+                logger.warning("User not found: user_id=%s", user_id)
+                return {"success": False, "message": "User not found."}
+            if user.role == 'admin':
+                logger.warning("Cannot delete admin user: user_id=%s", user_id)
+                return {"success": False, "message": "Cannot delete admin users."}
+
+            if UserDAO.delete_user_by_id(user_id) > 0:
+                logger.info("User deleted successfully: user_id=%s", user_id)
+                return {"success": True, "message": "User deleted successfully."}
+            logger.error("Failed to delete user: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to delete user."}
 
     @staticmethod
     def update_user_role_by_user_id(user_id, role):
-        logger.info(f"Updating user role: user_id={user_id}, new_role={role}")
-        user = UserDAO.get_user_by_id(user_id)
-        if not user:
-            logger.warning(f"User not found: user_id={user_id}")
-            return {"success": False, "message": "User not found."}
-        if user.role == 'admin' and role != 'admin':
-            logger.warning(f"Cannot change role of admin user: user_id={user_id}")
-            return {"success": False, "message": "Cannot change role of admin users."}
-
-        if UserDAO.update_role_by_id(user_id, role) > 0:
-            logger.info(f"User role updated successfully: user_id={user_id}, new_role={role}")
-            return {"success": True, "message": f"User role updated to {role}."}
-        logger.error(f"Failed to update user role: user_id={user_id}")
-        return {"success": False, "message": "Failed to update user role."}
+        logger.info("Updating user role: user_id=%s, new_role=%s", user_id, role)
+        # read and write share one connection and one transaction
+        with UnitOfWork():
+            user = UserDAO.get_user_by_id(user_id)
+            if not user:
+                logger.warning("User not found: user_id=%s", user_id)
+                return {"success": False, "message": "User not found."}
+            if user.role == 'admin' and role != 'admin':
+                logger.warning("Cannot change role of admin user: user_id=%s", user_id)
+                return {"success": False, "message": "Cannot change role of admin users."}
+
+            if UserDAO.update_role_by_id(user_id, role) > 0:
+                logger.info("User role updated successfully: user_id=%s, new_role=%s", user_id, role)
+                return {"success": True, "message": f"User role updated to {role}."}
+            logger.error("Failed to update user role: user_id=%s", user_id)
+            return {"success": False, "message": "Failed to update user role."}
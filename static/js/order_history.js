@@ -4,6 +4,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     const loadingMessage = document.getElementById('loading-message');
     const ordersTable = document.getElementById('orders-table');
     const ordersTableBody = document.getElementById('orders-table-body');
+    const loadMoreButton = document.getElementById('load-more-button');
 
     // Logout button functionality
     logoutButton.addEventListener('click', async () => {
@@ -18,30 +19,68 @@ document.addEventListener('DOMContentLoaded', async () => {
         window.location.href = '/welcome'; // Redirect to welcome page
     });
 
-    // Function to load product image
-    function loadProductImage(imgElement, productName) {
-        const formats = ['jpg', 'png', 'jpeg', 'gif'];
-        let formatIndex = 0;
-
-        function tryNextFormat() {
-            if (formatIndex < formats.length) {
-                imgElement.src = `/static/img/${productName
-                    .replace(/\s+/g, '_')                       // replace space to _
-                    .replace(/[^a-zA-Z0-9\u4e00-\u9fa5_]/g, '') // remove non alpha/number/chinese/underscore characters
-                }.${formats[formatIndex]}`;
-                formatIndex++;
-            } else {
-                imgElement.src = '/static/img/default.jpg'; // Fallback image
-            }
+    // Product image from the URLs in the payload: WebP thumbnail when the browser supports it, thumbnail otherwise
+    function createProductImage(image, alt) {
+        const picture = document.createElement('picture');
+        if (image.webp) {
+            const source = document.createElement('source');
+            source.srcset = image.webp;
+            source.type = 'image/webp';
+            picture.appendChild(source);
         }
+        const img = document.createElement('img');
+        img.src = image.thumb;
+        img.alt = alt;
+        img.loading = 'lazy';
+        picture.appendChild(img);
+        return picture;
+    }
+
+    // Render one order row
+    function renderOrder(order) {
+        const row = document.createElement('tr');
+
+        const orderIdCell = document.createElement('td');
+        orderIdCell.textContent = order.id;
+        row.appendChild(orderIdCell);
+
+        const productIdCell = document.createElement('td');
+        productIdCell.textContent = order.product_id;
+        row.appendChild(productIdCell);
+
+        const productNameCell = document.createElement('td');
+        productNameCell.textContent = order.product_name || 'Unknown';
+        row.appendChild(productNameCell);
+
+        // const productPriceCell = document.createElement('td');
+        // productPriceCell.textContent = order.product_price;
+        // row.appendChild(productPriceCell);
+
+        const productImageCell = document.createElement('td');
+        productImageCell.appendChild(createProductImage(order.product_image, order.product_name));
+        row.appendChild(productImageCell);
 
-        imgElement.onerror = tryNextFormat;
-        tryNextFormat(); // Start trying the first format
+        const quantityCell = document.createElement('td');
+        quantityCell.textContent = order.quantity;
+        row.appendChild(quantityCell);
+
+        const orderDateCell = document.createElement('td');
+        orderDateCell.textContent = new Date(order.order_date).toLocaleString();
+        row.appendChild(orderDateCell);
+
+        ordersTableBody.appendChild(row);
     }
 
-    // Load user's order history
-    try {
-        const response = await fetch('/user/orders', { method: 'GET' });
+    // Orders are loaded newest first, one page at a time
+    const ORDER_PAGE_SIZE = 50;
+    let nextOrderCursor = null;
+
+    async function loadOrderPage(cursor) {
+        const params = new URLSearchParams({ limit: ORDER_PAGE_SIZE });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        const response = await fetch(`/user/orders?${params}`, { method: 'GET' });
         if (!response.ok) {
             throw new Error('Failed to fetch order history');
         }
@@ -51,43 +90,22 @@ document.addEventListener('DOMContentLoaded', async () => {
             throw new Error(result.message || 'Failed to fetch order history');
         }
 
-        // Populate order table
-        result.orders.forEach(order => {
-            const row = document.createElement('tr');
-
-            const orderIdCell = document.createElement('td');
-            orderIdCell.textContent = order.id;
-            row.appendChild(orderIdCell);
-
-            const productIdCell = document.createElement('td');
-            productIdCell.textContent = order.product_id;
-            row.appendChild(productIdCell);
-
-            const productNameCell = document.createElement('td');
-            productNameCell.textContent = order.product_name || 'Unknown';
-            row.appendChild(productNameCell);
-
-            // const productPriceCell = document.createElement('td');
-            // productPriceCell.textContent = order.product_price;
-            // row.appendChild(productPriceCell);
-
-            const productImageCell = document.createElement('td');
-            const productImg = document.createElement('img');
-            loadProductImage(productImg, order.product_name || 'Unknown');
-            productImageCell.appendChild(productImg);
-            row.appendChild(productImageCell);
-
-            const quantityCell = document.createElement('td');
-            quantityCell.textContent = order.quantity;
-            row.appendChild(quantityCell);
-
-            const orderDateCell = document.createElement('td');
-            orderDateCell.textContent = new Date(order.order_date).toLocaleString();
-            row.appendChild(orderDateCell);
+        result.orders.forEach(renderOrder);
+        nextOrderCursor = result.next_cursor;
+        loadMoreButton.style.display = nextOrderCursor ? 'inline-block' : 'none';
+    }
 
-            ordersTableBody.appendChild(row);
-        });
+    loadMoreButton.addEventListener('click', async () => {
+        try {
+            await loadOrderPage(nextOrderCursor);
+        } catch (error) {
+            alert(`Error loading orders: ${error.message}`);
+        }
+    });
 
+    // Load user's order history
+    try {
+        await loadOrderPage(null);
         loadingMessage.style.display = 'none';
         ordersTable.style.display = 'table';
     } catch (error) {
@@ -19,30 +19,14 @@ document.getElementById('admin-dashboard-button').addEventListener('click', asyn
     }
 });
 
-// Load current user information
-async function loadCurrentUser() {
-    try {
-        const usernameResponse = await fetch('/user/username');
-        const usernameResult = await usernameResponse.json();
-        if (!usernameResult.username) {
-            throw new Error('Failed to retrieve username.');
-        }
-        document.getElementById('current-username').textContent = usernameResult.username;
-
-        const depositResponse = await fetch('/user/deposit');
-        const depositResult = await depositResponse.json();
-        if (!depositResult.success) {
-            throw new Error(depositResult.message || 'Failed to retrieve deposit.');
-        }
-        document.getElementById('current-deposit').textContent = depositResult.deposit.toFixed(2);
-    } catch (error) {
-        alert(`Failed to load user information: ${error.message}`);
-        console.error(error);
-    }
+// Show current user information, it comes with /bootstrap and with the deposit / purchase responses
+function showCurrentUser(username) {
+    document.getElementById('current-username').textContent = username;
 }
 
-// Load user info when page is loaded
-loadCurrentUser();
+function showDeposit(deposit) {
+    document.getElementById('current-deposit').textContent = deposit.toFixed(2);
+}
 
 // Add deposit functionality
 document.getElementById('add-deposit-button').addEventListener('click', async () => {
@@ -66,7 +50,7 @@ document.getElementById('add-deposit-button').addEventListener('click', async ()
         const result = await response.json();
         if (response.ok && result.success) {
             alert('Deposit updated successfully!');
-            await loadCurrentUser(); // Reload user information
+            showDeposit(result.deposit); // the response has the new deposit
             addDepositInput.value = ''; // Clear input field
         } else {
             alert(`Failed to update deposit: ${result.message}`);
@@ -77,136 +61,156 @@ document.getElementById('add-deposit-button').addEventListener('click', async ()
     }
 });
 
-// Load products on page load
+// Products are loaded one page at a time, see /products?limit=&cursor=
+const PRODUCT_PAGE_SIZE = 50;
+let nextProductCursor = null;
+
+// Product image from the URLs in the payload: WebP thumbnail when the browser supports it, thumbnail otherwise
+function createProductImage(image, alt) {
+    const picture = document.createElement('picture');
+    if (image.webp) {
+        const source = document.createElement('source');
+        source.srcset = image.webp;
+        source.type = 'image/webp';
+        picture.appendChild(source);
+    }
+    const img = document.createElement('img');
+    img.src = image.thumb;
+    img.alt = alt;
+    img.loading = 'lazy';
+    picture.appendChild(img);
+    return picture;
+}
+
+function renderProduct(product, tableBody) {
+    const row = document.createElement('tr');
+    const idCell = document.createElement('td');
+    idCell.textContent = product.id;
+    row.appendChild(idCell);
+
+    const imageCell = document.createElement('td');
+    imageCell.appendChild(createProductImage(product.image, product.name));
+    row.appendChild(imageCell);
+
+    const nameCell = document.createElement('td');
+    nameCell.textContent = product.name;
+    row.appendChild(nameCell);
+
+    const priceCell = document.createElement('td');
+    const price = parseFloat(product.price) || 0.0;
+    priceCell.textContent = `$${price.toFixed(2)}`;
+    row.appendChild(priceCell);
+
+    const inventoryCell = document.createElement('td');
+    inventoryCell.textContent = product.inventory;
+    inventoryCell.setAttribute('data-inventory', product.inventory); // 保存库存信息
+    row.appendChild(inventoryCell);
+
+    // Category
+    const categoryCell = document.createElement('td');
+    categoryCell.textContent = product.category || 'N/A'; // show N/A if empty
+    row.appendChild(categoryCell);
+
+    // Description
+    const descriptionCell = document.createElement('td');
+    descriptionCell.textContent = product.description || 'N/A'; // show N/A if empty
+    row.appendChild(descriptionCell);
+
+    const purchaseCell = document.createElement('td');
+    const quantityInput = document.createElement('input');
+    quantityInput.type = 'number';
+    quantityInput.min = 1;
+    quantityInput.max = product.inventory;
+    quantityInput.value = 1;
+    quantityInput.style.width = '50px';
+
+    const purchaseButton = document.createElement('button');
+    purchaseButton.textContent = 'Buy';
+    
+    purchaseButton.addEventListener('click', async () => {
+        const quantity = parseInt(quantityInput.value);
+        if (isNaN(quantity) || quantity < 1 || quantity > product.inventory) {
+            alert('Invalid quantity');
+            return;
+        }
+    
+        try {
+            // 调用 /purchase 路由
+            const response = await fetch('/purchase', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    product_id: product.id,
+                    quantity: quantity
+                })
+            });
+    
+            const result = await response.json();
+            if (!response.ok || !result.success) {
+                throw new Error(result.message || 'Failed to process purchase');
+            }
+    
+            // 更新页面显示, the response has the new inventory and deposit
+            product.inventory = result.inventory;
+            inventoryCell.textContent = product.inventory;
+            inventoryCell.setAttribute('data-inventory', product.inventory);
+            quantityInput.max = product.inventory;
+            showDeposit(result.deposit);
+    
+            alert('Purchase successful');
+        } catch (error) {
+            alert(`Error processing purchase: ${error.message}`);
+        }
+    });            
+
+    purchaseCell.appendChild(quantityInput);
+    purchaseCell.appendChild(purchaseButton);
+    row.appendChild(purchaseCell);
+
+    tableBody.appendChild(row);
+}
+
+async function loadProductPage(cursor) {
+    const params = new URLSearchParams({ limit: PRODUCT_PAGE_SIZE });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`/products?${params}`, { method: 'GET' });
+    if (!response.ok) {
+        throw new Error('Failed to fetch products');
+    }
+
+    const result = await response.json();
+    if (!result.success) {
+        throw new Error(result.message || 'Failed to fetch products');
+    }
+    showProductPage(result);
+}
+
+function showProductPage(result) {
+    const tableBody = document.getElementById('product-table-body');
+    result.products.forEach(product => renderProduct(product, tableBody));
+
+    nextProductCursor = result.next_cursor;
+    document.getElementById('load-more-button').style.display = nextProductCursor ? 'inline-block' : 'none';
+}
+
+// One request on page load: username, deposit and the first page of products
 document.addEventListener('DOMContentLoaded', async () => {
     const table = document.getElementById('product-table');
-    const tableBody = document.getElementById('product-table-body');
     const loadingMessage = document.getElementById('loading-message');
 
     try {
-        const response = await fetch('/products', { method: 'GET' });
-        if (!response.ok) {
-            throw new Error('Failed to fetch products');
-        }
-
+        const response = await fetch(`/bootstrap?limit=${PRODUCT_PAGE_SIZE}`, { method: 'GET' });
         const result = await response.json();
-        if (!result.success) {
-            throw new Error(result.message || 'Failed to fetch products');
+        if (!response.ok || !result.success) {
+            throw new Error(result.message || 'Failed to load page');
         }
-
-        result.products.forEach(product => {
-            const row = document.createElement('tr');
-            const idCell = document.createElement('td');
-            idCell.textContent = product.id;
-            row.appendChild(idCell);
-
-            const imageCell = document.createElement('td');
-            const img = document.createElement('img');
-            // 定义支持的图片格式
-            const formats = ['jpg', 'png', 'jpeg', 'gif'];
-            let formatIndex = 0;
-            // 尝试加载不同格式的图片
-            function tryNextFormat() {
-                if (formatIndex < formats.length) {
-                    img.src = `/static/img/${product.name
-                        .replace(/\s+/g, '_')                 // 替换空格为下划线
-                        .replace(/[^a-zA-Z0-9\u4e00-\u9fa5_]/g, '') // 移除非英文字母、数字、汉字和下划线的字符
-                    }.${formats[formatIndex]}`;
-                    formatIndex++;
-                } else {
-                    // 如果所有格式都失败，则使用默认图片
-                    img.src = '/static/img/default.jpg';
-                }
-            }
-            // 当图片加载失败时尝试下一个格式
-            img.onerror = tryNextFormat;
-            // 开始尝试加载第一种格式
-            tryNextFormat();
-            img.alt = product.name;
-            imageCell.appendChild(img);
-            row.appendChild(imageCell);
-
-            const nameCell = document.createElement('td');
-            nameCell.textContent = product.name;
-            row.appendChild(nameCell);
-
-            const priceCell = document.createElement('td');
-            const price = parseFloat(product.price) || 0.0;
-            priceCell.textContent = `$${price.toFixed(2)}`;
-            row.appendChild(priceCell);
-
-            const inventoryCell = document.createElement('td');
-            inventoryCell.textContent = product.inventory;
-            inventoryCell.setAttribute('data-inventory', product.inventory); // 保存库存信息
-            row.appendChild(inventoryCell);
-
-            // Category
-            const categoryCell = document.createElement('td');
-            categoryCell.textContent = product.category || 'N/A'; // show N/A if empty
-            row.appendChild(categoryCell);
-
-            // Description
-            const descriptionCell = document.createElement('td');
-            descriptionCell.textContent = product.description || 'N/A'; // show N/A if empty
-            row.appendChild(descriptionCell);
-
-            const purchaseCell = document.createElement('td');
-            const quantityInput = document.createElement('input');
-            quantityInput.type = 'number';
-            quantityInput.min = 1;
-            quantityInput.max = product.inventory;
-            quantityInput.value = 1;
-            quantityInput.style.width = '50px';
-
-            const purchaseButton = document.createElement('button');
-            purchaseButton.textContent = 'Buy';
-            
-            purchaseButton.addEventListener('click', async () => {
-                const quantity = parseInt(quantityInput.value);
-                if (isNaN(quantity) || quantity < 1 || quantity > product.inventory) {
-                    alert('Invalid quantity');
-                    return;
-                }
-            
-                try {
-                    // 调用 /purchase 路由
-                    const response = await fetch('/purchase', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            product_id: product.id,
-                            quantity: quantity
-                        })
-                    });
-            
-                    const result = await response.json();
-                    if (!response.ok || !result.success) {
-                        throw new Error(result.message || 'Failed to process purchase');
-                    }
-            
-                    // 更新页面显示
-                    product.inventory -= quantity;
-                    inventoryCell.textContent = product.inventory;
-                    quantityInput.max = product.inventory;
-            
-                    // 重新加载用户信息
-                    await loadCurrentUser();
-            
-                    alert('Purchase successful');
-                } catch (error) {
-                    alert(`Error processing purchase: ${error.message}`);
-                }
-            });            
-
-            purchaseCell.appendChild(quantityInput);
-            purchaseCell.appendChild(purchaseButton);
-            row.appendChild(purchaseCell);
-
-            tableBody.appendChild(row);
-        });
-
+        showCurrentUser(result.username);
+        showDeposit(result.deposit);
+        showProductPage(result);
         loadingMessage.style.display = 'none';
         table.style.display = 'table';
     } catch (error) {
@@ -214,6 +218,15 @@ document.addEventListener('DOMContentLoaded', async () => {
     }
 });
 
+// Load more button appends the next page
+document.getElementById('load-more-button').addEventListener('click', async () => {
+    try {
+        await loadProductPage(nextProductCursor);
+    } catch (error) {
+        alert(`Error loading products: ${error.message}`);
+    }
+});
+
 // Order History button
 document.getElementById('my-orders-button').addEventListener('click', () => {
     window.location.href = '/order_history'; // Redirect to order history page
@@ -0,0 +1,75 @@
+import time
+import unittest
+from unittest.mock import patch
+from dao.ProductDAO import ProductDAO
+from util.Cache import TTLCache
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TTLCache(maxsize=2, ttl=60, name="test_cache")
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return {"id": 1, "name": "Test Product"}
+
+    def test_read_through(self):
+        # second read should be served from the cache
+        self.cache.get_or_load(1, self.loader)
+        value = self.cache.get_or_load(1, self.loader)
+        self.assertEqual(value["name"], "Test Product")
+        self.assertEqual(self.loads, 1, "Loader should only run on the first miss")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_invalidate(self):
+        self.cache.get_or_load(1, self.loader)
+        self.cache.invalidate(1)
+        self.cache.get_or_load(1, self.loader)
+        self.assertEqual(self.loads, 2, "Invalidated entry should be loaded again")
+
+    def test_lru_eviction(self):
+        self.cache.put(1, "a")
+        self.cache.put(2, "b")
+        self.cache.get(1)  # 1 is now the most recently used
+        self.cache.put(3, "c")
+        self.assertIsNone(self.cache.get(2), "Least recently used entry should be evicted")
+        self.assertEqual(self.cache.get(1), "a")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_stale_served_when_loader_fails(self):
+        # inside the stale window the old value is served, the failing reload runs in the background
+        cache = TTLCache(maxsize=10, ttl=0.01, stale_ttl=5, name="test_cache")
+        cache.put(1, "old")
+        time.sleep(0.03)  # past the fresh window only
+
+        def failing_loader():
+            raise RuntimeError("database is down")
+
+        self.assertEqual(cache.get_or_load(1, failing_loader), "old")
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+    def test_not_served_past_stale_window(self):
+        cache = TTLCache(maxsize=10, ttl=0.01, stale_ttl=0.01, name="test_cache")
+        cache.put(1, "old")
+        time.sleep(0.03)  # past the fresh and the stale window
+
+        def failing_loader():
+            raise RuntimeError("database is down")
+
+        with self.assertRaises(RuntimeError, msg="An entry past its stale window must not be served"):
+            cache.get_or_load(1, failing_loader)
+
+    def test_product_id_key_normalized(self):
+        # "5" from a request body and 5 are one entry, invalidated by either
+        rows = [{"id": 5, "name": "Old"}, {"id": 5, "name": "New"}]
+        with patch.object(ProductDAO, "cache", self.cache), \
+                patch.object(ProductDAO, "_query_product_row_by_id", side_effect=lambda product_id: rows.pop(0)):
+            self.assertEqual(ProductDAO.get_product_by_id("5").name, "Old")
+            self.assertEqual(ProductDAO.get_product_by_id(5).name, "Old")
+            ProductDAO.invalidate_cache(5)
+            self.assertEqual(ProductDAO.get_product_by_id("5").name, "New")
+            self.assertIsNone(ProductDAO.get_product_by_id("five"))
+
+if __name__ == '__main__':
+    unittest.main()
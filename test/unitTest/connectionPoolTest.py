@@ -0,0 +1,123 @@
+import threading
+import time
+import unittest
+from util.ConnectionPool import ConnectionPool, PoolTimeoutError
+
+class FakeConnection:
+    # stands in for a mysql connection, the pool only needs these
+    def __init__(self):
+        self.in_transaction = False
+        self.unread_result = False
+        self.closed = False
+        self.pings = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+class FakeConnectionPool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection()
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = FakeConnectionPool("test", {}, pool_size=2, max_overflow=1, timeout=0.2, max_waiters=1)
+
+    def test_reuse_connection(self):
+        # a released connection is handed out again instead of opening a new one
+        connection = self.pool.checkout()
+        raw = connection._slot.cnx
+        connection.close()
+        connection = self.pool.checkout()
+        self.assertIs(connection._slot.cnx, raw)
+        self.assertEqual(self.pool.stats()["size"], 1)
+
+    def test_overflow_is_closed_on_release(self):
+        connections = [self.pool.checkout() for _ in range(3)]
+        overflow = connections[2]._slot.cnx
+        self.assertEqual(self.pool.stats()["overflow"], 1)
+        connections[2].close()
+        self.assertTrue(overflow.closed, "Overflow connection should be closed when released")
+        self.assertEqual(self.pool.stats()["overflow"], 0)
+
+    def test_timeout_when_exhausted(self):
+        connections = [self.pool.checkout() for _ in range(3)]
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.checkout()
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+        for connection in connections:
+            connection.close()
+
+    def test_reject_when_wait_queue_full(self):
+        # with max_waiters callers waiting already, the next one fails at once instead of waiting
+        connections = [self.pool.checkout() for _ in range(3)]
+        self.pool.timeout = 5
+        waiter = threading.Thread(target=lambda: self.pool.checkout().close())
+        waiter.start()
+        time.sleep(0.05)
+        start = time.perf_counter()
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.checkout()
+        self.assertLess(time.perf_counter() - start, 1, "Checkout should fail fast when the wait queue is full")
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+        self.assertEqual(self.pool.stats()["timeouts"], 0)
+        connections[0].close()
+        waiter.join()
+        for connection in connections[1:]:
+            connection.close()
+
+    def test_waiter_gets_released_connection(self):
+        connections = [self.pool.checkout() for _ in range(3)]
+        result = {}
+
+        def wait_for_connection():
+            result["connection"] = self.pool.checkout()
+
+        waiter = threading.Thread(target=wait_for_connection)
+        waiter.start()
+        time.sleep(0.05)
+        connections[0].close()
+        waiter.join()
+        self.assertIn("connection", result, "Waiting caller should get the released connection")
+
+    def test_warm_and_close(self):
+        self.assertEqual(self.pool.warm(), 2, "Warm up should open pool_size connections")
+        self.assertEqual(self.pool.stats()["idle"], 2)
+        raw = [slot.cnx for slot in self.pool._idle]
+        self.assertEqual(self.pool.close(), 2)
+        self.assertTrue(all(cnx.closed for cnx in raw), "Idle connections should be closed")
+        self.assertEqual(self.pool.stats()["size"], 0)
+
+    def test_double_close(self):
+        # closing the same checkout twice must not release the connection twice
+        connection = self.pool.checkout()
+        connection.close()
+        connection.close()
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_rollback_open_transaction_on_release(self):
+        connection = self.pool.checkout()
+        raw = connection._slot.cnx
+        raw.in_transaction = True
+        connection.close()
+        self.assertFalse(raw.in_transaction, "Open transaction should be rolled back on release")
+
+    def test_ping_only_after_idle(self):
+        # release and quick reuse never ping, an idle connection is validated on checkout
+        connection = self.pool.checkout()
+        raw = connection._slot.cnx
+        connection.close()
+        self.pool.checkout().close()
+        self.assertEqual(raw.pings, 0, "Connection should not be pinged when reused right away")
+        self.pool.validate_after_idle = 0
+        self.pool.checkout().close()
+        self.assertEqual(raw.pings, 1, "Idle connection should be pinged on checkout")
+
+if __name__ == '__main__':
+    unittest.main()
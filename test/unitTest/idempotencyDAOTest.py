@@ -0,0 +1,37 @@
+import unittest
+from dao.IdempotencyDAO import IdempotencyDAO
+from dao.UserDAO import UserDAO
+
+class TestIdempotencyDAO(unittest.TestCase):
+    def setUp(self):
+        self.user_id = UserDAO.create_user("testIdempotencyUser", "123", "user")
+
+    def tearDown(self):
+        if self.user_id:
+            UserDAO.delete_user(self.user_id)  # cascades to its keys
+
+    def test_claim_then_replay(self):
+        claim = IdempotencyDAO.claim(self.user_id, "key-1", "/purchase", "a" * 64)
+        self.assertEqual(claim["status"], IdempotencyDAO.CLAIMED)
+        self.assertTrue(IdempotencyDAO.save_response(self.user_id, "key-1", 200, '{"success": true}'))
+
+        claim = IdempotencyDAO.claim(self.user_id, "key-1", "/purchase", "a" * 64)
+        self.assertEqual(claim["status"], IdempotencyDAO.EXISTS, "Second claim of a key should return the stored row")
+        self.assertEqual(claim["status_code"], 200)
+        self.assertEqual(claim["response"], '{"success": true}')
+
+    def test_release(self):
+        IdempotencyDAO.claim(self.user_id, "key-2", "/purchase", "a" * 64)
+        self.assertTrue(IdempotencyDAO.release(self.user_id, "key-2"))
+        claim = IdempotencyDAO.claim(self.user_id, "key-2", "/purchase", "a" * 64)
+        self.assertEqual(claim["status"], IdempotencyDAO.CLAIMED, "Released key should be claimable again")
+
+    def test_find(self):
+        self.assertEqual(IdempotencyDAO.find(self.user_id, "key-3")["status"], IdempotencyDAO.MISSING)
+        IdempotencyDAO.claim(self.user_id, "key-3", "/purchase", "a" * 64)
+        found = IdempotencyDAO.find(self.user_id, "key-3")
+        self.assertEqual(found["status"], IdempotencyDAO.EXISTS)
+        self.assertIsNone(found["status_code"], "A claimed key has no response yet")
+
+if __name__ == '__main__':
+    unittest.main()
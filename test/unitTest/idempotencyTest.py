@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+from util.Idempotency import IdempotencyStore, IdempotencyTimeoutError
+
+class TestIdempotencyStore(unittest.TestCase):
+    def setUp(self):
+        self.store = IdempotencyStore(maxsize=2, ttl=60, name="idempotency_test")
+
+    def test_first_caller_holds_the_key(self):
+        self.assertIsNone(self.store.acquire((1, "a"), timeout=1))
+        self.store.put((1, "a"), {"status": 200})
+        self.store.release((1, "a"))
+        self.assertEqual(self.store.acquire((1, "a"), timeout=1), {"status": 200})
+
+    def test_duplicate_waits_for_first_response(self):
+        self.assertIsNone(self.store.acquire((1, "a"), timeout=1))
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.store.acquire((1, "a"), timeout=5)))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(results, [], "Duplicate should wait while the first request runs")
+        self.store.put((1, "a"), {"status": 200})
+        self.store.release((1, "a"))
+        waiter.join(5)
+        self.assertEqual(results, [{"status": 200}])
+
+    def test_duplicate_takes_key_if_first_stored_nothing(self):
+        # the first request was rolled back, the duplicate has to run it
+        self.assertIsNone(self.store.acquire((1, "a"), timeout=1))
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.store.acquire((1, "a"), timeout=5)))
+        waiter.start()
+        time.sleep(0.05)
+        self.store.release((1, "a"))
+        waiter.join(5)
+        self.assertEqual(results, [None])
+
+    def test_wait_timeout(self):
+        self.assertIsNone(self.store.acquire((1, "a"), timeout=1))
+        with self.assertRaises(IdempotencyTimeoutError):
+            self.store.acquire((1, "a"), timeout=0.05)
+
+    def test_keys_are_per_user(self):
+        self.assertIsNone(self.store.acquire((1, "a"), timeout=1))
+        self.assertIsNone(self.store.acquire((2, "a"), timeout=0.05))
+
+    def test_bounded(self):
+        for i in range(3):
+            self.store.put((1, str(i)), {"status": 200})
+        self.assertIsNone(self.store.acquire((1, "0"), timeout=1), "Oldest response should be evicted")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from dao.ProductDAO import ProductDAO
+from service.ImageService import ImageService
+from service.ProductService import ProductService
+from util.ConnectionPool import ConnectionPool
+from util.DatabaseConnection import DBConnector
+from util.UnitOfWork import UnitOfWork
+
+class FakeConnection:
+    # stands in for a mysql connection, the unit of work only commits
+    def __init__(self):
+        self.in_transaction = False
+        self.unread_result = False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeConnectionPool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection()
+
+class TestImageService(unittest.TestCase):
+    def setUp(self):
+        # work on a copy of static/img so the real manifest is not touched
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        for name in ("hat.jpg", "another_red_hat.jpg", "default.jpg"):
+            shutil.copyfile(os.path.join(ImageService.SOURCE_DIR, name), os.path.join(self.source_dir, name))
+        build_dir = os.path.join(self.source_dir, "build")
+        patcher = patch.multiple(ImageService, SOURCE_DIR=self.source_dir, BUILD_DIR=build_dir,
+                                 MANIFEST_FILE=os.path.join(build_dir, "manifest.json"), _manifest=None, _building=set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def built_urls(self, product_id, name):
+        # the first lookup queues the build, wait for it and look up again
+        ImageService.image_urls(product_id, name)
+        ImageService.shutdown()
+        return ImageService.image_urls(product_id, name)
+
+    def test_image_urls(self):
+        urls = self.built_urls(1, "hat")
+        self.assertTrue(urls["src"].startswith(ImageService.URL_PREFIX))
+        self.assertTrue(os.path.isfile(os.path.join(ImageService.BUILD_DIR, urls["src"][len(ImageService.URL_PREFIX):])))
+        self.assertTrue(os.path.isfile(ImageService.MANIFEST_FILE), "Manifest should be saved")
+
+    def test_miss_not_built_on_request_thread(self):
+        submitted = []
+        with patch.object(ImageService, "_get_executor", return_value=SimpleNamespace(submit=lambda *args: submitted.append(args))):
+            urls = ImageService.image_urls(1, "hat")
+            ImageService.image_urls(1, "hat")
+        self.assertEqual(urls, ImageService._default_urls(), "A missing entry should get the default image")
+        self.assertNotIn("1", ImageService._get_manifest()["products"])
+        self.assertEqual(len(submitted), 1, "The build should be queued once")
+
+    def test_same_content_shares_files(self):
+        self.assertEqual(self.built_urls(1, "hat"), self.built_urls(2, "another red hat"))
+
+    def test_missing_image_uses_default(self):
+        self.assertEqual(self.built_urls(3, "No Such Product"), self.built_urls(None, None))
+
+    def test_rename_rebuilds_entry(self):
+        default_urls = self.built_urls(1, "No Such Product")
+        self.assertEqual(ImageService.image_urls(1, "hat"), default_urls, "The old image is served while it is rebuilt")
+        self.assertNotEqual(self.built_urls(1, "hat"), default_urls)
+
+    def test_build_all(self):
+        products = [SimpleNamespace(id=i, name="hat") for i in range(1, 4)]
+        with patch.object(ImageService, "_save_manifest", wraps=ImageService._save_manifest) as save:
+            self.assertEqual(ImageService.build_all(products), 4)
+            self.assertEqual(save.call_count, 1, "The whole catalog should be saved once")
+            self.assertEqual(ImageService.build_all(products), 0)
+            self.assertEqual(save.call_count, 1, "Nothing should be written when every entry is up to date")
+        self.assertEqual(set(ImageService._get_manifest()["products"]), {"default", "1", "2", "3"})
+
+    def test_submit_build_all(self):
+        with patch.object(ProductDAO, "get_all_products", return_value=[SimpleNamespace(id=1, name="hat")]), \
+                patch.object(ProductDAO, "invalidate_cache") as invalidate_cache:
+            ImageService.submit_build_all()
+            ImageService.shutdown()
+        self.assertIn("1", ImageService._get_manifest()["products"])
+        invalidate_cache.assert_called_once_with()
+
+    def read_image(self, name):
+        with open(os.path.join(self.source_dir, name), 'rb') as file:
+            return file.read()
+
+    def build_files(self):
+        return set(os.listdir(ImageService.BUILD_DIR)) - {"manifest.json", "manifest.json.lock"}
+
+    def test_upload_deduplicated(self):
+        ImageService._process_upload(1, "Hat", self.read_image("hat.jpg"))
+        files = self.build_files()
+        ImageService._process_upload(2, "Red Hat", self.read_image("another_red_hat.jpg"))
+        self.assertEqual(self.build_files(), files, "Same content should be stored once")
+        self.assertEqual(ImageService.image_urls(1, "Hat"), ImageService.image_urls(2, "Red Hat"))
+        self.assertEqual(ImageService._manifest["assets"][ImageService._manifest["products"]["1"]["digest"]]["refs"], 2)
+
+    def test_upload_kept_after_rename(self):
+        ImageService._process_upload(1, "Hat", self.read_image("hat.jpg"))
+        self.assertEqual(ImageService.image_urls(1, "Renamed"), ImageService.image_urls(1, "Hat"),
+                         "Uploaded image should not be replaced by a name lookup")
+
+    def test_invalid_upload_rejected(self):
+        ImageService._process_upload(1, "Hat", b"not an image")
+        self.assertNotIn("1", ImageService._get_manifest()["products"])
+
+    def test_orphan_deleted_with_last_product(self):
+        ImageService._process_upload(1, "Hat", self.read_image("hat.jpg"))
+        ImageService._process_upload(2, "Red Hat", self.read_image("another_red_hat.jpg"))
+        ImageService.remove_product(1)
+        self.assertTrue(self.build_files(), "Files are still used by product 2")
+        ImageService.remove_product(2)
+        self.assertEqual(self.build_files(), set(), "Files should be deleted with the last product using them")
+
+    def test_changes_of_other_processes_kept(self):
+        # another worker saved product 2 after this process read the manifest, saving product 3 must keep it
+        ImageService._process_upload(1, "Hat", self.read_image("hat.jpg"))
+        stale = copy.deepcopy(ImageService._manifest), ImageService._manifest_stamp
+        ImageService._process_upload(2, "Red Hat", self.read_image("another_red_hat.jpg"))
+        ImageService._manifest, ImageService._manifest_stamp = stale
+        ImageService._process_upload(3, "Default", self.read_image("default.jpg"))
+        with open(ImageService.MANIFEST_FILE, encoding='utf-8') as file:
+            self.assertEqual(set(json.load(file)["products"]), {"1", "2", "3"})
+
+    def test_reload_when_file_changed(self):
+        ImageService._process_upload(1, "Hat", self.read_image("hat.jpg"))
+        ImageService._manifest = {"products": {}, "assets": {}}  # as if read before another process saved
+        ImageService._manifest_stamp = None
+        ImageService._checked_at = 0.0
+        self.assertIn("1", ImageService._get_manifest()["products"])
+
+    def test_add_product_uploads_after_commit(self):
+        # the real path: the upload is submitted once the unit of work committed the product
+        saved_pool = DBConnector._pool
+        DBConnector._pool = FakeConnectionPool("test", {}, pool_size=1)
+        self.addCleanup(setattr, DBConnector, "_pool", saved_pool)
+
+        def create_product(product):
+            DBConnector.get_connection().close()
+            return 5
+
+        product = {"name": "Hat", "price": 1, "inventory": 1, "category": "", "description": ""}
+        with patch.object(ProductDAO, "create_product", side_effect=create_product), \
+                patch.object(ProductDAO, "invalidate_cache"):
+            with UnitOfWork():
+                result = ProductService.add_product(product, self.read_image("hat.jpg"))
+                self.assertEqual(result["image"], "processing")
+                self.assertIsNone(ImageService._executor, "Nothing should be submitted before the commit")
+            ImageService.shutdown()  # waits for the upload
+        self.assertTrue(ImageService._get_manifest()["products"]["5"]["uploaded"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import logging
+import queue
+import unittest
+from log.log import DeferredQueueHandler, SamplingFilter, parse_level, parse_log_levels
+
+class TestLog(unittest.TestCase):
+    def make_record(self, msg, args=()):
+        return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+    def test_sampling_filter(self):
+        sampling_filter = SamplingFilter(("Successfully obtained a connection from the pool.",), 10)
+        kept = [sampling_filter.filter(self.make_record("Successfully obtained a connection from the pool."))
+                for _ in range(100)]
+        self.assertEqual(sum(kept), 10, "Only 1 in 10 sampled messages should be kept")
+        self.assertTrue(sampling_filter.filter(self.make_record("Order %s created", (1,))),
+                        "Other messages should always pass")
+
+    def test_queue_handler_defers_formatting(self):
+        handler = DeferredQueueHandler(queue.Queue())
+        record = self.make_record("Order %s created", (1,))
+        handler.handle(record)
+        queued = handler.queue.get_nowait()
+        self.assertEqual(queued.args, (1,), "Arguments should be formatted by the listener, not the caller")
+
+    def test_queue_handler_formats_mutable_args(self):
+        # the caller may change a dict after logging it, the record must show it as it was
+        handler = DeferredQueueHandler(queue.Queue())
+        items = {"product_id": 1}
+        handler.handle(self.make_record("Cart %s", (items,)))
+        items["product_id"] = 2
+        queued = handler.queue.get_nowait()
+        self.assertEqual(queued.getMessage(), "Cart {'product_id': 1}")
+
+    def test_queue_handler_drops_when_full(self):
+        handler = DeferredQueueHandler(queue.Queue(maxsize=1))
+        dropped = DeferredQueueHandler.dropped
+        handler.handle(self.make_record("first"))
+        handler.handle(self.make_record("second"))
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(DeferredQueueHandler.dropped, dropped + 1)
+
+    def test_parse_log_levels(self):
+        levels = parse_log_levels("dao=WARNING, util.DatabaseConnection=error")
+        self.assertEqual(levels, {"dao": logging.WARNING, "util.DatabaseConnection": logging.ERROR})
+
+    def test_unknown_log_level_ignored(self):
+        invalid = []
+        self.assertEqual(parse_log_levels("dao=LOUD,service=10", invalid), {"service": logging.DEBUG})
+        self.assertEqual(invalid, ["dao=LOUD"])
+        self.assertIsNone(parse_level("verbose"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from app import app
+import controller.Controller  # registers the routes
+from util.Metrics import Histogram, PrometheusWriter, RequestMetrics
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_cumulative_buckets(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], [(0.1, 1), (1.0, 2), (float("inf"), 3)])
+        self.assertEqual(snapshot["count"], 3)
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics()
+        metrics.start("GET", "/products")
+        self.assertEqual(metrics.snapshot()["in_flight"][("GET", "/products")], 1)
+        metrics.finish("GET", "/products", 200, 0.01)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["in_flight"][("GET", "/products")], 0)
+        self.assertEqual(snapshot["counts"][("GET", "/products", 200)], 1)
+        self.assertEqual(snapshot["latency"][("GET", "/products")]["count"], 1)
+
+    def test_prometheus_format(self):
+        writer = PrometheusWriter()
+        writer.metric("http_requests_total", "counter", "Requests.", [({"route": '/a"b'}, 3)])
+        histogram = Histogram(buckets=(0.1,))
+        histogram.observe(0.05)
+        writer.histogram("latency_seconds", "Latency.", [({}, histogram.snapshot())])
+        text = writer.render()
+        self.assertIn('# TYPE http_requests_total counter', text)
+        self.assertIn('http_requests_total{route="/a\\"b"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('latency_seconds_count 1', text)
+
+    def test_metrics_endpoint_allow_list(self):
+        client = app.test_client()
+        response = client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'})
+        self.assertEqual(response.status_code, 403, "Metrics should not be served outside the allowed networks")
+        response = client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total', response.get_data(as_text=True))
+
+if __name__ == '__main__':
+    unittest.main()
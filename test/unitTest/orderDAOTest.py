@@ -1,6 +1,12 @@
 import unittest
+import mysql.connector
 from dao.OrderDAO import OrderDAO
+from dao.IdempotencyDAO import IdempotencyDAO
+from dao.ProductDAO import ProductDAO
+from dao.UserDAO import UserDAO
 from log.log import get_logger
+from model.Product import Product
+from util.DatabaseConnection import DBConnector
 
 class TestOrderDAO(unittest.TestCase):
     def setUp(self):
@@ -41,5 +47,84 @@ class TestOrderDAO(unittest.TestCase):
         self.assertGreater(len(orders), 0, "No orders found for user")
         self.assertEqual(orders[0].user_id, self.test_user_id, "User ID mismatch in orders")
 
+    def test_orders_page_joins_product_name(self):
+        # test orders come back with the product name joined in, the new order is the newest one
+        page = OrderDAO.get_orders_page_by_user_id(self.test_user_id, limit=1)
+        self.assertEqual(page["orders"][0].id, self.new_order_id, "Created order not found for user")
+        self.assertIsNotNone(page["orders"][0].product_name, "Product name should be joined into the order")
+
+    def test_get_orders_page_by_user_id(self):
+        # newest order comes first and a one item page points to the next page
+        page = OrderDAO.get_orders_page_by_user_id(self.test_user_id, limit=1)
+        self.assertIsNotNone(page, "Orders page query failed")
+        self.assertEqual(len(page["orders"]), 1)
+        self.assertEqual(page["orders"][0].user_id, self.test_user_id, "User ID mismatch in orders")
+
+    def test_purchase_product_insufficient_inventory(self):
+        # guarded update should refuse to oversell and leave no order behind
+        result = OrderDAO.purchase_product(self.test_user_id, self.test_product_id, 10 ** 9)
+        self.assertEqual(result["status"], OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY)
+        self.assertNotIn("order_id", result)
+
+    def test_checkout_all_or_nothing(self):
+        # the second product is sold out, so nothing of the cart is bought
+        sold_out_id = ProductDAO.create_product(Product(None, "testCheckoutSoldOut", 1, 0))
+        self.addCleanup(ProductDAO.delete_product_by_id, sold_out_id)
+        product = ProductDAO.get_product_by_id(self.test_product_id)
+        user = UserDAO.get_user_by_id(self.test_user_id)
+
+        result = OrderDAO.checkout(self.test_user_id, {self.test_product_id: 1, sold_out_id: 1})
+        self.assertEqual(result["status"], OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY)
+        self.assertEqual(result["product_id"], sold_out_id)
+        self.assertEqual(ProductDAO.get_product_by_id(self.test_product_id).inventory, product.inventory, "The other product must not be sold")
+        self.assertEqual(UserDAO.get_user_by_id(self.test_user_id).deposit, user.deposit, "The deposit must not be debited")
+
+    def test_order_date_not_null(self):
+        # the order history cursor is (order_date, id), the table must not accept an order without a date
+        connection = DBConnector.get_connection()
+        try:
+            with self.assertRaises(mysql.connector.Error):
+                connection.cursor().execute("INSERT INTO orders (user_id, product_id, quantity, order_date) VALUES (%s, %s, %s, NULL)",
+                                            (self.test_user_id, self.test_product_id, 1))
+        finally:
+            connection.rollback()
+            DBConnector.release_connection(connection)
+
+    def test_purchase_product_not_found(self):
+        result = OrderDAO.purchase_product(self.test_user_id, -1, 1)
+        self.assertEqual(result["status"], OrderDAO.PURCHASE_PRODUCT_NOT_FOUND)
+
+    def test_purchase_batch(self):
+        # first purchase fits, the second asks for more than what is left and is refused on its own
+        product = ProductDAO.get_product_by_id(self.test_product_id)
+        UserDAO.add_to_deposit_by_id(self.test_user_id, product.price)  # enough for one item
+        user = UserDAO.get_user_by_id(self.test_user_id)
+        ProductDAO.update_inventory_by_id(self.test_product_id, product.inventory + 1)
+
+        results = OrderDAO.purchase_batch(self.test_product_id, [(self.test_user_id, 1, None), (self.test_user_id, 10 ** 9, None)])
+        self.assertEqual(results[0]["status"], OrderDAO.PURCHASE_OK)
+        self.assertEqual(results[1]["status"], OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY)
+        self.assertEqual(results[0]["inventory"], product.inventory)
+        self.assertEqual(results[0]["deposit"], user.deposit - product.price)
+        self.assertEqual(ProductDAO.get_product_by_id(self.test_product_id).inventory, product.inventory, "Inventory should go down by the quantity bought")
+        self.assertEqual(UserDAO.get_user_by_id(self.test_user_id).deposit, user.deposit - product.price, "Deposit should go down by the price paid")
+        self.assertEqual(OrderDAO.get_order_by_id(results[0]["order_id"]).quantity, 1, "Returned order id should be the inserted order")
+
+        OrderDAO.delete_order_by_id(results[0]["order_id"])
+
+    def test_purchase_batch_idempotency_key(self):
+        # the second purchase reuses the key of the first one, a refused purchase does not keep its key
+        idempotency = {"user_id": self.test_user_id, "key": "batch-key", "route": "/purchase", "request_hash": "a" * 64,
+                       "response": lambda result: (200, "{}")}
+        results = OrderDAO.purchase_batch(self.test_product_id, [(self.test_user_id, 10 ** 9, idempotency), (self.test_user_id, 10 ** 9, dict(idempotency))])
+        self.assertEqual(results[0]["status"], OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY)
+        self.assertEqual(results[1]["status"], OrderDAO.PURCHASE_DUPLICATE)
+        self.assertNotIn("saved", idempotency)
+        self.assertEqual(IdempotencyDAO.find(self.test_user_id, "batch-key")["status"], IdempotencyDAO.MISSING)
+
+    def test_purchase_batch_product_not_found(self):
+        results = OrderDAO.purchase_batch(-1, [(self.test_user_id, 1, None)])
+        self.assertEqual(results, [{"status": OrderDAO.PURCHASE_PRODUCT_NOT_FOUND}])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+from unittest.mock import patch
+from dao.OrderDAO import OrderDAO
+from service.OrderService import OrderService
+
+class TestOrderServiceCheckout(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(OrderDAO, "checkout", return_value={"status": OrderDAO.PURCHASE_OK, "order_count": 2, "total_cost": 10})
+        self.dao_checkout = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_products_merged(self):
+        items = [{"product_id": 1, "quantity": 2}, {"product_id": 2, "quantity": 1}, {"product_id": 1, "quantity": 3}]
+        result = OrderService.checkout(7, items)
+        self.assertTrue(result["success"])
+        self.dao_checkout.assert_called_once_with(7, {1: 5, 2: 1})
+
+    def test_malformed_items_rejected(self):
+        for items in ([], ["not a dict"], [{"product_id": 1}], [{"product_id": "1", "quantity": 1}],
+                      [{"product_id": 1, "quantity": 1.5}], [{"product_id": 1, "quantity": 1}, {"product_id": 2, "quantity": 0}]):
+            result = OrderService.checkout(7, items)
+            self.assertFalse(result["success"], f"Cart {items} should be refused")
+        self.dao_checkout.assert_not_called()
+
+    def test_insufficient_inventory_reported(self):
+        self.dao_checkout.return_value = {"status": OrderDAO.PURCHASE_INSUFFICIENT_INVENTORY, "product_id": 2, "available": 0}
+        result = OrderService.checkout(7, [{"product_id": 1, "quantity": 1}, {"product_id": 2, "quantity": 1}])
+        self.assertFalse(result["success"])
+        self.assertIn("product 2", result["message"])
+
+if __name__ == '__main__':
+    unittest.main()
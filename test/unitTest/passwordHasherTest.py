@@ -0,0 +1,39 @@
+import threading
+import unittest
+from unittest.mock import patch
+from util.PasswordHasher import PasswordHasher, HasherBusyError
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        # cheap cost so the tests stay fast
+        patcher = patch.multiple("util.PasswordHasher.Settings", BcryptRounds=4, BcryptWorkers=0, BcryptAdmissionTimeout=0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hash_and_check_inline(self):
+        hashed = PasswordHasher.hash_password("secret1")
+        self.assertTrue(PasswordHasher.check_password("secret1", hashed))
+        self.assertFalse(PasswordHasher.check_password("secret2", hashed))
+
+    def test_hash_and_check_in_worker_process(self):
+        with patch("util.PasswordHasher.Settings.BcryptWorkers", 1):
+            try:
+                hashed = PasswordHasher.hash_password("secret1")
+                self.assertTrue(PasswordHasher.check_password("secret1", hashed))
+            finally:
+                PasswordHasher.shutdown()
+
+    def test_needs_rehash(self):
+        hashed = PasswordHasher.hash_password("secret1")
+        self.assertFalse(PasswordHasher.needs_rehash(hashed))
+        with patch("util.PasswordHasher.Settings.BcryptRounds", 5):
+            self.assertTrue(PasswordHasher.needs_rehash(hashed), "Hash made with another cost should be rehashed")
+
+    def test_busy_when_saturated(self):
+        with patch.object(PasswordHasher, "_admission", threading.BoundedSemaphore(1)):
+            PasswordHasher._admission.acquire()
+            with self.assertRaises(HasherBusyError):
+                PasswordHasher.hash_password("secret1")
+
+if __name__ == '__main__':
+    unittest.main()
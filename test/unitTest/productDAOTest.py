@@ -27,7 +27,7 @@ class TestProductDAO(unittest.TestCase):
         if self.new_product_id:
             deleted = ProductDAO.delete_product_by_id(self.new_product_id)
             if deleted == 0:
-                self.logger.warning(f"Product with ID {self.new_product_id} not found during teardown.")
+                self.logger.warning("Product with ID %s not found during teardown.", self.new_product_id)
             self.assertEqual(deleted, 1, f"Failed to delete product during teardown (ID: {self.new_product_id})")
 
     def test_create_product(self):
@@ -45,6 +45,15 @@ class TestProductDAO(unittest.TestCase):
         product = ProductDAO.get_product_by_id(self.new_product_id)
         self.assertEqual(product.inventory, new_inventory, "Inventory update failed")
 
+    def test_add_to_inventory(self):
+        # inventory changes on the server side and never goes below 0
+        updated, inventory = ProductDAO.add_to_inventory_by_id(self.new_product_id, -10)
+        self.assertEqual(updated, 1, "Failed to change inventory")
+        self.assertEqual(inventory, self.test_inventory - 10)
+        updated, inventory = ProductDAO.add_to_inventory_by_id(self.new_product_id, -1000)
+        self.assertEqual(updated, 0, "Inventory should not go below 0")
+        self.assertEqual(inventory, self.test_inventory - 10)
+
     def test_update_price(self):
         # test update product price
         new_price = 49.99
@@ -0,0 +1,69 @@
+import threading
+import unittest
+from unittest.mock import patch
+from dao.OrderDAO import OrderDAO
+from service.PurchaseQueue import PurchaseQueue, PurchaseQueueFullError
+
+class TestPurchaseQueue(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+        def purchase_batch(product_id, purchases):
+            self.started.set()
+            self.release.wait(5)
+            self.batches.append((product_id, purchases))
+            return [{"status": OrderDAO.PURCHASE_OK, "order_id": user_id} for user_id, _, _ in purchases]
+
+        patcher = patch.object(OrderDAO, "purchase_batch", side_effect=purchase_batch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_caller_gets_its_result(self):
+        futures = [PurchaseQueue.submit(user_id, 1, 1) for user_id in range(5)]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual([result["order_id"] for result in results], list(range(5)))
+
+    def test_purchases_of_same_product_batched(self):
+        # hold the workers on a first purchase so the next ones queue up behind it
+        self.release.clear()
+        first = PurchaseQueue.submit(100, 2, 1)
+        self.started.wait(5)
+        futures = [PurchaseQueue.submit(user_id, 2, 1) for user_id in range(10)]
+        self.release.set()
+        first.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        product_batches = [purchases for product_id, purchases in self.batches if product_id == 2]
+        self.assertEqual(len(product_batches), 2, "Queued purchases should be applied in one batch")
+        self.assertEqual([user_id for user_id, _, _ in product_batches[1]], list(range(10)), "Arrival order is kept")
+
+    def test_failed_batch_fails_every_purchase(self):
+        with patch.object(OrderDAO, "purchase_batch", return_value=None):
+            result = PurchaseQueue.submit(1, 3, 1).result(timeout=5)
+        self.assertEqual(result["status"], OrderDAO.PURCHASE_FAILED)
+
+    def test_cancelled_purchase_is_not_applied(self):
+        # a caller that gave up while its purchase was still queued cancels it, the worker skips it
+        self.release.clear()
+        first = PurchaseQueue.submit(100, 5, 1)
+        self.started.wait(5)
+        cancelled = PurchaseQueue.submit(1, 5, 1)
+        kept = PurchaseQueue.submit(2, 5, 1)
+        self.assertTrue(cancelled.cancel())
+        self.release.set()
+        first.result(timeout=5)
+        kept.result(timeout=5)
+        applied = [user_id for product_id, purchases in self.batches if product_id == 5 for user_id, _, _ in purchases]
+        self.assertEqual(applied, [100, 2])
+        self.assertFalse(first.cancel(), "A purchase taken by a worker can no longer be cancelled")
+
+    def test_queue_full(self):
+        with patch("service.PurchaseQueue.Settings.PurchaseQueueMaxSize", 0):
+            with self.assertRaises(PurchaseQueueFullError):
+                PurchaseQueue.submit(1, 4, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch
+from util.QueryLog import InstrumentedCursor, QueryStats, normalize_sql, query_stats
+
+class FakeCursor:
+    # result set cursor when rows is a list, write cursor otherwise
+    def __init__(self, rows=None, rowcount=1):
+        self.rows = list(rows) if rows is not None else None
+        self.with_rows = rows is not None
+        self.rowcount = rowcount if rows is None else -1
+
+    def execute(self, operation, params=None):
+        pass
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        query_stats.clear()
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM products\n  WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 10"),
+            "SELECT * FROM products WHERE id IN (...) AND name = ? LIMIT ?")
+
+    def test_write_statement_recorded(self):
+        cursor = InstrumentedCursor(FakeCursor())
+        cursor.execute("UPDATE users SET deposit = deposit + %s WHERE id = %s", (10, 1))
+        stats = query_stats.snapshot()
+        self.assertEqual(stats["UPDATE users SET deposit = deposit + ? WHERE id = ?"]["count"], 1)
+
+    def test_select_recorded_once_rows_fetched(self):
+        cursor = InstrumentedCursor(FakeCursor(rows=[(1,), (2,)]))
+        cursor.execute("SELECT id FROM orders WHERE user_id = %s", (1,))
+        self.assertEqual(query_stats.snapshot(), {}, "Statement should be timed until its rows are fetched")
+        self.assertEqual([row for row in cursor], [(1,), (2,)])
+        self.assertEqual(query_stats.snapshot()["SELECT id FROM orders WHERE user_id = ?"]["count"], 1)
+
+    def test_slow_query_logged_without_parameters(self):
+        cursor = InstrumentedCursor(FakeCursor(rows=[("secret",)]))
+        with patch("util.QueryLog.Settings.SlowQueryThreshold", 0.0), \
+                patch("util.QueryLog.slow_query_logger") as slow_query_logger:
+            cursor.execute("SELECT * FROM users WHERE username = %s", ("alice",))
+            cursor.fetchall()
+        args = slow_query_logger.warning.call_args[0]
+        self.assertEqual(args[2], 1, "Row count should be logged")
+        self.assertNotIn("alice", str(args), "Parameter values should be redacted")
+
+    def test_statement_limit(self):
+        stats = QueryStats(max_statements=1)
+        stats.observe("SELECT ?", 0.1)
+        stats.observe("SELECT ? FROM users", 0.1)
+        self.assertEqual(set(stats.snapshot()), {"SELECT ?", QueryStats.OTHER})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import uuid
+from unittest.mock import patch
+from app import app
+import controller.Controller  # registers the routes
+from dao.IdempotencyDAO import IdempotencyDAO
+from dao.OrderDAO import OrderDAO
+from service.UserService import UserService
+from util.ConnectionPool import ConnectionPool
+from util.DatabaseConnection import DBConnector
+
+class FakeConnection:
+    # stands in for a mysql connection, the request unit of work only commits / rolls back
+    def __init__(self):
+        self.in_transaction = False
+        self.unread_result = False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeConnectionPool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection()
+
+class TestQueuedPurchaseIdempotency(unittest.TestCase):
+    def setUp(self):
+        self.saved_pool = DBConnector._pool
+        DBConnector._pool = FakeConnectionPool("test", {}, pool_size=2)
+        self.in_use_during_batch = []
+        self.results = [{"status": OrderDAO.PURCHASE_INSUFFICIENT_DEPOSIT},
+                        {"status": OrderDAO.PURCHASE_OK, "order_id": 7, "deposit": 90, "inventory": 3}]
+
+        def purchase_batch(product_id, purchases):
+            self.in_use_during_batch.append(DBConnector._pool.stats()["in_use"])
+            result = self.results.pop(0)
+            for _, _, idempotency in purchases:
+                if result["status"] == OrderDAO.PURCHASE_OK:
+                    idempotency["saved"] = idempotency["response"](result)  # what a commit of the batch does
+            return [result for _ in purchases]
+
+        def find(user_id, key):
+            DBConnector.get_connection().close()  # the read takes the request connection
+            return {"status": IdempotencyDAO.MISSING}
+
+        for patcher in (patch("config.settings.Settings.PurchaseQueueEnabled", True),
+                        patch.object(OrderDAO, "purchase_batch", side_effect=purchase_batch),
+                        patch.object(IdempotencyDAO, "find", side_effect=find),
+                        patch.object(UserService, "verify_token", return_value={"user_id": 1, "username": "test", "role": "user"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['token'] = "token"
+        self.headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+    def tearDown(self):
+        DBConnector._pool = self.saved_pool
+
+    def purchase(self):
+        return self.client.post('/purchase', json={"product_id": 1, "quantity": 1}, headers=self.headers)
+
+    def test_refused_purchase_runs_again_and_success_is_replayed(self):
+        response = self.purchase()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.in_use_during_batch, [0], "No request connection should be held while the purchase waits")
+
+        response = self.purchase()
+        self.assertEqual(response.status_code, 200, "A refused purchase should not be replayed")
+        self.assertEqual(response.get_json()["order_id"], 7)
+
+        replayed = self.purchase()
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.headers.get("Idempotent-Replayed"), "true")
+        self.assertEqual(replayed.get_json(), response.get_json())
+        self.assertEqual(len(self.in_use_during_batch), 2, "A replayed purchase should not be applied again")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import patch
+from util.RateLimiter import RateLimiter
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter({"read": (1.0, 3), "write": (0, 1)}, max_keys=2)
+        self.now = 100.0
+        patcher = patch("util.RateLimiter.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_limited(self):
+        waits = [self.limiter.acquire("read", 1) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0], "A full bucket should let a burst through")
+        self.assertAlmostEqual(waits[3], 1.0)
+        self.assertEqual(self.limiter.stats()["read"]["limited"], 1)
+
+    def test_refill(self):
+        for _ in range(3):
+            self.limiter.acquire("read", 1)
+        self.now += 1.0
+        self.assertEqual(self.limiter.acquire("read", 1), 0, "One token should be back after one second")
+        self.assertGreater(self.limiter.acquire("read", 1), 0)
+
+    def test_buckets_per_user(self):
+        for _ in range(3):
+            self.limiter.acquire("read", 1)
+        self.assertEqual(self.limiter.acquire("read", 2), 0, "Another user should have its own bucket")
+
+    def test_zero_rate_is_unlimited(self):
+        waits = [self.limiter.acquire("write", 1) for _ in range(10)]
+        self.assertEqual(waits, [0] * 10)
+        self.assertEqual(self.limiter.stats()["write"]["allowed"], 10)
+
+    def test_bounded(self):
+        for user in range(3):
+            self.limiter.acquire("read", user)
+        self.assertEqual(len(self.limiter._buckets), 2)
+
+if __name__ == '__main__':
+    unittest.main()
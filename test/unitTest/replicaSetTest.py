@@ -0,0 +1,101 @@
+import time
+import unittest
+from util.ConnectionPool import ConnectionPool
+from util.ReplicaSet import Replica, ReplicaSet
+
+class FakeCursor:
+    with_rows = True
+    rowcount = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        time.sleep(self.connection.pool.delay)
+        lag = self.connection.pool.lag
+        return [] if lag == "not replicating" else [{"Seconds_Behind_Source": lag}]
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    # stands in for a mysql connection of a replica, the pool's lag is what SHOW REPLICA STATUS reports
+    def __init__(self, pool):
+        self.pool = pool
+        self.in_transaction = False
+        self.unread_result = False
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+class FakeReplicaPool(ConnectionPool):
+    def __init__(self, name, lag):
+        super().__init__(name, {}, pool_size=1, max_overflow=0, timeout=0.1, max_waiters=0)
+        self.lag = lag
+        self.delay = 0
+
+    def _connect(self):
+        return FakeConnection(self)
+
+class TestReplicaSet(unittest.TestCase):
+    def make_replica(self, name, lag):
+        # checked once like DBConnector.warm_up does, later checks run in the background
+        replica = Replica(FakeReplicaPool(name, lag), max_lag=2, check_interval=60)
+        replica.check()
+        return replica
+
+    def test_round_robin_over_healthy(self):
+        replicas = ReplicaSet([self.make_replica("a", 0), self.make_replica("b", 1)])
+        names = []
+        for _ in range(4):
+            connection = replicas.checkout()
+            names.append(connection._pool.name)
+            connection.close()
+        self.assertEqual(names, ["a", "b", "a", "b"])
+
+    def test_lagging_replica_skipped(self):
+        replicas = ReplicaSet([self.make_replica("a", 30), self.make_replica("b", 0)])
+        for _ in range(3):
+            connection = replicas.checkout()
+            self.assertEqual(connection._pool.name, "b", "Replica behind more than max_lag should not be used")
+            connection.close()
+        self.assertEqual(replicas.stats()["a"]["lag"], 30)
+
+    def test_not_replicating_is_unhealthy(self):
+        replica = self.make_replica("a", "not replicating")
+        self.assertFalse(replica.is_healthy())
+        self.assertIsNone(ReplicaSet([replica]).checkout(), "Without a healthy replica reads go to the primary")
+
+    def test_busy_replica_falls_back(self):
+        replicas = ReplicaSet([self.make_replica("a", 0)])
+        held = replicas.checkout()
+        self.assertIsNone(replicas.checkout(), "A replica with no free connection should not make the caller wait")
+        held.close()
+
+    def test_checked_once_per_interval(self):
+        replica = self.make_replica("a", 0)
+        self.assertTrue(replica.is_healthy())
+        replica.pool.lag = 30
+        self.assertTrue(replica.is_healthy(), "The last result is used until check_interval passed")
+        replica.check()
+        self.assertFalse(replica.is_healthy())
+
+    def test_check_does_not_block_caller(self):
+        replica = Replica(FakeReplicaPool("a", 0), max_lag=2, check_interval=60)
+        replica.pool.delay = 0.5  # a slow replica
+        start = time.perf_counter()
+        self.assertFalse(replica.is_healthy(), "A replica is not used before its first check finished")
+        self.assertLess(time.perf_counter() - start, 0.2, "The check should run in the background")
+        deadline = time.monotonic() + 5
+        while replica.checked_at is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(replica.is_healthy())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from flask import jsonify
+from app import app
+from util.ConnectionPool import ConnectionPool
+from util.DatabaseConnection import DBConnector
+
+class FakeConnection:
+    # stands in for a mysql connection, counts commits and rollbacks
+    def __init__(self):
+        self.in_transaction = False
+        self.unread_result = False
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+class FakeConnectionPool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection()
+
+written = []
+
+@app.route('/test/write-then-raise', methods=['POST'])
+def write_then_raise():
+    written.append(DBConnector.get_connection()._connection._slot.cnx)
+    raise RuntimeError("view failed after writing")
+
+@app.route('/test/write-then-500', methods=['POST'])
+def write_then_500():
+    written.append(DBConnector.get_connection()._connection._slot.cnx)
+    return jsonify({"success": False}), 500
+
+@app.route('/test/write', methods=['POST'])
+def write():
+    written.append(DBConnector.get_connection()._connection._slot.cnx)
+    return jsonify({"success": True})
+
+class TestRequestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.saved_pool = DBConnector._pool
+        DBConnector._pool = FakeConnectionPool("test", {}, pool_size=2)
+        written.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        DBConnector._pool = self.saved_pool
+
+    def test_view_that_raises_is_rolled_back(self):
+        response = self.client.post('/test/write-then-raise')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(written[0].commits, 0, "A view that raised must not be committed")
+        self.assertEqual(written[0].rollbacks, 1)
+        self.assertEqual(DBConnector._pool.stats()["in_use"], 0)
+
+    def test_5xx_response_is_rolled_back(self):
+        response = self.client.post('/test/write-then-500')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(written[0].commits, 0, "A 5xx response must not be committed")
+
+    def test_success_is_committed(self):
+        response = self.client.post('/test/write')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(written[0].commits, 1)
+
+if __name__ == '__main__':
+    unittest.main()
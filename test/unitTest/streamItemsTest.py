@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import patch
+import mysql.connector
+from app import app
+import controller.Controller  # registers the routes
+from service.UserService import UserService
+from util.ConnectionPool import ConnectionPool, PoolTimeoutError
+from util.DatabaseConnection import DBConnector
+
+def failing_users(error):
+    raise error
+    yield
+
+class FakeCursor:
+    # hands out the rows of a SELECT in fetchmany chunks, the rest stays unread on the connection
+    def __init__(self, connection):
+        self._connection = connection
+        self.rowcount = -1
+
+    def execute(self, operation, params=None):
+        self._connection.unread = list(self._connection.rows)
+
+    def fetchmany(self, size=1):
+        rows, self._connection.unread = self._connection.unread[:size], self._connection.unread[size:]
+        return rows
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    # like mysql connector, commit fails while rows of a query are still unread
+    def __init__(self, rows):
+        self.rows = rows
+        self.unread = []
+        self.in_transaction = False
+
+    @property
+    def unread_result(self):
+        return bool(self.unread)
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def consume_results(self):
+        self.unread = []
+
+    def commit(self):
+        if self.unread:
+            raise mysql.connector.InternalError("Unread result found")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeConnectionPool(ConnectionPool):
+    def __init__(self, rows):
+        super().__init__("test", {}, pool_size=2)
+        self.rows = rows
+
+    def _connect(self):
+        return FakeConnection(self.rows)
+
+class TestStreamItems(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(UserService, "verify_token", return_value={"user_id": 1, "username": "admin", "role": "admin"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['token'] = "token"
+
+    def test_streamed_document(self):
+        users = [{"user_id": i} for i in range(3)]
+        with patch.object(UserService, "iter_all_users", return_value=iter(users)):
+            response = self.client.get('/users')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"success": True, "users": users})
+
+    def test_query_failure_before_first_item(self):
+        with patch.object(UserService, "iter_all_users", return_value=failing_users(mysql.connector.Error("gone away"))):
+            response = self.client.get('/users')
+        self.assertEqual(response.status_code, 500, "A query failing before the first item should not answer 200")
+        self.assertFalse(response.get_json()["success"])
+
+    def test_pool_exhausted_before_first_item(self):
+        with patch.object(UserService, "iter_all_users", return_value=failing_users(PoolTimeoutError("pool is full"))):
+            response = self.client.get('/users')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers.get('Retry-After'), '1')
+
+    def test_stream_larger_than_one_fetch_through_the_dao(self):
+        # the rows are read after the view returned and the request committed, more than one fetchmany chunk
+        rows = [{"id": i, "username": f"user{i}", "role": "user", "deposit": 0} for i in range(2500)]
+        saved_pool, saved_replicas = DBConnector._pool, DBConnector._replicas
+        DBConnector._pool, DBConnector._replicas = FakeConnectionPool(rows), None
+        try:
+            response = self.client.get('/users')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()["users"]), 2500)
+            self.assertEqual(DBConnector._pool.stats()["in_use"], 0, "The streaming connection should be given back")
+        finally:
+            DBConnector._pool, DBConnector._replicas = saved_pool, saved_replicas
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+from dao.ProductDAO import ProductDAO
+from util.Cache import TTLCache
+from util.ConnectionPool import ConnectionPool
+from util.DatabaseConnection import DBConnector
+from util.UnitOfWork import UnitOfWork
+
+class FakeConnection:
+    # stands in for a mysql connection, counts commits and rollbacks
+    def __init__(self):
+        self.in_transaction = False
+        self.unread_result = False
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+class FakeConnectionPool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection()
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.saved_pool = DBConnector._pool
+        DBConnector._pool = FakeConnectionPool("test", {}, pool_size=2)
+
+    def tearDown(self):
+        DBConnector._pool = self.saved_pool
+        DBConnector.current_unit_of_work.set(None)
+
+    def test_shared_connection_and_deferred_commit(self):
+        with UnitOfWork():
+            first = DBConnector.get_connection()
+            first.commit()  # what a DAO does, deferred to the end of the unit of work
+            DBConnector.release_connection(first)
+            second = DBConnector.get_connection()
+            raw = second._connection._slot.cnx
+            self.assertIs(first._connection._slot.cnx, raw, "DAO calls should share one connection")
+            self.assertEqual(DBConnector._pool.stats()["in_use"], 1)
+            self.assertEqual(raw.commits, 0, "Commit should wait for the end of the unit of work")
+        self.assertEqual(raw.commits, 1)
+        self.assertEqual(DBConnector._pool.stats()["in_use"], 0, "Connection should be back in the pool")
+
+    def test_rollback_marks_rollback_only(self):
+        with UnitOfWork() as unit_of_work:
+            connection = DBConnector.get_connection()
+            raw = connection._connection._slot.cnx
+            connection.rollback()
+            self.assertTrue(unit_of_work.rollback_only)
+        self.assertEqual(raw.commits, 0, "Unit of work rolled back by a DAO must not commit")
+
+    def test_nested_unit_of_work_joins(self):
+        with UnitOfWork() as outer:
+            with UnitOfWork() as inner:
+                self.assertIs(inner, outer)
+                DBConnector.get_connection()
+            self.assertIsNotNone(UnitOfWork.current(), "Inner block must not end the outer unit of work")
+
+    def test_after_commit_callback(self):
+        called = []
+        with UnitOfWork():
+            DBConnector.get_connection()
+            DBConnector.after_commit(lambda: called.append(True))
+            self.assertEqual(called, [])
+        self.assertEqual(called, [True])
+
+    def test_rolled_back_write_not_left_in_product_cache(self):
+        # write -> read (cached from the uncommitted row) -> rollback -> read must see the committed row again
+        table = {1: {"id": 1, "name": "Hat", "inventory": 5}}
+        with patch.object(ProductDAO, "cache", TTLCache(maxsize=10, ttl=60)), \
+                patch.object(ProductDAO, "_query_product_row_by_id", side_effect=lambda product_id: dict(table[product_id])):
+            self.assertEqual(ProductDAO.get_product_by_id(1).inventory, 5)
+            with UnitOfWork() as unit_of_work:
+                DBConnector.get_connection()
+                table[1]["inventory"] = 4  # the UPDATE, seen by the loader through the unit of work
+                ProductDAO.invalidate_cache(1)
+                self.assertEqual(ProductDAO.get_product_by_id(1).inventory, 4)
+                table[1]["inventory"] = 5  # what the rollback below undoes
+                unit_of_work.rollback_only = True
+            self.assertEqual(ProductDAO.get_product_by_id(1).inventory, 5, "The rolled back row should not stay cached")
+
+if __name__ == '__main__':
+    unittest.main()
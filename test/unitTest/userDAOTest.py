@@ -33,6 +33,15 @@ class TestUserDAO(unittest.TestCase):
         self.assertIsNotNone(updated_user, "Updated username should exist in the database")
         self.assertEqual(updated_user.username, "testUser01_edited")
 
+    def test_add_to_deposit(self):
+        # deposit changes on the server side and never goes below 0
+        updated, deposit = UserDAO.add_to_deposit_by_id(self.new_user_id, 5)
+        self.assertEqual(updated, 1, "Failed to add to deposit")
+        self.assertEqual(deposit, 5)
+        updated, deposit = UserDAO.add_to_deposit_by_id(self.new_user_id, -10)
+        self.assertEqual(updated, 0, "Deposit should not go below 0")
+        self.assertEqual(deposit, 5)
+
     def test_delete_user(self):
         # checl delete user
         deleted = UserDAO.delete_user(self.new_user_id)
@@ -0,0 +1,128 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class TTLCache:
+    """
+    Thread safe in-process cache with TTL and LRU eviction.
+
+    get_or_load works as a read-through cache: on a miss the loader is called and its result stored.
+    With stale_ttl > 0 an expired entry is still served for stale_ttl seconds while one background
+    thread reloads it, also when that reload raises (e.g. the database is down or slow). Past stale_ttl
+    the entry is never served, the loader is called on the request and its error is raised.
+    Loaders returning None are not cached.
+    """
+
+    _instances = weakref.WeakSet()  # every live cache, for /metrics
+
+    def __init__(self, maxsize, ttl, stale_ttl=0.0, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._generation = 0  # bumped on every invalidation so a slow load cannot store an old value
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        TTLCache._instances.add(self)
+
+    def get(self, key):
+        # return the fresh value or None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generation
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if expires_at + self.stale_ttl > now:
+                    # stale but usable, serve it and reload in the background
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, loader, generation), daemon=True).start()
+                    return value
+            self.misses += 1
+
+        value = loader()
+        with self._lock:
+            if value is None:
+                self._entries.pop(key, None)
+            elif generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def all_stats():
+        # name -> stats() of every live cache
+        return {cache.name: cache.stats() for cache in list(TTLCache._instances)}
+
+    def _store(self, key, value, ttl=None):
+        # caller holds the lock
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _refresh(self, key, loader, generation):
+        try:
+            value = loader()
+            with self._lock:
+                if value is None:
+                    self._entries.pop(key, None)
+                elif generation == self._generation:
+                    self._store(key, value)
+        except Exception as e:
+            logger.warning("%s: background reload of %s failed: %s", self.name, key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
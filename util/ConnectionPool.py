@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import deque
+import mysql.connector
+from mysql.connector.errors import PoolError
+from util.Metrics import Histogram
+from util.QueryLog import InstrumentedCursor
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class PoolTimeoutError(PoolError):
+    # no connection became free within the acquire timeout, or the wait queue is full
+    pass
+
+
+class _Slot:
+    # a raw connection owned by the pool
+    def __init__(self, cnx, overflow=False):
+        self.cnx = cnx
+        self.overflow = overflow
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class PooledConnection:
+    """
+    What DAOs get from DBConnector.get_connection, behaves like the mysql connection it wraps
+    except that close() gives the connection back to the pool. A new proxy is made for every
+    checkout, so closing it twice cannot release somebody else's connection.
+    Its cursors are InstrumentedCursors, every statement is timed (see util/QueryLog.py).
+    """
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+        self._checked_out_at = time.perf_counter()
+
+    def __getattr__(self, name):
+        slot = self.__dict__.get('_slot')
+        if slot is None:
+            raise PoolError("Connection was already returned to the pool.")
+        return getattr(slot.cnx, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.__getattr__('cursor')(*args, **kwargs))
+
+    def close(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool.release(slot, time.perf_counter() - self._checked_out_at)
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of mysql connections.
+
+    pool_size connections are kept, up to max_overflow extra ones are opened under bursts and closed
+    when given back. When everything is in use, callers wait up to timeout seconds in a queue of at
+    most max_waiters, instead of failing at once. Connections older than max_lifetime seconds are
+    replaced on checkout / release. stats() reports usage and wait / checkout time histograms.
+
+    Health is only checked on checkout, with a ping, when the connection sat idle for more than
+    validate_after_idle seconds. Releasing never talks to the server unless there is an open
+    transaction to roll back or unread rows to drain.
+    """
+
+    def __init__(self, name, db_config, pool_size=5, max_overflow=0, timeout=10.0, max_lifetime=3600.0, max_waiters=64,
+                 validate_after_idle=30.0):
+        self.name = name
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_waiters = max_waiters
+        self.validate_after_idle = validate_after_idle
+
+        self._idle = deque()
+        self._size = 0  # pooled connections open (idle + in use)
+        self._overflow = 0  # overflow connections open, always in use
+        self._in_use = 0
+        self._waiters = 0
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.rejected = 0  # checkouts refused at once because max_waiters callers were waiting already
+        self.wait_time = Histogram()
+        self.checkout_duration = Histogram()
+
+    def checkout(self, timeout=None):
+        # timeout overrides self.timeout, 0 takes a free connection or fails at once
+        start = time.perf_counter()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = start + timeout
+        slot, create, overflow = None, False, False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    slot = self._idle.pop()  # most recently used first, it is the least likely to be stale
+                    break
+                if self._size < self.pool_size:
+                    self._size += 1
+                    create = True
+                    break
+                if self._overflow < self.max_overflow:
+                    self._overflow += 1
+                    create, overflow = True, True
+                    break
+                if self._waiters >= self.max_waiters:
+                    # fail fast instead of piling up blocked threads, the request answers 503 (see app.py)
+                    self.rejected += 1
+                    raise PoolTimeoutError(f"Pool {self.name} exhausted: wait queue is full.")
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(f"Pool {self.name} exhausted: no connection free after {timeout}s.")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            self._in_use += 1
+            self.checkouts += 1
+
+        try:
+            if create:
+                slot = _Slot(self._connect(), overflow)
+            elif time.monotonic() - slot.created_at > self.max_lifetime:
+                logger.info("Connection reached max lifetime in pool %s, reconnecting.", self.name)
+                self._close_quietly(slot.cnx)
+                slot = _Slot(self._connect())
+            elif time.monotonic() - slot.last_used_at > self.validate_after_idle:
+                slot = self._validate(slot)
+        except Exception:
+            # could not open a connection, give the place back to the other callers
+            with self._cond:
+                self._in_use -= 1
+                if overflow:
+                    self._overflow -= 1
+                else:
+                    self._size -= 1
+                self._cond.notify()
+            raise
+
+        self.wait_time.observe(time.perf_counter() - start)
+        return PooledConnection(self, slot)
+
+    def release(self, slot, duration):
+        self.checkout_duration.observe(duration)
+        keep = not slot.overflow and time.monotonic() - slot.created_at <= self.max_lifetime
+        if keep:
+            try:
+                if slot.cnx.unread_result:
+                    slot.cnx.consume_results()  # a streaming reader stopped early
+                if slot.cnx.in_transaction:
+                    slot.cnx.rollback()  # never hand out a connection in the middle of somebody's transaction
+            except mysql.connector.Error as e:
+                logger.warning("Dropping connection of pool %s that failed to clean up: %s", self.name, e)
+                keep = False
+        if not keep:
+            self._close_quietly(slot.cnx)
+
+        with self._cond:
+            self._in_use -= 1
+            if slot.overflow:
+                self._overflow -= 1
+            elif keep:
+                slot.last_used_at = time.monotonic()
+                self._idle.append(slot)
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+    def warm(self, count=None):
+        # open up to pool_size connections ahead of the first requests, return how many are open
+        count = self.pool_size if count is None else min(count, self.pool_size)
+        connections = []
+        try:
+            for _ in range(count):
+                connections.append(self.checkout())
+        finally:
+            for connection in connections:
+                connection.close()
+        return len(connections)
+
+    def close(self):
+        # close the idle connections, e.g. on shutdown. Connections still in use are kept until given back
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+        for slot in idle:
+            self._close_quietly(slot.cnx)
+        return len(idle)
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "size": self._size,
+                "overflow": self._overflow,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+            }
+        stats["wait_time"] = self.wait_time.snapshot()
+        stats["checkout_duration"] = self.checkout_duration.snapshot()
+        return stats
+
+    def _validate(self, slot):
+        # ping a connection that was idle for a while, open a new one if the server dropped it
+        try:
+            slot.cnx.ping(reconnect=False)
+            return slot
+        except mysql.connector.Error as e:
+            logger.warning("Idle connection of pool %s is dead, reconnecting: %s", self.name, e)
+            self._close_quietly(slot.cnx)
+            return _Slot(self._connect())
+
+    def _connect(self):
+        return mysql.connector.connect(**self.db_config)
+
+    @staticmethod
+    def _close_quietly(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
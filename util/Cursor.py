@@ -0,0 +1,21 @@
+import base64
+import json
+
+
+def encode_cursor(values):
+    # opaque pagination token from the sort key values of the last row of a page
+    # Decimal and datetime values are kept as strings, MySQL converts them back when comparing
+    raw = json.dumps(list(values), default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    # return the list of sort key values in the token, raise ValueError if the token is not valid
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Invalid cursor: {token}")
+    return values
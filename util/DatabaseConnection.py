@@ -1,15 +1,35 @@
 import os
 import json
-import mysql.connector
-from mysql.connector import pooling
+import threading
+import contextvars
+from config.settings import Settings
+from util.ConnectionPool import ConnectionPool
+from util.ReplicaSet import Replica, ReplicaSet
+from util.QueryLog import query_stats
 from log.log import get_logger
 
 logger = get_logger(__name__)
 
 class DBConnector:
     _pool = None
+    _replicas = None  # ReplicaSet of the "replicas" in db_connection.json, None if there are none
+    _inherited = []  # pools of the parent process after a fork, see reset_after_fork
+    current_unit_of_work = contextvars.ContextVar("current_unit_of_work", default=None)
+    # True while read_only DAO calls must not go to a replica, e.g. right after the user wrote (see app.py)
+    read_from_primary = contextvars.ContextVar("read_from_primary", default=False)
+    _pool_lock = threading.Lock()
     _config_filepath = "../config/db_connection.json"
 
+    # used when neither the environment nor the "pool" section of db_connection.json sets a value
+    POOL_DEFAULTS = {
+        "size": 5,
+        "max_overflow": 5,
+        "timeout": 10.0,
+        "max_lifetime": 3600.0,
+        "max_waiters": 64,
+        "validate_after_idle": 30.0,
+    }
+
     @staticmethod
     def load_db_config(file_path):
         # Get the connection host, username, and password from the file
@@ -32,27 +52,132 @@ class DBConnector:
             logger.error("Unexpected error while loading database configuration: %s", e)
             raise
 
+    @staticmethod
+    def load_pool_options(pool_config):
+        # pool settings: environment variable > "pool" section of db_connection.json > default
+        def pick(env_value, key):
+            return env_value if env_value is not None else pool_config.get(key, DBConnector.POOL_DEFAULTS[key])
+
+        return {
+            "pool_size": pick(Settings.DBPoolSize, "size"),
+            "max_overflow": pick(Settings.DBPoolMaxOverflow, "max_overflow"),
+            "timeout": pick(Settings.DBPoolTimeout, "timeout"),
+            "max_lifetime": pick(Settings.DBPoolMaxLifetime, "max_lifetime"),
+            "max_waiters": pick(Settings.DBPoolMaxWaiters, "max_waiters"),
+            "validate_after_idle": pick(Settings.DBPoolValidateAfterIdle, "validate_after_idle"),
+        }
+
     @classmethod
     def initialize_pool(cls):
         # Initialize the connection pool only once
         # I can take connection from pools instead of create new connectio nevery time or just play with one connection
         # this brings higher performance
-        if cls._pool is not None:
-            logger.info("Connection pool is already initialized.")
-            return
-        
-        logger.info("Initializing connection pool.")
+        with cls._pool_lock:
+            if cls._pool is not None:
+                logger.info("Connection pool is already initialized.")
+                return
+
+            logger.info("Initializing connection pool.")
+            try:
+                db_config = cls.load_db_config(cls._config_filepath)
+                pool_config = db_config.pop("pool", {})
+                replica_configs = db_config.pop("replicas", [])
+                pool_options = cls.load_pool_options(pool_config)
+                cls._pool = ConnectionPool("mypool", db_config, **pool_options)
+                logger.info("Connection pool initialized successfully with pool name: %s, options: %s", cls._pool.name, pool_options)
+
+                # every replica entry overrides the primary settings it differs in, usually just "host"
+                replicas = []
+                for i, replica_config in enumerate(replica_configs):
+                    replica_config = dict(replica_config)
+                    replica_pool_options = cls.load_pool_options(replica_config.pop("pool", pool_config))
+                    replica_pool = ConnectionPool(f"replica{i}", {**db_config, **replica_config}, **replica_pool_options)
+                    replicas.append(Replica(replica_pool, Settings.ReplicaMaxLag, Settings.ReplicaCheckInterval))
+                    logger.info("Replica pool %s initialized for host %s.", replica_pool.name, replica_pool.db_config.get("host"))
+                cls._replicas = ReplicaSet(replicas) if replicas else None
+            except Exception as e:
+                logger.error("Failed to initialize connection pool: %s", e)
+                raise
+
+    @classmethod
+    def warm_up(cls):
+        # open the pool connections (and check the replicas) before the process takes requests,
+        # so the first requests do not pay for connecting. A database that is down is only logged
         try:
-            db_config = cls.load_db_config(cls._config_filepath)
-            cls._pool = mysql.connector.pooling.MySQLConnectionPool(pool_name="mypool", pool_size=5, **db_config)
-            logger.info("Connection pool initialized successfully with pool name: %s", cls._pool.pool_name)
+            cls._ensure_pool()
+            opened = cls._pool.warm()
+            for replica in (cls._replicas.replicas if cls._replicas is not None else []):
+                replica.check()  # here and not in the background, requests can use the replicas right away
+                if replica.healthy:
+                    replica.pool.warm()
+            logger.info("Connection pool warmed up with %s connections.", opened)
         except Exception as e:
-            logger.error("Failed to initialize connection pool: %s", e)
-            raise
+            logger.warning("Failed to warm up the connection pool: %s", e)
+
+    @classmethod
+    def reset_after_fork(cls):
+        # in a forked worker: the pools came from the parent and their sockets are shared with it. They must not
+        # be used, and not closed either (that would end the parent's sessions), so they are kept aside
+        # untouched and new pools are built on the next checkout
+        cls._pool_lock = threading.Lock()
+        if cls._pool is not None:
+            cls._inherited.append(cls._pool)
+        if cls._replicas is not None:
+            cls._inherited.extend(replica.pool for replica in cls._replicas.replicas)
+        cls._pool = None
+        cls._replicas = None
+
+    @classmethod
+    def close_pools(cls):
+        # on shutdown, after the last request: close the idle connections of every pool
+        pools = [cls._pool] if cls._pool is not None else []
+        if cls._replicas is not None:
+            pools.extend(replica.pool for replica in cls._replicas.replicas)
+        closed = sum(pool.close() for pool in pools)
+        logger.info("Closed %s pooled connections.", closed)
 
     @staticmethod
-    def get_connection():
-        # Ensure the pool is initialized
+    def get_connection(read_only=False):
+        # inside a unit of work (util/UnitOfWork.py) every DAO call shares its connection and transaction
+        # read_only calls (plain SELECTs nothing is written from) go to a healthy replica instead, unless the
+        # unit of work holds a connection already (its uncommitted writes must be seen), the request has to
+        # read from the primary, or no replica is configured / healthy
+        unit_of_work = DBConnector.current_unit_of_work.get()
+        if read_only and not DBConnector.read_from_primary.get() and (unit_of_work is None or not unit_of_work.has_connection()):
+            connection = DBConnector.checkout_replica_connection()
+            if connection is not None:
+                return connection
+        if unit_of_work is not None:
+            return unit_of_work.connection()
+        return DBConnector.checkout_connection()
+
+    @staticmethod
+    def get_stream_connection():
+        # connection for a generator DAO method whose rows are read while the response is sent: it is the
+        # caller's own (give it back with release_connection when the generator ends), never the unit of work's,
+        # whose commit after the view would fail on the rows not read yet. What the unit of work did so far is
+        # committed and its connection given back first, so the request still holds one connection at a time
+        unit_of_work = DBConnector.current_unit_of_work.get()
+        if unit_of_work is not None and unit_of_work.has_connection():
+            if not unit_of_work.commit():
+                raise RuntimeError("Failed to commit the unit of work before streaming.")
+            unit_of_work.release()
+        if not DBConnector.read_from_primary.get():
+            connection = DBConnector.checkout_replica_connection()
+            if connection is not None:
+                return connection
+        return DBConnector.checkout_connection()
+
+    @staticmethod
+    def checkout_replica_connection():
+        # connection of a healthy replica, None if the caller has to use the primary
+        DBConnector._ensure_pool()
+        if DBConnector._replicas is None:
+            return None
+        return DBConnector._replicas.checkout()
+
+    @staticmethod
+    def _ensure_pool():
         if DBConnector._pool is None:
             logger.warning("Connection pool is not initialized. Initializing now.")
             try:
@@ -61,10 +186,66 @@ class DBConnector:
                 logger.error("Failed to initialize connection pool during get_connection: %s", e)
                 raise
 
+    @staticmethod
+    def checkout_connection():
+        # Ensure the pool is initialized
+        DBConnector._ensure_pool()
+
+        # waits in the pool queue when every connection is in use, raises PoolTimeoutError after the timeout
         try:
-            connection = DBConnector._pool.get_connection()
+            connection = DBConnector._pool.checkout()
             logger.info("Successfully obtained a connection from the pool.")
             return connection
         except Exception as e:
             logger.error("Failed to obtain a connection from the pool: %s", e)
             raise
+
+    @staticmethod
+    def after_commit(callback):
+        # run callback once the current write is really committed:
+        # at the end of the unit of work if there is one, right away otherwise (the DAO already committed)
+        unit_of_work = DBConnector.current_unit_of_work.get()
+        if unit_of_work is not None:
+            unit_of_work.after_commit(callback)
+        else:
+            callback()
+
+    @staticmethod
+    def after_transaction(callback):
+        # run callback once the current transaction ended, committed or rolled back:
+        # at the end of the unit of work if there is one, right away otherwise
+        unit_of_work = DBConnector.current_unit_of_work.get()
+        if unit_of_work is not None:
+            unit_of_work.after_transaction(callback)
+        else:
+            callback()
+
+    @staticmethod
+    def release_connection(connection):
+        # give a connection from get_connection back to the pool, safe to call with None
+        # no ping here, the pool checks health on checkout after the connection was idle for a while
+        if connection is not None:
+            connection.close()
+
+    @staticmethod
+    def pool_stats():
+        # live pool numbers: in use, idle, waiters, wait time and checkout duration histograms
+        if DBConnector._pool is None:
+            return None
+        return DBConnector._pool.stats()
+
+    @staticmethod
+    def has_replicas():
+        return DBConnector._replicas is not None
+
+    @staticmethod
+    def replica_stats():
+        # per replica: healthy, lag seen by the last check and its pool numbers
+        if DBConnector._replicas is None:
+            return {}
+        return DBConnector._replicas.stats()
+
+    @staticmethod
+    def query_stats():
+        # latency histogram of every statement run so far, keyed by normalized SQL
+        return query_stats.snapshot()
@@ -0,0 +1,56 @@
+import threading
+import time
+from config.settings import Settings
+from util.Cache import TTLCache
+
+
+class IdempotencyTimeoutError(Exception):
+    # another request with the same key is still running after the wait timeout
+    pass
+
+
+class IdempotencyStore:
+    """
+    Recent Idempotency-Key responses of this process, so a retried request is answered from memory.
+
+    The responses are kept in a bounded TTLCache (LRU past maxsize). A key is "in flight" while the first
+    request with it runs: acquire() makes a duplicate wait for it and then returns its stored response.
+    The database keeps the same keys (IdempotencyDAO), for duplicates that reach another process or
+    arrive after the entry was evicted here.
+    """
+
+    def __init__(self, maxsize, ttl, name="idempotency_cache"):
+        self._responses = TTLCache(maxsize=maxsize, ttl=ttl, name=name)
+        self._in_flight = {}  # key -> Event set when the request holding it is done
+        self._lock = threading.Lock()
+
+    def acquire(self, key, timeout):
+        # return the stored response of key, or None when the caller now holds the key and has to release() it
+        # raise IdempotencyTimeoutError if another request still holds it after timeout seconds
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                stored = self._responses.get(key)
+                if stored is not None:
+                    return stored
+                event = self._in_flight.get(key)
+                if event is None:
+                    self._in_flight[key] = threading.Event()
+                    return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                raise IdempotencyTimeoutError(f"Request with key {key} is still in progress.")
+            # the first request is done, its response is stored now unless it failed, then try to take the key
+
+    def put(self, key, stored):
+        self._responses.put(key, stored)
+
+    def release(self, key):
+        # wake up the duplicates waiting on key
+        with self._lock:
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+idempotency_store = IdempotencyStore(Settings.IdempotencyCacheMaxSize, Settings.IdempotencyKeyTTL)
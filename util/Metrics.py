@@ -0,0 +1,116 @@
+import bisect
+import threading
+
+
+class Histogram:
+    """
+    Fixed bucket histogram (seconds by default), cheap enough to observe on every request / query.
+    snapshot() returns cumulative bucket counts like a Prometheus histogram.
+    """
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = [], 0
+        for le, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((le, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+class RequestMetrics:
+    """
+    Per route request numbers for /metrics: count by status code, latency histogram and requests in flight.
+    Routes are the Flask url rules (e.g. "/product"), not the raw paths, so the number of series stays small.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}  # (method, route, status) -> count
+        self._latency = {}  # (method, route) -> Histogram
+        self._in_flight = {}  # (method, route) -> requests being served
+
+    def start(self, method, route):
+        key = (method, route)
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def finish(self, method, route, status, duration):
+        key = (method, route)
+        with self._lock:
+            self._in_flight[key] -= 1
+            count_key = (method, route, status)
+            self._counts[count_key] = self._counts.get(count_key, 0) + 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+        histogram.observe(duration)
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+            in_flight = dict(self._in_flight)
+            latency = dict(self._latency)
+        return {
+            "counts": counts,
+            "in_flight": in_flight,
+            "latency": {key: histogram.snapshot() for key, histogram in latency.items()},
+        }
+
+
+request_metrics = RequestMetrics()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class PrometheusWriter:
+    # builds the Prometheus text exposition format, one metric family at a time
+
+    def __init__(self):
+        self._lines = []
+
+    def metric(self, name, kind, help_text, samples):
+        # samples: iterable of (labels dict, value)
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self._lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name, help_text, snapshots):
+        # snapshots: iterable of (labels dict, Histogram.snapshot())
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} histogram")
+        for labels, snapshot in snapshots:
+            for le, count in snapshot["buckets"]:
+                bucket_labels = dict(labels, le="+Inf" if le == float("inf") else repr(le))
+                self._lines.append(f"{name}_bucket{_labels(bucket_labels)} {count}")
+            self._lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']}")
+            self._lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+
+    def render(self):
+        return "\n".join(self._lines) + "\n"
@@ -0,0 +1,93 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from config.settings import Settings
+
+# keep this module light: the worker processes import it to run _hashpw / _checkpw
+
+
+class HasherBusyError(Exception):
+    # too many passwords are being hashed / checked already, the caller should retry later
+    pass
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    """
+    bcrypt off the request threads: hashing and checking run on a small process pool of
+    Settings.BcryptWorkers processes (0 runs them inline, e.g. for tests).
+
+    At most Settings.BcryptMaxPending jobs are admitted at the same time, a caller that cannot get in
+    within Settings.BcryptAdmissionTimeout seconds gets HasherBusyError instead of holding a request
+    thread, so a login storm cannot starve the other routes.
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+    _admission = threading.BoundedSemaphore(Settings.BcryptMaxPending)
+
+    @staticmethod
+    def hash_password(password):
+        return PasswordHasher._run(_hashpw, password.encode('utf-8'), Settings.BcryptRounds).decode('utf-8')
+
+    @staticmethod
+    def check_password(password, hashed):
+        return PasswordHasher._run(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    @staticmethod
+    def needs_rehash(hashed):
+        # "$2b$12$..." -> stored with cost 12, rehash when Settings.BcryptRounds is different
+        try:
+            return int(hashed.split('$')[2]) != Settings.BcryptRounds
+        except (IndexError, ValueError):
+            return True
+
+    @staticmethod
+    def shutdown():
+        # stop the worker processes, a new pool is started on next use (e.g. in a forked worker)
+        with PasswordHasher._executor_lock:
+            executor, PasswordHasher._executor = PasswordHasher._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def reset_after_fork():
+        # in a forked worker the parent's hashing processes are not ours to use or stop, start a new pool on next use
+        PasswordHasher._executor = None
+        PasswordHasher._executor_lock = threading.Lock()
+        PasswordHasher._admission = threading.BoundedSemaphore(Settings.BcryptMaxPending)
+
+    @staticmethod
+    def _run(function, *args):
+        if not PasswordHasher._admission.acquire(timeout=Settings.BcryptAdmissionTimeout):
+            raise HasherBusyError("Too many password checks in progress.")
+        try:
+            if Settings.BcryptWorkers <= 0:
+                return function(*args)
+            try:
+                return PasswordHasher._get_executor().submit(function, *args).result()
+            except BrokenProcessPool:
+                # a worker died (e.g. killed by the OS), start a new pool and try once more
+                PasswordHasher.shutdown()
+                return PasswordHasher._get_executor().submit(function, *args).result()
+        finally:
+            PasswordHasher._admission.release()
+
+    @staticmethod
+    def _get_executor():
+        with PasswordHasher._executor_lock:
+            if PasswordHasher._executor is None:
+                # spawn: forking a process that already runs threads (log listeners, pool users) is not safe
+                PasswordHasher._executor = ProcessPoolExecutor(
+                    max_workers=Settings.BcryptWorkers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return PasswordHasher._executor
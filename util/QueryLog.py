@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+from config.settings import Settings
+from util.Metrics import Histogram
+from log.log import get_logger
+
+slow_query_logger = get_logger("mysql.slow_query", is_mysql=True)
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\([A-Za-z_]\w*\)s")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(operation):
+    # one key per statement shape: literals and placeholders become ?, IN lists of any length are the same
+    sql = _STRING.sub("?", operation)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class QueryStats:
+    """
+    Latency histogram per normalized statement, for every query run through an InstrumentedCursor.
+    At most max_statements different statements are kept, the rest are counted under "other".
+    """
+
+    OTHER = "other"
+
+    def __init__(self, max_statements=500):
+        self.max_statements = max_statements
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, sql, duration):
+        histogram = self._histograms.get(sql)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(sql)
+                if histogram is None:
+                    if len(self._histograms) >= self.max_statements:
+                        sql = QueryStats.OTHER
+                    histogram = self._histograms.setdefault(sql, Histogram())
+        histogram.observe(duration)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {sql: histogram.snapshot() for sql, histogram in histograms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+
+
+query_stats = QueryStats(Settings.QueryStatsMaxStatements)
+
+
+class InstrumentedCursor:
+    """
+    Wraps a mysql cursor and times each statement: execute / executemany plus the fetches of its rows.
+    The time is recorded in query_stats once the statement is done (rows all fetched, next execute,
+    cursor closed or dropped). Statements slower than Settings.SlowQueryThreshold seconds are written
+    to mysql.log with their row count, the parameter values are never logged.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None  # [sql, parameter count, elapsed, rows] of the statement being timed
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        # DAOs stream with "for row in cursor", fetch through fetchone so the rows are timed too
+        return iter(self.fetchone, None)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._timed(operation, params, self._cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        return self._timed(operation, seq_params, self._cursor.executemany, operation, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        self._count_rows(0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._fetch(self._cursor.fetchmany, size)
+        self._count_rows(len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        self._count_rows(len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __del__(self):
+        self._finish()
+
+    def _timed(self, operation, params, method, *args, **kwargs):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            count = len(params) if isinstance(params, (list, tuple, dict)) else 0
+            self._statement = [operation, count, time.perf_counter() - start, 0]
+            if not getattr(self._cursor, "with_rows", False):
+                # no result set (insert / update / delete): done, rowcount is the number of rows changed
+                self._statement[3] = self._cursor.rowcount
+                self._finish()
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - start
+
+    def _count_rows(self, rows, exhausted):
+        if self._statement is not None:
+            self._statement[3] += rows
+            if exhausted:
+                self._finish()
+
+    def _finish(self):
+        statement, self._statement = self.__dict__.get("_statement"), None
+        if statement is None:
+            return
+        operation, param_count, elapsed, rows = statement
+        sql = normalize_sql(operation)
+        query_stats.observe(sql, elapsed)
+        if elapsed >= Settings.SlowQueryThreshold:
+            slow_query_logger.warning("Slow query (%.3fs, %s rows, %s parameters redacted): %s",
+                                      elapsed, rows, param_count, sql)
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+from config.settings import Settings
+
+
+class RateLimiter:
+    """
+    Token bucket per (route class, user). Each route class ("read", "write", "admin") has its own rate
+    (tokens added per second) and burst (bucket size), a rate of 0 turns the limit off for that class.
+
+    Buckets of at most max_keys users are kept, the least recently used one is dropped beyond that
+    (it starts full again next time). Allowed / limited counters per class are kept for /metrics.
+    """
+
+    def __init__(self, limits, max_keys=10000):
+        self.limits = limits  # route class -> (rate, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # (route class, user) -> (tokens, updated_at)
+        self._lock = threading.Lock()
+        self.allowed = {route_class: 0 for route_class in limits}
+        self.limited = {route_class: 0 for route_class in limits}
+
+    def acquire(self, route_class, user):
+        # take one token, return 0 if the request may go on, otherwise the seconds until the next token
+        rate, burst = self.limits[route_class]
+        with self._lock:
+            if rate <= 0:
+                self.allowed[route_class] += 1
+                return 0
+            now = time.monotonic()
+            key = (route_class, user)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+                self.allowed[route_class] += 1
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+                self.limited[route_class] += 1
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                route_class: {"rate": rate, "burst": burst, "allowed": self.allowed[route_class],
+                              "limited": self.limited[route_class]}
+                for route_class, (rate, burst) in self.limits.items()
+            }
+
+
+rate_limiter = RateLimiter({
+    "read": (Settings.RateLimitReadRate, Settings.RateLimitReadBurst),
+    "write": (Settings.RateLimitWriteRate, Settings.RateLimitWriteBurst),
+    "admin": (Settings.RateLimitAdminRate, Settings.RateLimitAdminBurst),
+}, max_keys=Settings.RateLimitMaxUsers)
@@ -0,0 +1,112 @@
+import itertools
+import threading
+import time
+import mysql.connector
+from util.ConnectionPool import PoolTimeoutError
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class Replica:
+    """
+    A read replica: its connection pool and the replication lag seen by the last health check.
+
+    The check runs at most every check_interval seconds on a background thread, one at a time, so a slow
+    or unreachable replica never holds up a request; callers use the last result. A replica that was never
+    checked, cannot be reached, does not replicate or is more than max_lag seconds behind is not used until
+    a later check finds it healthy. DBConnector.warm_up checks them once before the process takes requests.
+    """
+
+    def __init__(self, pool, max_lag, check_interval):
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.healthy = False
+        self.checked_at = None  # never checked, the first caller checks it
+        self._checking = threading.Lock()
+
+    def is_healthy(self):
+        stale = self.checked_at is None or time.monotonic() - self.checked_at > self.check_interval
+        if stale and self._checking.acquire(blocking=False):
+            threading.Thread(target=self._check_in_background, name=f"{self.pool.name}-check", daemon=True).start()
+        return self.healthy
+
+    def _check_in_background(self):
+        try:
+            self.check()
+        finally:
+            self._checking.release()
+
+    def check(self):
+        connection = None
+        try:
+            connection = self.pool.checkout()
+            lag = self._replication_lag(connection)
+            if lag is None:
+                logger.warning("Replica %s is not replicating, reads go to the primary.", self.pool.name)
+            elif lag > self.max_lag:
+                logger.warning("Replica %s is %ss behind, reads go to the primary.", self.pool.name, lag)
+        except PoolTimeoutError:
+            # every connection is busy serving reads, keep the last result and check again next interval
+            self.checked_at = time.monotonic()
+            return
+        except mysql.connector.Error as e:
+            logger.warning("Health check of replica %s failed: %s", self.pool.name, e)
+            lag = None
+        finally:
+            if connection is not None:
+                connection.close()
+        self.lag = lag
+        self.healthy = lag is not None and lag <= self.max_lag
+        self.checked_at = time.monotonic()
+
+    def mark_down(self, error):
+        # a checkout failed, skip the replica until the next check
+        logger.warning("Replica %s failed, reads go to the primary: %s", self.pool.name, error)
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    @staticmethod
+    def _replication_lag(connection):
+        # seconds behind the primary, None if replication is not running
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            cursor.execute("SHOW SLAVE STATUS")  # MySQL before 8.0.22
+        rows = cursor.fetchall()  # one row per replication channel
+        cursor.close()
+        lags = [row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master")) for row in rows]
+        if not lags or None in lags:
+            return None
+        return max(lags)
+
+
+class ReplicaSet:
+    """
+    The read replicas of DBConnector. checkout() hands out a connection of a healthy replica,
+    going round robin over them, or None so the caller reads from the primary.
+    """
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._next = itertools.count()
+
+    def checkout(self):
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            if not replica.is_healthy():
+                continue
+            try:
+                return replica.pool.checkout(timeout=0)
+            except PoolTimeoutError:
+                continue  # this one is busy, try the next one instead of waiting, the primary is the last resort
+            except mysql.connector.Error as e:
+                replica.mark_down(e)
+        return None
+
+    def stats(self):
+        return {replica.pool.name: {"healthy": replica.healthy, "lag": replica.lag, **replica.pool.stats()}
+                for replica in self.replicas}
@@ -0,0 +1,191 @@
+from util.DatabaseConnection import DBConnector
+from util.ConnectionPool import PoolTimeoutError
+from log.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class _UnitOfWorkConnection:
+    """
+    Connection handed to DAOs inside a unit of work. DAOs keep their usual code, but:
+    close() does not give the connection back, commit() is deferred to the end of the unit of work,
+    start_transaction() is a no-op (the unit of work is already one transaction) and rollback()
+    rolls back and marks the whole unit of work rollback only.
+    """
+
+    def __init__(self, unit_of_work, connection):
+        self._unit_of_work = unit_of_work
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def start_transaction(self, *args, **kwargs):
+        pass
+
+    def rollback(self):
+        self._unit_of_work.rollback_only = True
+        self._connection.rollback()
+
+
+class UnitOfWork:
+    """
+    Shares one pooled connection and one transaction across every DAO call made inside it.
+
+        with UnitOfWork():
+            user = UserDAO.get_user_by_id(user_id)
+            UserDAO.delete_user_by_id(user_id)
+
+    The connection is only checked out on the first DAO call. Leaving the block commits, or rolls back
+    if it raised or a DAO rolled back, then gives the connection back. A unit of work opened while
+    another one is active joins it. Every Flask request runs in one, see app.py: it is committed
+    in after_request and released in teardown_request.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._joined = None
+        self._after_commit = []
+        self._after_transaction = []
+        self.rollback_only = False
+        self.pool_exhausted = False  # a checkout failed because the pool was saturated
+
+    @staticmethod
+    def current():
+        return DBConnector.current_unit_of_work.get()
+
+    def has_connection(self):
+        return self._connection is not None
+
+    def connection(self):
+        if self._connection is None:
+            try:
+                self._connection = _UnitOfWorkConnection(self, DBConnector.checkout_connection())
+            except PoolTimeoutError:
+                # the DAO turns it into its usual failure result, the request answers 503 anyway (see app.py)
+                self.pool_exhausted = True
+                raise
+        return self._connection
+
+    def after_commit(self, callback):
+        # run callback once the transaction is really committed, e.g. to invalidate caches
+        self._after_commit.append(callback)
+
+    def after_transaction(self, callback):
+        # run callback once the transaction ended, committed or rolled back: e.g. to drop what a reader
+        # cached from its uncommitted writes
+        self._after_transaction.append(callback)
+
+    def commit(self):
+        # commit what was done so far (or roll it back if rollback only), the connection stays bound
+        # return False if the commit failed
+        if self._connection is None:
+            return True
+        callbacks, self._after_commit = self._after_commit, []
+        try:
+            if self.rollback_only:
+                self._connection._connection.rollback()
+                callbacks = []
+            else:
+                self._connection._connection.commit()
+        except Exception as e:
+            logger.error("Failed to commit unit of work: %s", e)
+            self._rollback_quietly()
+            self._end_transaction()
+            return False
+        for callback in callbacks:
+            callback()
+        self._end_transaction()
+        return True
+
+    def release(self):
+        # roll back anything not committed and give the connection back to the pool
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            DBConnector.release_connection(connection._connection)  # the pool rolls back an open transaction
+        self._after_commit = []
+        self._end_transaction()
+        self.rollback_only = False
+
+    def __enter__(self):
+        outer = UnitOfWork.current()
+        if outer is not None:
+            self._joined = outer
+            return outer
+        DBConnector.current_unit_of_work.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._joined is not None:
+            if exc_type is not None:
+                self._joined.rollback_only = True
+            self._joined = None
+            return False
+        try:
+            if exc_type is not None:
+                self.rollback_only = True
+            self.commit()
+        finally:
+            self.release()
+            DBConnector.current_unit_of_work.set(None)
+        return False
+
+    @staticmethod
+    def begin_request():
+        # called before every request, no connection is taken until a DAO needs one
+        DBConnector.current_unit_of_work.set(UnitOfWork())
+
+    @staticmethod
+    def request_pool_exhausted():
+        # True if a DAO call of the current request could not get a connection from the saturated pool
+        unit_of_work = UnitOfWork.current()
+        return unit_of_work is not None and unit_of_work.pool_exhausted
+
+    @staticmethod
+    def commit_request():
+        # called after the view returned, return False if the commit failed
+        unit_of_work = UnitOfWork.current()
+        return unit_of_work.commit() if unit_of_work is not None else True
+
+    @staticmethod
+    def rollback_request():
+        # called after a view raised or answered 5xx, nothing it wrote is kept
+        unit_of_work = UnitOfWork.current()
+        if unit_of_work is not None:
+            unit_of_work.rollback_only = True
+            unit_of_work.commit()  # rolls back, after commit callbacks are dropped, after transaction ones run
+
+    @staticmethod
+    def end_request(exc=None):
+        # called on request teardown, also after a streamed response finished
+        unit_of_work = UnitOfWork.current()
+        if unit_of_work is not None:
+            if exc is not None:
+                logger.warning("Request failed, rolling back unit of work: %s", exc)
+            unit_of_work.release()
+        DBConnector.current_unit_of_work.set(None)
+
+    @staticmethod
+    def commit_and_release():
+        # commit what the current unit of work did so far and give its connection back before a slow step
+        # that does not need the database (e.g. bcrypt), the next DAO call checks out a connection again
+        unit_of_work = UnitOfWork.current()
+        if unit_of_work is not None and unit_of_work.commit():
+            unit_of_work.release()
+
+    def _end_transaction(self):
+        callbacks, self._after_transaction = self._after_transaction, []
+        for callback in callbacks:
+            callback()
+
+    def _rollback_quietly(self):
+        try:
+            self._connection._connection.rollback()
+        except Exception:
+            pass
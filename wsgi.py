@@ -0,0 +1,29 @@
+from app import app
+import controller.Controller  # registers the routes
+from log.log import restart_listeners, stop_listeners
+from service.ImageService import ImageService
+from util.DatabaseConnection import DBConnector
+from util.PasswordHasher import PasswordHasher
+
+# production entry point: gunicorn -c gunicorn.conf.py wsgi:app (main.py runs the development server)
+
+
+def init_worker():
+    # in every worker right after the fork, before it accepts requests (post_fork in gunicorn.conf.py):
+    # nothing the parent started is usable here, start over, open the pool connections and build the images
+    restart_listeners()
+    DBConnector.reset_after_fork()
+    PasswordHasher.reset_after_fork()
+    DBConnector.warm_up()
+    # image entries of every product, so request threads find them. In the background: with a big catalog the
+    # first build takes longer than the worker may take to start (the files are shared, only the first worker
+    # builds anything)
+    ImageService.submit_build_all()
+
+
+def shutdown_worker():
+    # when a worker exits after its last request (worker_exit in gunicorn.conf.py)
+    ImageService.shutdown()
+    PasswordHasher.shutdown()
+    DBConnector.close_pools()
+    stop_listeners()